@@ -0,0 +1,536 @@
+import collections
+import io
+import mmap
+import threading
+import numpy as np
+import soundfile as sf
+
+from spill import SpillFile
+
+# Margen extra (en segundos) por encima de replay_time.
+# Es la zona donde escribe el hilo de captura mientras alguien copia un snapshot.
+REPLAY_MARGIN_SECONDS = 2.0
+# Con desborde a disco el margen es más largo (solo ocupa fichero): los guardados leen el clip
+# del anillo por trozos mientras se sigue escribiendo encima (AudioRangeReader)
+SPILL_MARGIN_SECONDS = 30.0
+# Trozo que decodifica AudioRangeReader en cada paso (~1 s a 48 kHz)
+READER_CHUNK_FRAMES = 48000
+
+# Formatos del audio en RAM. Los snapshots siempre salen en float32 (mismo API para todos).
+#   float32: 8 bytes/muestra estéreo, sin conversión
+#   int16:   4 bytes, calidad CD (de sobra para voz y juego)
+#   int24:   6 bytes (3 por muestra, empaquetado), calidad de estudio
+#   flac:    int24 comprimido sin pérdidas por bloque (~40-60% de int24 según el contenido)
+SAMPLE_FORMATS = ("float32", "int16", "int24", "flac")
+_INT16_SCALE = 32767.0
+_INT24_SCALE = 8388607.0
+
+
+def _encode_int24(block):
+    """float32 (n, ch) -> uint8 (n, ch, 3): el int32 desplazado 8 bits, sin el byte bajo."""
+    v = (np.clip(block, -1.0, 1.0) * _INT24_SCALE).astype(np.int32) << 8
+    return v.view(np.uint8).reshape(block.shape + (4,))[..., 1:]
+
+
+def _decode_int24(raw, out, chunk=65536):
+    """
+    uint8 (n, ch, 3) -> float32 en `out`. El byte alto se lee como int8 para recuperar el signo.
+    Por trozos: así los temporales int32 no duplican la RAM de un snapshot de varios minutos.
+    """
+    for i in range(0, len(raw), chunk):
+        part = raw[i:i + chunk]
+        v = part[..., 2].view(np.int8).astype(np.int32) << 16
+        v |= part[..., 1].astype(np.int32) << 8
+        v |= part[..., 0]
+        np.multiply(v, 1.0 / _INT24_SCALE, out=out[i:i + chunk], casting="unsafe")
+
+
+class AudioRingBuffer:
+    """
+    Búfer circular PREASIGNADO para el modo Replay (float32, int16 o int24, ver SAMPLE_FORMATS).
+    La memoria se reserva una sola vez al crearlo: replay_time + un margen pequeño.
+    El lock solo protege el cursor de escritura (dos enteros), nunca la copia de datos,
+    así el hilo de captura no se queda esperando mientras se guarda un clip.
+
+    Cada bloque se sella con el reloj compartido (time.monotonic() al terminar de capturarlo).
+    Con esos sellos se traduce tiempo -> muestra y se puede recortar el audio a la misma
+    ventana que el vídeo (snapshot_range) sin pasadas de -sseof en FFmpeg.
+
+    Con `spill_path` el anillo vive en un fichero mapeado (spill.SpillFile) en vez de en RAM:
+    los últimos `ram_seconds` se quedan residentes y lo anterior se suelta de la memoria del
+    proceso cada segundo. Para buffers de 30-60 minutos sin que crezca el RSS.
+
+    Los tramos de silencio de una pista con puerta (write_silence) no se copian: el anillo en RAM
+    está en memoria anónima mapeada y sus páginas se devuelven al sistema con madvise(DONTNEED),
+    que las deja a cero. Los tramos se apuntan en `silent_runs` para que un guardado los salte.
+    """
+    def __init__(self, duration, samplerate=48000, channels=2, margin=REPLAY_MARGIN_SECONDS, sample_format="float32",
+                 spill_path=None, ram_seconds=None):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.window_frames = max(1, int(duration * samplerate))
+        self.margin_frames = max(1, int(margin * samplerate))
+        self.capacity = self.window_frames + self.margin_frames
+        self.spill = None
+        self.ram_frames = int(ram_seconds * samplerate) if ram_seconds else None
+        self._unreleased = 0
+        self._anon = None
+        self._alloc()
+        if spill_path is not None:
+            self._map_to_disk(spill_path)
+
+        self.lock = threading.Lock()
+        self.write_pos = 0
+        self.total_frames = 0
+        # Tamaño del último bloque: es lo que puede estar escribiéndose "en vuelo"
+        self._block_hint = 0
+        # Sellos de tiempo por bloque: (total_frames al acabar el bloque, time.monotonic())
+        self.stamps = collections.deque()
+        # Tramos de silencio de la puerta: [inicio, fin) en muestras absolutas, solo los que siguen en el anillo
+        self.silent_runs = collections.deque()
+        self.silent_frames = 0
+
+    def _alloc(self):
+        if self.sample_format == "int16":
+            shape, dtype = (self.capacity, self.channels), np.int16
+        elif self.sample_format == "int24":
+            shape, dtype = (self.capacity, self.channels, 3), np.uint8
+        else:
+            shape, dtype = (self.capacity, self.channels), np.float32
+        # Memoria anónima mapeada (ya a cero, como np.zeros): permite soltar páginas de silencio.
+        # Privada: con MAP_SHARED (lo que da mmap por defecto) DONTNEED no libera ni pone a cero
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if hasattr(mmap, "MAP_PRIVATE"):
+            self._anon = mmap.mmap(-1, nbytes, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+        else:
+            self._anon = mmap.mmap(-1, nbytes)
+        self.data = np.frombuffer(self._anon, dtype=dtype).reshape(shape)
+
+    def _map_to_disk(self, spill_path):
+        """Mueve el array del anillo a un fichero mapeado con la misma forma y tipo."""
+        shape, dtype = self.data.shape, self.data.dtype
+        # El mapeo anónimo no llegó a tocarse: no ocupa RAM, lo suelta el GC con el array
+        self._anon = None
+        self.spill = SpillFile(spill_path, self.data.nbytes)
+        self.data = np.frombuffer(self.spill.mm, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def _release_old(self, n):
+        """Suelta de RAM lo que ya queda más atrás de `ram_frames` (a trozos de ~1 s)."""
+        self._unreleased += n
+        if self._unreleased < self.samplerate: return
+        frame_bytes = self.data.strides[0]
+        start = (self.total_frames - self.ram_frames - self._unreleased) % self.capacity
+        self.spill.release(start * frame_bytes, self._unreleased * frame_bytes)
+        self._unreleased = 0
+
+    def close(self):
+        """Libera el fichero de desborde (si lo hay)."""
+        if self.spill is not None:
+            self.data = None
+            self.spill.close()
+            self.spill = None
+
+    def _encode(self, block):
+        if self.sample_format == "int16":
+            return (np.clip(block, -1.0, 1.0) * _INT16_SCALE).astype(np.int16)
+        if self.sample_format == "int24":
+            return _encode_int24(block)
+        return block
+
+    def _decode_into(self, out, raw):
+        if self.sample_format == "int16":
+            np.multiply(raw, 1.0 / _INT16_SCALE, out=out, casting="unsafe")
+        elif self.sample_format == "int24":
+            _decode_int24(raw, out)
+        else:
+            out[:] = raw
+
+    @property
+    def nbytes(self):
+        """Memoria que ocupa el audio guardado (con desborde a disco, solo la parte residente)."""
+        if self.spill is not None and self.ram_frames:
+            return min(self.data.nbytes, self.ram_frames * self.data.strides[0])
+        if self._releases_pages():
+            return self.data.nbytes - self.silent_frames * self.data.strides[0]
+        return self.data.nbytes
+
+    def _releases_pages(self):
+        return self._anon is not None and hasattr(self._anon, "madvise") and hasattr(mmap, "MADV_DONTNEED")
+
+    def _zero(self, pos, n):
+        """Pone a cero [pos, pos+n) del anillo. En RAM anónima, las páginas completas se devuelven al sistema."""
+        if not self._releases_pages():
+            self.data[pos:pos + n] = 0
+            return
+        stride, page = self.data.strides[0], mmap.PAGESIZE
+        start, end = pos * stride, (pos + n) * stride
+        first = -(-start // page) * page
+        last = end // page * page
+        if last <= first:
+            self.data[pos:pos + n] = 0
+            return
+        # Bordes que no llenan una página: a mano; el resto vuelve a cero con madvise
+        head = -(-(first - start) // stride)
+        tail = (end - last) // stride + (1 if (end - last) % stride else 0)
+        self.data[pos:pos + head] = 0
+        self.data[pos + n - tail:pos + n] = 0
+        try:
+            self._anon.madvise(mmap.MADV_DONTNEED, first, last - first)
+        except (OSError, ValueError):
+            self.data[pos:pos + n] = 0
+
+    def _mark_silent(self, start, end):
+        """Apunta [start, end) como silencio de la puerta (bajo el lock), uniéndolo al tramo anterior."""
+        if self.silent_runs and self.silent_runs[-1][1] == start:
+            self.silent_runs[-1][1] = end
+        else:
+            self.silent_runs.append([start, end])
+        self.silent_frames += end - start
+
+    def _prune_silent(self):
+        """Olvida los tramos que ya han salido del anillo (bajo el lock)."""
+        oldest = self.total_frames - self.capacity
+        while self.silent_runs and self.silent_runs[0][0] < oldest:
+            run = self.silent_runs[0]
+            cut = min(run[1], oldest) - run[0]
+            self.silent_frames -= cut
+            run[0] += cut
+            if run[0] >= run[1]: self.silent_runs.popleft()
+
+    def is_silent(self, first, last):
+        """¿Es [first, last) entero silencio de la puerta? Un guardado puede saltarse la copia."""
+        if last <= first: return False
+        with self.lock:
+            return any(start <= first and last <= end for start, end in self.silent_runs)
+
+    def _fit_channels(self, block):
+        """Adapta bloques mono o multicanal (5.1, 7.1...) al número de canales del búfer."""
+        if block.ndim == 1:
+            block = block[:, None]
+        ch = block.shape[1]
+        if ch == self.channels:
+            return block
+        if ch == 1:
+            return np.repeat(block, self.channels, axis=1)
+        if ch > self.channels:
+            return block[:, :self.channels]
+        return np.pad(block, ((0, 0), (0, self.channels - ch)))
+
+    def write(self, block, timestamp=None):
+        """
+        Copia un bloque en el anillo. Solo lo llama el hilo de captura.
+        `timestamp`: time.monotonic() en el que se capturó la última muestra del bloque.
+        """
+        n = len(block)
+        if n == 0: return
+        block = self._fit_channels(block)
+        self._block_hint = n
+
+        # Si el bloque es más grande que el anillo, solo caben sus últimas muestras
+        data = self._encode(block[-self.capacity:] if n > self.capacity else block)
+        m = len(data)
+        pos = (self.write_pos + (n - m)) % self.capacity
+
+        first = min(m, self.capacity - pos)
+        self.data[pos:pos + first] = data[:first]
+        if first < m:
+            self.data[:m - first] = data[first:]
+
+        self._publish(pos + m, n, timestamp)
+
+    def _publish(self, end_pos, n, timestamp, silent=False):
+        # Publicamos el nuevo cursor (sección crítica mínima)
+        with self.lock:
+            self.write_pos = end_pos % self.capacity
+            if silent: self._mark_silent(self.total_frames, self.total_frames + n)
+            self.total_frames += n
+            if timestamp is not None:
+                self.stamps.append((self.total_frames, timestamp))
+                # Solo interesan los sellos de lo que sigue en el anillo
+                while self.stamps[0][0] <= self.total_frames - self.capacity:
+                    self.stamps.popleft()
+            if self.silent_runs: self._prune_silent()
+        if self.spill is not None and self.ram_frames and self.total_frames > self.ram_frames:
+            self._release_old(n)
+
+    def write_silence(self, n, timestamp=None):
+        """Como write() con `n` muestras a cero, sin copiar nada (silencio de la puerta)."""
+        if n <= 0: return
+        self._block_hint = n
+        m = min(n, self.capacity)
+        pos = (self.write_pos + (n - m)) % self.capacity
+        first = min(m, self.capacity - pos)
+        self._zero(pos, first)
+        if first < m:
+            self._zero(0, m - first)
+        self._publish(pos + m, n, timestamp, silent=True)
+
+    def clear(self):
+        with self.lock:
+            self.write_pos = 0
+            self.total_frames = 0
+            self.stamps.clear()
+            self.silent_runs.clear()
+            self.silent_frames = 0
+
+    def _clock_anchor(self, stamps):
+        """
+        Instante (reloj monotonic) de la muestra absoluta 0, suponiendo ritmo nominal.
+        Cada sello llega algo tarde (planificación del hilo); el mínimo es el más fiel.
+        """
+        return min(t - frames / self.samplerate for frames, t in stamps)
+
+    def _copy_range(self, start, n, end_total, pos):
+        """
+        Copia `n` muestras desde la absoluta `start`; `end_total`/`pos` son el cursor leído
+        bajo el lock. Fuera del lock: si el escritor pisa el principio mientras copiamos, se recorta.
+        """
+        out = np.empty((n, self.channels), dtype=np.float32)
+        ring_start = (pos - (end_total - start)) % self.capacity
+        first = min(n, self.capacity - ring_start)
+        self._decode_into(out[:first], self.data[ring_start:ring_start + first])
+        if first < n:
+            self._decode_into(out[first:], self.data[:n - first])
+
+        # Si durante la copia el hilo de captura se comió el margen, la cabeza puede estar pisada.
+        # Con el margen por defecto (2 s) no pasa nunca, pero lo comprobamos y recortamos.
+        with self.lock:
+            advanced = self.total_frames - end_total
+        overrun = advanced + self._block_hint - (self.capacity - (end_total - start))
+        if overrun > 0:
+            out = out[overrun:]
+        return out
+
+    def _oldest_frame(self, end_total):
+        """Primera muestra absoluta que se puede leer sin riesgo de que el escritor la pise."""
+        return max(0, end_total - self.capacity + self._block_hint)
+
+    def get_snapshot(self, max_frames=None):
+        """
+        Devuelve una COPIA de los últimos `replay_time` segundos (o `max_frames`).
+        Son dos copias de slices sobre un array de salida; el lock solo se usa para leer el cursor.
+        """
+        with self.lock:
+            end_total = self.total_frames
+            pos = self.write_pos
+
+        limit = self.window_frames if max_frames is None else min(max_frames, self.capacity)
+        n = min(end_total, limit)
+        if n <= 0: return None
+        out = self._copy_range(end_total - n, n, end_total, pos)
+        return out if len(out) else None
+
+    def _frames_for(self, t_start, t_end, stamps, end_total):
+        anchor = self._clock_anchor(stamps)
+        first = int(round((t_start - anchor) * self.samplerate))
+        last = min(int(round((t_end - anchor) * self.samplerate)), end_total)
+        return first, last
+
+    def frame_range(self, t_start, t_end):
+        """Muestras absolutas [first, last) capturadas entre t_start y t_end, o None sin sellos."""
+        with self.lock:
+            end_total = self.total_frames
+            stamps = list(self.stamps)
+        if not stamps: return None
+        return self._frames_for(t_start, t_end, stamps, end_total)
+
+    def snapshot_range(self, t_start, t_end):
+        """
+        COPIA de las muestras capturadas entre t_start y t_end (reloj time.monotonic()).
+        Si el búfer no llega tan atrás, el principio se rellena con silencio para que la
+        primera muestra siga cayendo en t_start; por el final se corta en lo que haya.
+        Devuelve None si no hay sellos de tiempo (bloques escritos sin timestamp).
+        """
+        with self.lock:
+            end_total = self.total_frames
+            pos = self.write_pos
+            stamps = list(self.stamps)
+        if not stamps: return None
+        first, last = self._frames_for(t_start, t_end, stamps, end_total)
+        return self._snapshot_frames(first, last, end_total, pos)
+
+    def reader_range(self, t_start, t_end):
+        """
+        Como snapshot_range() pero sin copiar: un AudioRangeReader que decodifica el tramo por
+        trozos cuando se lee. Para anillos en disco, donde una copia entera serían gigas.
+        """
+        with self.lock:
+            end_total = self.total_frames
+            stamps = list(self.stamps)
+        if not stamps: return None
+        first, last = self._frames_for(t_start, t_end, stamps, end_total)
+        if last <= first: return None
+        return AudioRangeReader(self, first, last)
+
+    def _safe_from(self):
+        """Primera muestra absoluta que el escritor aún no puede pisar (según el cursor de ahora)."""
+        with self.lock:
+            end_total = self.total_frames
+        return self._oldest_frame(end_total)
+
+    def snapshot_frames(self, first, last):
+        """COPIA de las muestras absolutas [first, last), con silencio delante si ya no están."""
+        with self.lock:
+            end_total = self.total_frames
+            pos = self.write_pos
+        return self._snapshot_frames(first, min(last, end_total), end_total, pos)
+
+    def _snapshot_frames(self, first, last, end_total, pos):
+        if last <= first: return None
+        oldest = self._oldest_frame(end_total)
+        start = max(first, oldest)
+        data = self._copy_range(start, last - start, end_total, pos) if last > start else None
+        pad = (last - first) - (len(data) if data is not None else 0)
+        if pad <= 0: return data
+        silence = np.zeros((pad, self.channels), dtype=np.float32)
+        return silence if data is None else np.concatenate((silence, data))
+
+
+class CompressedAudioRing(AudioRingBuffer):
+    """
+    Variante comprimida: cada bloque se codifica a FLAC (24 bits) al llegar y se guarda como
+    bytes inmutables en una cola; se descartan bloques enteros por antigüedad.
+    Los snapshots decodifican solo los bloques que tocan y salen en float32 como en el anillo.
+    No hay zona "en vuelo": un bloque publicado ya no cambia, así que no hace falta margen.
+    """
+    def _alloc(self):
+        self.blocks = collections.deque()   # (muestra_absoluta_inicial, muestras, bytes FLAC)
+        self._nbytes = 0
+
+    def _encode(self, block):
+        buf = io.BytesIO()
+        sf.write(buf, block, self.samplerate, format="FLAC", subtype="PCM_24")
+        return buf.getvalue()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def write(self, block, timestamp=None):
+        n = len(block)
+        if n == 0: return
+        # La codificación va fuera del lock; bajo el lock solo se publica el bloque
+        self._append(n, self._encode(self._fit_channels(block)), timestamp)
+
+    def write_silence(self, n, timestamp=None):
+        """Silencio de la puerta: un bloque sin datos (payload None), que se lee como ceros."""
+        if n <= 0: return
+        self._append(n, None, timestamp)
+
+    def _append(self, n, payload, timestamp):
+        size = len(payload) if payload is not None else 0
+        with self.lock:
+            self.blocks.append((self.total_frames, n, payload))
+            self._nbytes += size
+            if payload is None: self._mark_silent(self.total_frames, self.total_frames + n)
+            self.total_frames += n
+            while self.blocks and self.blocks[0][0] + self.blocks[0][1] <= self.total_frames - self.capacity:
+                old = self.blocks.popleft()[2]
+                if old is not None: self._nbytes -= len(old)
+            if timestamp is not None:
+                self.stamps.append((self.total_frames, timestamp))
+                while self.stamps[0][0] <= self.total_frames - self.capacity:
+                    self.stamps.popleft()
+            if self.silent_runs: self._prune_silent()
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self._nbytes = 0
+            self.total_frames = 0
+            self.stamps.clear()
+            self.silent_runs.clear()
+            self.silent_frames = 0
+
+    def _oldest_frame(self, end_total):
+        with self.lock:
+            return self.blocks[0][0] if self.blocks else end_total
+
+    def _copy_range(self, start, n, end_total, pos):
+        out = np.zeros((n, self.channels), dtype=np.float32)
+        with self.lock:
+            blocks = [b for b in self.blocks if b[0] + b[1] > start and b[0] < start + n]
+        for b_start, b_len, payload in blocks:
+            if payload is None: continue   # Silencio: ya está a cero
+            data, _ = sf.read(io.BytesIO(payload), dtype="float32", always_2d=True)
+            lo, hi = max(start, b_start), min(start + n, b_start + b_len)
+            out[lo - start:hi - start] = data[lo - b_start:hi - b_start]
+        # Si se descartó el principio mientras tanto, se devuelve desde el primer bloque que quedaba
+        first = blocks[0][0] if blocks else start + n
+        return out[max(0, first - start):]
+
+
+class AudioRangeReader:
+    """
+    Tramo [first, last) de un AudioRingBuffer leído a trozos de float32 (chunks()), sin copiarlo
+    entero: así un guardado de una hora desde el anillo en disco no sube el RSS. Cada trozo se
+    decodifica en el mismo búfer justo cuando el mux lo pide.
+    Lo que ya no está (antes del inicio del anillo, o pisado por el escritor porque el guardado
+    esperó demasiado en la cola) sale como silencio del mismo largo, así la pista no se desplaza.
+    """
+    def __init__(self, ring, first, last, chunk_frames=READER_CHUNK_FRAMES):
+        self.ring = ring
+        # Referencia propia al array: el mapeo sigue vivo aunque se pare el buffer a mitad del guardado
+        self.data = ring.data
+        self.first = first
+        self.last = last
+        self.channels = ring.channels
+        self.samplerate = ring.samplerate
+        self.chunk_frames = chunk_frames
+        # Lo anterior a esto ya no estaba al pedir el clip (relleno, como snapshot_range)
+        self.available_from = ring._safe_from()
+        self.lost_frames = 0     # Muestras pisadas por el escritor antes de poder leerlas
+
+    def __len__(self):
+        return self.last - self.first
+
+    def _decode(self, out, start):
+        """Decodifica len(out) muestras desde la absoluta `start` (con la vuelta del anillo)."""
+        capacity = self.ring.capacity
+        pos = start % capacity
+        first = min(len(out), capacity - pos)
+        self.ring._decode_into(out[:first], self.data[pos:pos + first])
+        if first < len(out):
+            self.ring._decode_into(out[first:], self.data[:len(out) - first])
+
+    def chunks(self):
+        """Genera los trozos en orden. Cada uno es una vista del mismo búfer: hay que usarlo antes del siguiente."""
+        out = np.empty((self.chunk_frames, self.channels), dtype=np.float32)
+        for a in range(self.first, self.last, self.chunk_frames):
+            b = min(a + self.chunk_frames, self.last)
+            buf = out[:b - a]
+            lo = min(b, max(a, self.ring._safe_from()))
+            buf[:lo - a] = 0
+            if lo < b: self._decode(buf[lo - a:], lo)
+            # El escritor pudo avanzar mientras decodificábamos: lo pisado tampoco vale
+            gone = min(b, max(lo, self.ring._safe_from()))
+            buf[lo - a:gone - a] = 0
+            self.lost_frames += max(0, gone - max(a, self.available_from))
+            if gone < b: self._release(gone, b)
+            yield buf
+
+    def _release(self, start, end):
+        """Lo leído del fichero también cuenta en el RSS: se suelta como hace el escritor (_release_old)."""
+        ring = self.ring
+        if ring.spill is None or not ring.ram_frames: return
+        # Lo de los últimos `ram_frames` se queda: el escritor lo mantiene residente
+        end = min(end, ring.total_frames - ring.ram_frames)
+        if end <= start: return
+        stride = self.data.strides[0]
+        ring.spill.release((start % ring.capacity) * stride, (end - start) * stride)
+
+
+def make_audio_ring(duration, samplerate=48000, channels=2, sample_format="float32", spill_path=None, ram_seconds=None):
+    """
+    Crea el búfer de replay con el formato en RAM elegido (SAMPLE_FORMATS).
+    `spill_path`: anillo en fichero mapeado (ver AudioRingBuffer); FLAC ya es pequeño y no lo usa.
+    """
+    if sample_format == "flac":
+        return CompressedAudioRing(duration, samplerate, channels, sample_format=sample_format)
+    if sample_format not in SAMPLE_FORMATS:
+        print(f"[AUDIO] Formato en RAM desconocido '{sample_format}', se usa float32")
+        sample_format = "float32"
+    margin = SPILL_MARGIN_SECONDS if spill_path is not None else REPLAY_MARGIN_SECONDS
+    return AudioRingBuffer(duration, samplerate, channels, margin=margin, sample_format=sample_format,
+                           spill_path=spill_path, ram_seconds=ram_seconds)
@@ -0,0 +1,120 @@
+import time
+import warnings
+
+import audio_manager
+
+# Tamaños de bloque que se prueban (muestras a 48 kHz: ~21, ~43 y ~85 ms). Por debajo de un frame
+# de vídeo (16,7 ms a 60 fps) el recorte de los clips no gana nada y la CPU por segundo se dispara
+CANDIDATE_BLOCKS = (1024, 2048, 4096)
+# El de siempre: lo que se usa si el dispositivo no se ha calibrado
+DEFAULT_BLOCK = 4096
+# Segundos de captura por tamaño probado
+CALIBRATION_SECONDS = 1.5
+
+
+def native_period(recorder, samplerate):
+    """
+    Periodo nativo del dispositivo en muestras, si el backend lo expone: WASAPI da `deviceperiod`
+    (por defecto, mínimo) y PulseAudio la `latency` del stream. None si no se sabe.
+    soundcard no dice la frecuencia nativa (convierte a la que se pide), así que se captura a 48 kHz.
+    """
+    for attr in ("deviceperiod", "latency"):
+        try:
+            value = getattr(recorder, attr)
+        except Exception:
+            continue
+        if isinstance(value, tuple): value = value[0]
+        if value: return max(1, int(round(value * samplerate)))
+    return None
+
+
+def _candidates(period):
+    """Los bloques candidatos, redondeados a un múltiplo del periodo nativo (el driver entrega de periodo en periodo)."""
+    if not period: return list(CANDIDATE_BLOCKS)
+    return sorted({max(period, -(-block // period) * period) for block in CANDIDATE_BLOCKS})
+
+
+def _measure(mic, block, samplerate, seconds):
+    """Captura `seconds` con bloques de `block` y cuenta lo que se ha perdido o llegado tarde."""
+    with warnings.catch_warnings(record=True) as caught:
+        # WASAPI avisa con un warning de cada hueco en la captura ("data discontinuity")
+        warnings.simplefilter("always")
+        with mic.recorder(samplerate=samplerate, blocksize=block) as recorder:
+            period = native_period(recorder, samplerate)
+            recorder.record(numframes=block)   # El primer bloque incluye el arranque del stream
+            t0 = last = time.monotonic()
+            cpu0 = time.thread_time()
+            frames, max_gap = 0, 0.0
+            while time.monotonic() - t0 < seconds:
+                frames += len(recorder.record(numframes=block))
+                now = time.monotonic()
+                max_gap = max(max_gap, now - last)
+                last = now
+            elapsed = last - t0
+            cpu = time.thread_time() - cpu0
+    block_seconds = block / samplerate
+    # Lo que falta respecto al reloj (más allá del bloque en curso) se ha perdido
+    missing = elapsed * samplerate - frames
+    lost_blocks = max(0, int(missing / block) - 1)
+    discontinuities = sum(1 for w in caught if "discontinuity" in str(w.message))
+    return {
+        "block": block, "block_ms": round(block_seconds * 1000, 2), "period": period,
+        "underruns": discontinuities + lost_blocks,
+        "jitter_ms": round(max(0.0, max_gap - block_seconds) * 1000, 2),
+        "cpu_ms_per_s": round(cpu * 1000 / max(elapsed, 1e-6), 2),
+    }
+
+
+def choose_block(results):
+    """
+    El bloque más pequeño (recorte más fino) entre los que menos underruns han tenido, siempre que
+    su peor retraso no pase de medio bloque; si ninguno es estable, el más grande de ellos.
+    """
+    if not results: return DEFAULT_BLOCK
+    fewest = min(r["underruns"] for r in results)
+    best = sorted((r for r in results if r["underruns"] == fewest), key=lambda r: r["block"])
+    for r in best:
+        if r["jitter_ms"] <= r["block_ms"] / 2:
+            return r["block"]
+    return best[-1]["block"]
+
+
+def calibrate_device(device_id, name=None, samplerate=48000, seconds=CALIBRATION_SECONDS):
+    """
+    Prueba los tamaños de bloque en un dispositivo y elige uno. Devuelve
+    {'id', 'name', 'block_size', 'period', 'results'} o None si el dispositivo no está.
+    """
+    mic = audio_manager.get_mic(device_id)
+    if mic is None:
+        print(f"[CALIB] {name or device_id} no está conectado")
+        return None
+    period = None
+    try:
+        with mic.recorder(samplerate=samplerate, blocksize=DEFAULT_BLOCK) as recorder:
+            period = native_period(recorder, samplerate)
+    except Exception as e:
+        print(f"[CALIB] No se pudo abrir {name or device_id}: {e}")
+        return None
+    results = []
+    for block in _candidates(period):
+        try:
+            results.append(_measure(mic, block, samplerate, seconds))
+        except Exception as e:
+            print(f"[CALIB] {name or device_id}: bloque {block} falló ({e})")
+    block = choose_block(results)
+    period_ms = f"{period / samplerate * 1000:.1f} ms" if period else "desconocido"
+    print(f"[CALIB] {name or device_id}: periodo {period_ms}, bloque elegido {block} "
+          f"({block / samplerate * 1000:.1f} ms)")
+    return {"id": device_id, "name": name, "block_size": block, "period": period, "results": results}
+
+
+def calibrate_devices(tracks, samplerate=48000, seconds=CALIBRATION_SECONDS):
+    """
+    Calibra varias pistas, una detrás de otra: los avisos de huecos de WASAPI se recogen con
+    warnings.catch_warnings, que no es seguro entre hilos. Devuelve {id: resultado}.
+    """
+    out = {}
+    for track in tracks:
+        result = calibrate_device(track['id'], track.get('name'), samplerate, seconds)
+        if result: out[track['id']] = result
+    return out
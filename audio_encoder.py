@@ -0,0 +1,162 @@
+import collections
+import math
+import queue
+import subprocess
+import threading
+import numpy as np
+
+AAC_FRAME = 1024          # Muestras por frame AAC
+# Retardo del encoder aac de FFmpeg: al decodificar desde el frame k, la primera muestra que sale
+# es la k*1024 - AAC_ENCODER_DELAY de la entrada (medido con un clic: es exactamente un frame)
+AAC_ENCODER_DELAY = 1024
+# Bloques de PCM que pueden esperar al encoder antes de sustituirlos por silencio
+MAX_PENDING_BLOCKS = 64
+
+
+def adts_frame_length(header):
+    """Longitud total (cabecera incluida) de un frame ADTS a partir de sus 6 primeros bytes."""
+    return ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+
+
+class ADTSRing:
+    """
+    Frames AAC (ADTS) de los últimos `capacity` frames, numerados desde el primero que sacó
+    el encoder. Igual que el búfer TS: los bytes son inmutables, así que un snapshot son
+    referencias tomadas bajo el lock y se escriben fuera.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = collections.deque()
+        self.first_index = 0      # Índice del frame frames[0]
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self._carry = b""
+
+    def feed(self, data):
+        if self._carry:
+            data = self._carry + data
+        out, i, n = [], 0, len(data)
+        while i + 7 <= n:
+            if data[i] != 0xFF or (data[i + 1] & 0xF0) != 0xF0:
+                # Fuera de sincronía (no debería pasar con un pipe): buscamos la siguiente cabecera
+                i += 1
+                continue
+            length = adts_frame_length(data[i:i + 6])
+            if length < 7 or i + length > n: break
+            out.append(data[i:i + length])
+            i += length
+        self._carry = data[i:]
+        if not out: return
+        with self.lock:
+            self.frames.extend(out)
+            self.nbytes += sum(len(f) for f in out)
+            while len(self.frames) > self.capacity:
+                self.nbytes -= len(self.frames.popleft())
+                self.first_index += 1
+
+    @property
+    def end_index(self):
+        return self.first_index + len(self.frames)
+
+    def snapshot(self, first, last):
+        """Frames [first, last) que sigan en el anillo: (índice del primero, [memoryviews])."""
+        with self.lock:
+            first = max(first, self.first_index)
+            last = min(last, self.end_index)
+            if last <= first: return first, []
+            base = self.first_index
+            return first, [memoryview(self.frames[k - base]) for k in range(first, last)]
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+            self.first_index = 0
+            self._carry = b""
+
+
+class LiveAACEncoder:
+    """
+    Codifica a AAC mientras se captura: un FFmpeg por pista recibe el mismo PCM que el anillo
+    (f32le por stdin) y devuelve ADTS por stdout, que se guarda en un ADTSRing.
+    Al guardar en MP4 el audio ya está comprimido y solo se copian paquetes (-c:a copy).
+    push() nunca bloquea al hilo de captura: si FFmpeg se atrasa, el bloque se cambia por
+    silencio de la misma longitud, así el frame k sigue siendo la muestra k*1024 del anillo PCM.
+    """
+    def __init__(self, ffmpeg_exec, duration, samplerate=48000, channels=2, bitrate="320k",
+                 margin=2.0, name="aac"):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.bitrate = bitrate
+        self.name = name
+        self.ring = ADTSRing(int(math.ceil((duration + margin) * samplerate / AAC_FRAME)) + 2)
+        self.pending = queue.Queue(maxsize=MAX_PENDING_BLOCKS)
+        self.stats = {"dropped_blocks": 0, "frames": 0}
+        self._dropped_frames = 0
+        self.running = True
+
+        cmd = [ffmpeg_exec, "-hide_banner", "-loglevel", "error",
+               "-f", "f32le", "-ar", str(samplerate), "-ac", str(channels), "-i", "pipe:0",
+               "-c:a", "aac", "-b:a", bitrate, "-f", "adts", "pipe:1"]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._feeder = threading.Thread(target=self._feed_loop, name=f"aac-in-{name}", daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, name=f"aac-out-{name}", daemon=True)
+        self._feeder.start()
+        self._reader.start()
+
+    def push(self, block):
+        """Lo llama el hilo de captura con el mismo bloque (ya remuestreado) que va al anillo PCM."""
+        try:
+            if self._dropped_frames:
+                # Primero el hueco de lo descartado, para no correr la numeración de frames
+                self.pending.put_nowait(np.zeros((self._dropped_frames, self.channels), dtype=np.float32))
+                self._dropped_frames = 0
+            self.pending.put_nowait(block)
+        except queue.Full:
+            self.stats["dropped_blocks"] += 1
+            self._dropped_frames += len(block)
+
+    def _feed_loop(self):
+        try:
+            while self.running:
+                block = self.pending.get()
+                if block is None: break
+                self.process.stdin.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try: self.process.stdin.close()
+            except Exception: pass
+
+    def _read_loop(self):
+        try:
+            while True:
+                data = self.process.stdout.read1(64 * 1024)
+                if not data: break
+                self.ring.feed(data)
+                self.stats["frames"] = self.ring.end_index
+        except (OSError, ValueError):
+            pass
+
+    def snapshot_frames(self, first_sample, last_sample):
+        """
+        Frames AAC que cubren las muestras [first_sample, last_sample) del anillo PCM.
+        Empieza en el primer frame que cae dentro (como mucho 1024 muestras tarde) y devuelve
+        (partes ADTS, desfase en segundos de su primera muestra respecto a first_sample).
+        """
+        first = math.ceil((first_sample + AAC_ENCODER_DELAY) / AAC_FRAME)
+        last = (last_sample + AAC_ENCODER_DELAY) // AAC_FRAME
+        first, parts = self.ring.snapshot(first, last)
+        offset = (first * AAC_FRAME - AAC_ENCODER_DELAY - first_sample) / self.samplerate
+        return parts, offset
+
+    def close(self):
+        self.running = False
+        try: self.pending.put_nowait(None)
+        except queue.Full: pass
+        try:
+            self.process.wait(timeout=2)
+        except Exception:
+            try: self.process.kill()
+            except Exception: pass
+        self._reader.join(timeout=1)
@@ -1,63 +1,228 @@
-import soundcard as sc
+import threading
+import time
 import soundfile as sf
 import numpy as np
 
-# Cache para no buscar dispositivos mil veces por segundo
-_CACHED_MICS = []
+# soundcard necesita un servidor de audio real (WASAPI / PulseAudio).
+# En máquinas sin cabeza (benchmarks, CI) no carga: seguimos con las fuentes sintéticas.
+try:
+    import soundcard as sc
+except Exception as e:
+    sc = None
+    print(f"[AudioManager] soundcard no disponible ({e}); solo fuentes sintéticas.")
 
-def get_audio_devices():
+# Palabras que delatan un dispositivo de salida (loopback = audio del PC/juego)
+_OUTPUT_HINTS = ["speakers", "headset", "sonar", "stereo", "mezcla", "altavoces", "auriculares"]
+# Cada cuánto mira el vigilante si se ha enchufado o quitado algo
+WATCH_INTERVAL = 2.0
+
+
+def _device_id(mic):
+    """ID estable de soundcard (endpoint de WASAPI / nombre de PulseAudio); el loopback lleva prefijo
+    porque comparte ID con el altavoz del que sale."""
+    base = str(getattr(mic, "id", None) or mic.name)
+    return f"loopback:{base}" if getattr(mic, "isloopback", False) else base
+
+
+def _device_info(index, mic):
+    nombre = mic.name
+    # Heurística para detectar si es Audio de Sistema (Loopback)
+    # Si dice "Speakers", "Headset", "Sonar", "Stereo Mix" o "Mezcla" suele ser salida
+    tipo = "output" if any(x in nombre.lower() for x in _OUTPUT_HINTS) else "input"
+    return {
+        'index': index,          # Posición en la última enumeración (solo para la UI)
+        'name': nombre,          # Nombre legible
+        'type': tipo,            # Para ponerle el icono correcto en la UI
+        'id': _device_id(mic),   # ID persistente: es lo que usan los hilos de captura
+    }
+
+
+class DeviceRegistry:
     """
-    Usa la librería 'soundcard' para detectar micrófonos y loopbacks (audio PC).
-    Basado en la lógica de 'grabadora.py'.
+    Dispositivos de audio por ID estable, no por índice: al enchufar unos cascos la lista de
+    soundcard se reordena, pero cada ID sigue apuntando al mismo dispositivo.
+    La lista se guarda en caché y solo se vuelve a enumerar al refrescar (a mano, por el vigilante
+    o si se pide un ID que no conocemos). Cada refresco se compara con el anterior y se avisa a
+    los listeners con ("added" | "removed", dispositivo).
     """
-    global _CACHED_MICS
-    devices = []
-    
-    try:
-        # include_loopback=True es la clave para grabar el audio del sistema (Speakers)
-        # Esto obtiene TODOS los dispositivos disponibles
-        mics = sc.all_microphones(include_loopback=True)
-        _CACHED_MICS = mics # Guardamos la referencia a los objetos reales
-        
-        for i, mic in enumerate(mics):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._mics = {}          # id -> objeto mic de soundcard
+        self._devices = []       # dicts en orden de enumeración
+        self._enumerated = False
+        self.generation = 0      # Sube con cada alta/baja
+        self.listeners = []
+        self._watcher = None
+        self._watching = False
+
+    def refresh(self):
+        """Vuelve a enumerar y aplica solo las diferencias. Devuelve la lista de dispositivos."""
+        if sc is None: return []
+        try:
+            # include_loopback=True es la clave para grabar el audio del sistema (Speakers)
+            mics = sc.all_microphones(include_loopback=True)
+        except Exception as e:
+            print(f"[AudioManager] Error detectando dispositivos: {e}")
+            return self.devices(refresh=False)
+        found, devices = {}, []
+        for mic in mics:
             try:
-                nombre = mic.name
-                # Determinamos el tipo basándonos en el nombre, igual que en tu script
-                tipo = "input" # Por defecto input (micro)
-                
-                # Heurística para detectar si es Audio de Sistema (Loopback)
-                # Si dice "Speakers", "Headset", "Sonar", "Stereo Mix" o "Mezcla" suele ser salida
-                n_low = nombre.lower()
-                if any(x in n_low for x in ["speakers", "headset", "sonar", "stereo", "mezcla", "altavoces", "auriculares"]):
-                    tipo = "output" # Lo marcamos como output (PC/JUEGO) para la UI
-                
-                devices.append({
-                    'index': i,          # Índice en la lista de soundcard
-                    'name': nombre,      # Nombre legible
-                    'type': tipo,        # Para ponerle el icono correcto en la UI
-                    'id': nombre         # Usamos el nombre como ID persistente
-                })
-            except:
+                info = _device_info(len(devices), mic)
+            except Exception:
                 continue
-                
-    except Exception as e:
-        print(f"[AudioManager] Error detectando dispositivos: {e}")
-        
-    return devices
+            found[info['id']] = mic
+            devices.append(info)
+        with self._lock:
+            old = {d['id']: d for d in self._devices}
+            added = [d for d in devices if d['id'] not in old]
+            removed = [d for d in old.values() if d['id'] not in found]
+            # Los objetos de los que siguen se conservan: un hilo puede estar grabando con ellos
+            self._mics = {dev_id: self._mics.get(dev_id, mic) for dev_id, mic in found.items()}
+            self._devices = devices
+            first = not self._enumerated
+            self._enumerated = True
+            if added or removed:
+                self.generation += 1
+                self._changed.notify_all()
+        if not first:
+            for dev in removed: self._emit("removed", dev)
+            for dev in added: self._emit("added", dev)
+        return list(devices)
+
+    def _emit(self, event, device):
+        print(f"[AudioManager] Dispositivo {'conectado' if event == 'added' else 'desconectado'}: {device['name']}")
+        for cb in list(self.listeners):
+            try: cb(event, device)
+            except Exception as e: print(f"[AudioManager] Error en listener: {e}")
+
+    def add_listener(self, callback):
+        """callback(evento, dispositivo). Se llama desde el hilo que refresca (el vigilante)."""
+        self.listeners.append(callback)
+
+    def devices(self, refresh=False):
+        if refresh or not self._enumerated: return self.refresh()
+        with self._lock:
+            return list(self._devices)
+
+    def get_mic(self, device_id):
+        """Objeto mic para un ID. Si no lo conocemos se enumera una vez (puede ser recién enchufado)."""
+        if str(device_id).startswith("synthetic:"):
+            return SyntheticMic(int(str(device_id).split(":", 1)[1]))
+        with self._lock:
+            mic = self._mics.get(device_id)
+        if mic is None and not self._watching:
+            self.refresh()
+            with self._lock:
+                mic = self._mics.get(device_id)
+        return mic
+
+    def wait_for_change(self, timeout=None):
+        """Bloquea hasta la próxima alta/baja (o timeout). Para hilos que esperan a su dispositivo."""
+        with self._lock:
+            generation = self.generation
+            self._changed.wait_for(lambda: self.generation != generation, timeout)
+
+    def start_watcher(self, interval=WATCH_INTERVAL):
+        if self._watcher is not None or sc is None: return
+        self._watching = True
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="audio-devices", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._watching = False
+        if self._watcher: self._watcher.join()
+        self._watcher = None
+
+    def _watch(self, interval):
+        # soundcard usa COM en Windows: cada hilo que enumera lo inicializa por su cuenta
+        while self._watching:
+            self.refresh()
+            time.sleep(interval)
+
+
+registry = DeviceRegistry()
+
+
+def get_audio_devices():
+    """
+    Usa la librería 'soundcard' para detectar micrófonos y loopbacks (audio PC).
+    Basado en la lógica de 'grabadora.py'. Refresca el registro (y avisa de altas/bajas).
+    """
+    return registry.devices(refresh=True)
+
+
+def get_mic(device_id):
+    """Recupera el objeto 'mic' real por su ID estable (ver DeviceRegistry)."""
+    return registry.get_mic(device_id)
+
 
 def get_mic_object_by_index(index):
-    """Recupera el objeto 'mic' real de soundcard usando el índice."""
-    global _CACHED_MICS
-    if 0 <= index < len(_CACHED_MICS):
-        return _CACHED_MICS[index]
-    
-    # Si por lo que sea no está en caché, refrescamos
-    mics = sc.all_microphones(include_loopback=True)
-    _CACHED_MICS = mics
-    if 0 <= index < len(mics):
-        return mics[index]
+    """Compatibilidad: índice de la última enumeración. Mejor get_mic(id), que no se mueve."""
+    if index <= SYNTHETIC_INDEX_BASE:
+        return SyntheticMic(SYNTHETIC_INDEX_BASE - index)
+    devices = registry.devices()
+    if 0 <= index < len(devices):
+        return registry.get_mic(devices[index]['id'])
     return None
 
+# =============================================================================
+#  FUENTES SINTÉTICAS (sustituyen a soundcard en benchmarks sin hardware)
+# =============================================================================
+# Índices negativos a partir de -2 (el -1 ya lo usa la UI para "[OFFLINE]")
+SYNTHETIC_INDEX_BASE = -2
+
+
+class _SyntheticRecorder:
+    """Imita a mic.recorder(): entrega bloques de un tono a ritmo real."""
+    def __init__(self, freq, samplerate, channels):
+        self.freq = freq
+        self.samplerate = samplerate
+        self.channels = channels
+        self._frames = 0
+        self._t0 = None
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def record(self, numframes=None):
+        numframes = numframes or 1024
+        # Esperamos a que "llegue" el bloque, como haría el driver
+        deadline = self._t0 + (self._frames + numframes) / self.samplerate
+        delay = deadline - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+        t = (np.arange(numframes) + self._frames) / self.samplerate
+        self._frames += numframes
+        tone = (0.1 * np.sin(2 * np.pi * self.freq * t)).astype(np.float32)
+        return np.repeat(tone[:, None], self.channels, axis=1)
+
+
+class SyntheticMic:
+    """Dispositivo falso con la misma interfaz que un micrófono de soundcard."""
+    def __init__(self, n=0):
+        self.n = n
+        self.name = f"Synthetic Tone {n}"
+        self.id = f"synthetic:{n}"
+        self.channels = 2
+
+    def recorder(self, samplerate, blocksize=None, channels=None):
+        return _SyntheticRecorder(440.0 * (self.n + 1), samplerate, channels or self.channels)
+
+
+def get_synthetic_devices(count=1):
+    """Pistas sintéticas con el mismo formato que get_audio_devices()."""
+    return [{
+        'index': SYNTHETIC_INDEX_BASE - i,
+        'name': f"Synthetic Tone {i}",
+        'type': 'input',
+        'id': f"synthetic:{i}",
+    } for i in range(count)]
+
+
 if __name__ == "__main__":
     # Test rápido (igual que tu script original)
     print("--- Test Audio Manager (SoundCard) ---")
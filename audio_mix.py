@@ -0,0 +1,99 @@
+import collections
+import numpy as np
+
+# Una pista que va más de esto por detrás de la más adelantada (dispositivo caído o atascado)
+# deja de frenar la mezcla: lo suyo cuenta como silencio hasta que se pone al día
+MIX_MAX_LAG_SECONDS = 0.5
+
+
+class _MixInput:
+    """Bloques pendientes de una pista, contiguos desde la muestra absoluta `start` de la mezcla."""
+    def __init__(self, start, gain):
+        self.start = start
+        self.end = start
+        self.gain = gain
+        self.chunks = collections.deque()
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.end += len(data)
+
+    def add_into(self, out, position, end):
+        """Suma (con su ganancia) lo que tenga de [position, end) en `out` y lo suelta."""
+        while self.chunks:
+            chunk = self.chunks[0]
+            c_end = self.start + len(chunk)
+            if c_end <= position:
+                # Llegó tarde (la mezcla ya pasó por ahí sin esperarla): se descarta
+                self.chunks.popleft()
+                self.start = c_end
+                continue
+            if self.start >= end: break
+            lo, hi = max(position, self.start), min(end, c_end)
+            part = chunk[lo - self.start:hi - self.start]
+            if self.gain == 1.0:
+                out[lo - position:hi - position] += part
+            else:
+                out[lo - position:hi - position] += part * self.gain
+            if hi < c_end:
+                # Lo que sobra del bloque se queda para la siguiente vuelta
+                self.chunks[0] = chunk[hi - self.start:]
+                self.start = hi
+                break
+            self.chunks.popleft()
+            self.start = c_end
+
+
+class AudioMixer:
+    """
+    Suma las pistas en una sola sobre el reloj compartido (time.monotonic()).
+    Cada pista entra con push() desde su hilo de captura, ya corregida de deriva (48 kHz exactos);
+    su primer bloque fija en qué muestra de la mezcla empieza y a partir de ahí va contigua (los
+    huecos al reabrir un dispositivo ya llegan rellenos de silencio). La mezcla avanza hasta
+    donde han llegado todas las pistas vivas, así que cada muestra se suma una sola vez; una pista
+    que no llega (o se queda más de `max_lag` atrás) deja de esperarse y cuenta como silencio.
+    No es seguro entre hilos: quien lo use debe llamar a push() bajo su propio lock.
+    """
+    def __init__(self, gains, samplerate=48000, channels=2, origin=None, max_lag=MIX_MAX_LAG_SECONDS):
+        self.gains = [float(g) for g in gains]
+        self.samplerate = samplerate
+        self.channels = channels
+        self.origin = origin          # time.monotonic() de la muestra 0 de la mezcla
+        self.max_lag = int(max_lag * samplerate)
+        self.inputs = [None] * len(self.gains)
+        self.position = 0             # Siguiente muestra de la mezcla por producir
+
+    def _fit(self, data):
+        if data.ndim == 1: return data[:, None]
+        # Mono se suma a los dos canales por broadcasting; de más canales, solo los primeros
+        return data[:, :self.channels] if data.shape[1] > self.channels else data
+
+    def push(self, index, data, captured_at):
+        """
+        Añade un bloque de la pista `index` (`captured_at`: fin del bloque). Devuelve
+        (bloque mezclado, time.monotonic() de su última muestra) si la mezcla avanzó, o None.
+        """
+        n = len(data)
+        if n == 0: return None
+        if self.origin is None:
+            self.origin = captured_at - n / self.samplerate
+        inp = self.inputs[index]
+        if inp is None:
+            start = int(round((captured_at - n / self.samplerate - self.origin) * self.samplerate))
+            inp = self.inputs[index] = _MixInput(start, self.gains[index])
+        inp.append(self._fit(data))
+        return self._mix()
+
+    def _mix(self):
+        live = [inp for inp in self.inputs if inp is not None]
+        lead = max(inp.end for inp in live)
+        # Al arrancar, las pistas cuyo dispositivo aún no ha dado su primer bloque también se esperan
+        if len(live) < len(self.inputs) and lead - self.position <= self.max_lag: return None
+        end = min(inp.end for inp in live if lead - inp.end <= self.max_lag)
+        if end <= self.position: return None
+        out = np.zeros((end - self.position, self.channels), dtype=np.float32)
+        for inp in live:
+            inp.add_into(out, self.position, end)
+        np.clip(out, -1.0, 1.0, out=out)
+        self.position = end
+        return out, self.origin + end / self.samplerate
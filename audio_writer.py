@@ -0,0 +1,193 @@
+import collections
+import threading
+import time
+import numpy as np
+import soundfile as sf
+
+# Audio que puede esperar en cola por pista antes de empezar a descartar (disco atascado)
+MAX_QUEUE_SECONDS = 10.0
+# Cada cuánto vuelca el hilo escritor aunque las colas vayan vacías
+FLUSH_INTERVAL = 0.5
+
+
+class AudioTrackQueue:
+    """
+    Cola acotada de una pista. push() la llama SOLO el hilo de captura y nunca bloquea:
+    deque.append/popleft son atómicos en CPython, así que no hay lock entre captura y disco.
+    Si la cola está llena el bloque se descarta y se apunta; el escritor mete ese mismo número
+    de muestras en silencio en su sitio, para que la pista no se desalinee del resto.
+
+    Con `segment_frames` la pista se parte en ficheros de exactamente ese número de muestras:
+    `filename` es entonces un patrón con %d (índice de segmento) y `segments_done` dice cuántos
+    están ya cerrados y se pueden muxear.
+    """
+    def __init__(self, writer, filename, samplerate, channels, subtype, max_blocks, segment_frames=None, held=False):
+        self.writer = writer
+        self.filename = filename
+        self.samplerate = samplerate
+        self.channels = channels
+        self.subtype = subtype
+        self.max_blocks = max_blocks
+        self.blocks = collections.deque()   # (bloque, muestras_descartadas_justo_antes)
+        self.segment_frames = segment_frames
+        self.segments_done = 0
+        self._segment_pos = 0
+        # Retenida: se encola pero no se escribe hasta release() (hay que meter antes la historia)
+        self.held = held
+        self.history = None      # Iterador de bloques que van delante de la cola (release)
+        self.file = self._open(0)
+        self.closing = False
+        self.closed = threading.Event()
+        self._dropped_pending = 0
+        self._reported_overruns = 0
+        self.stats = {"depth": 0, "max_depth": 0, "overruns": 0, "dropped_frames": 0,
+                      "written_frames": 0, "writes": 0, "max_write_ms": 0.0}
+
+    def segment_path(self, index):
+        return self.filename % index if self.segment_frames else self.filename
+
+    def _open(self, index):
+        return sf.SoundFile(self.segment_path(index), mode='w', samplerate=self.samplerate,
+                            channels=self.channels, subtype=self.subtype)
+
+    def _write(self, data):
+        if not self.segment_frames:
+            self.file.write(data)
+            return
+        while len(data):
+            part = data[:self.segment_frames - self._segment_pos]
+            self.file.write(part)
+            self._segment_pos += len(part)
+            data = data[len(part):]
+            if self._segment_pos >= self.segment_frames:
+                # Segmento completo: se cierra (ya es un WAV válido) y seguimos en el siguiente
+                self.file.close()
+                self.segments_done += 1
+                self._segment_pos = 0
+                self.file = self._open(self.segments_done)
+
+    def _close(self):
+        self.file.close()
+        if self.segment_frames: self.segments_done += 1
+
+    def push(self, block):
+        depth = len(self.blocks)
+        # Mientras se escribe la historia lo en vivo espera entero: crece a ritmo de captura
+        if depth >= self.max_blocks and self.history is None:
+            self.stats["overruns"] += 1
+            self.stats["dropped_frames"] += len(block)
+            self._dropped_pending += len(block)
+            return False
+        self.blocks.append((block, self._dropped_pending))
+        self._dropped_pending = 0
+        if depth + 1 > self.stats["max_depth"]: self.stats["max_depth"] = depth + 1
+        # Pasada la mitad despertamos al escritor sin esperar a su intervalo
+        if depth + 1 >= self.max_blocks // 2: self.writer.wake.set()
+        return True
+
+    def release(self, history=()):
+        """
+        Deja escribir la pista con `history` (bloques ya capturados) delante de lo encolado.
+        `history` puede ser un generador: lo consume el hilo escritor, un bloque por pasada,
+        así una historia de minutos no se copia entera en el hilo que llama.
+        """
+        self.history = iter(history)
+        self.held = False
+        self.writer.wake.set()
+
+    def _drain(self):
+        """Junta todo lo pendiente en un solo array y lo escribe de una vez (hilo escritor)."""
+        if self.held and not self.closing: return
+        if self.history is not None:
+            for block in self.history:
+                self._write_timed(block)
+                if not self.closing:
+                    # Un trozo por pasada para no frenar a las demás pistas; enseguida viene otra
+                    self.writer.wake.set()
+                    return
+            self.history = None
+        chunks = []
+        while self.blocks:
+            block, silence = self.blocks.popleft()
+            if silence: chunks.append(np.zeros((silence, self.channels), dtype=np.float32))
+            chunks.append(block)
+        if self.closing and self._dropped_pending:
+            chunks.append(np.zeros((self._dropped_pending, self.channels), dtype=np.float32))
+            self._dropped_pending = 0
+        self.stats["depth"] = len(self.blocks)
+        if self.stats["overruns"] > self._reported_overruns:
+            print(f"[AUDIO-WRITER] Disco lento: {self.stats['overruns'] - self._reported_overruns} bloques "
+                  f"descartados en {self.filename} (rellenados con silencio)")
+            self._reported_overruns = self.stats["overruns"]
+        if not chunks: return
+        self._write_timed(chunks[0] if len(chunks) == 1 else np.concatenate(chunks))
+
+    def _write_timed(self, data):
+        t0 = time.perf_counter()
+        self._write(data)
+        ms = (time.perf_counter() - t0) * 1000
+        self.stats["writes"] += 1
+        self.stats["written_frames"] += len(data)
+        if ms > self.stats["max_write_ms"]: self.stats["max_write_ms"] = ms
+
+
+class AudioFileWriter(threading.Thread):
+    """
+    Un único hilo de disco para todas las pistas de la grabación.
+    Los hilos de captura solo encolan; este hilo vacía las colas cada FLUSH_INTERVAL (o antes si
+    alguna pasa de la mitad) con una escritura grande y secuencial por pista.
+    """
+    def __init__(self, max_queue_seconds=MAX_QUEUE_SECONDS, flush_interval=FLUSH_INTERVAL):
+        super().__init__(name="audio-writer", daemon=True)
+        self.max_queue_seconds = max_queue_seconds
+        self.flush_interval = flush_interval
+        self.tracks = []
+        self.wake = threading.Event()
+        self.running = True
+        self._tracks_lock = threading.Lock()
+
+    def open_track(self, filename, samplerate, channels=2, subtype='FLOAT', block_size=4096, segment_frames=None,
+                   held=False):
+        max_blocks = max(2, int(np.ceil(self.max_queue_seconds * samplerate / block_size)))
+        track = AudioTrackQueue(self, filename, samplerate, channels, subtype, max_blocks, segment_frames, held)
+        with self._tracks_lock:
+            self.tracks.append(track)
+        return track
+
+    def close_track(self, track, timeout=None):
+        """Escribe lo que quede en la cola y cierra el fichero. Espera a que el escritor termine."""
+        track.closing = True
+        self.wake.set()
+        return track.closed.wait(timeout)
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            with self._tracks_lock:
+                tracks = list(self.tracks)
+            for track in tracks:
+                try:
+                    track._drain()
+                except Exception as e:
+                    print(f"[AUDIO-WRITER] Error escribiendo {track.filename}: {e}")
+                if track.closing:
+                    try: track._close()
+                    except Exception: pass
+                    with self._tracks_lock:
+                        self.tracks.remove(track)
+                    track.closed.set()
+            if not self.running and not tracks:
+                break
+
+    def stop(self):
+        """Cierra todas las pistas (vaciando sus colas) y termina el hilo."""
+        with self._tracks_lock:
+            for track in self.tracks: track.closing = True
+        self.running = False
+        self.wake.set()
+        self.join()
+
+    def get_stats(self):
+        with self._tracks_lock:
+            return {track.filename: dict(track.stats, depth=len(track.blocks)) for track in self.tracks}
@@ -0,0 +1,122 @@
+"""
+Benchmark del búfer de audio del modo Replay.
+
+Compara el deque antiguo (bloques sueltos + np.concatenate bajo el lock, 5x replay_time)
+con el AudioRingBuffer preasignado, a 48 kHz estéreo con búferes de 60 s y 300 s.
+El anillo se prueba en cada formato en RAM (float32, int16, int24, flac).
+Mide el tiempo máximo que se mantiene el lock, lo que ocupa el audio y el pico de RSS.
+
+Cada caso se ejecuta en un proceso aparte para que el pico de RSS sea independiente:
+    python benchmarks/bench_audio_ring.py
+"""
+import collections
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from bench_utils import TimedLock, rss_peak_mb
+from audio_buffer import make_audio_ring
+
+SAMPLERATE = 48000
+BLOCK_SIZE = 4096
+CHANNELS = 2
+SNAPSHOTS = 10
+
+
+class LegacyDequeBuffer:
+    """Réplica del búfer original de AudioWorker (deque de bloques, 5x la duración)."""
+    def __init__(self, duration):
+        maxlen = int((SAMPLERATE * (duration * 5.0)) / BLOCK_SIZE)
+        self.ram_buffer = collections.deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+    def write(self, block):
+        with self.lock:
+            self.ram_buffer.append(block)
+
+    def get_snapshot(self):
+        with self.lock:
+            return np.concatenate(self.ram_buffer)
+
+
+def run_case(impl, duration):
+    if impl == "deque":
+        buf = LegacyDequeBuffer(duration)
+    else:
+        buf = make_audio_ring(duration, SAMPLERATE, CHANNELS, "float32" if impl == "ring" else impl)
+    buf.lock = TimedLock()
+
+    # Prellenado instantáneo hasta el estado estable (el deque se llena hasta 5x)
+    fill_seconds = duration * 5.0 if impl == "deque" else duration + 2.0
+    block = np.random.uniform(-1, 1, (BLOCK_SIZE, CHANNELS)).astype(np.float32)
+    for _ in range(int(fill_seconds * SAMPLERATE / BLOCK_SIZE) + 1):
+        # El deque guarda referencias: copiamos para simular bloques nuevos del recorder
+        buf.write(block.copy())
+
+    # Hilo de captura a ritmo real mientras se sacan snapshots
+    running = True
+    stalls = []
+
+    def capture():
+        period = BLOCK_SIZE / SAMPLERATE
+        next_t = time.perf_counter()
+        while running:
+            t0 = time.perf_counter()
+            buf.write(block.copy())
+            stalls.append(time.perf_counter() - t0)
+            next_t += period
+            time.sleep(max(0.0, next_t - time.perf_counter()))
+
+    th = threading.Thread(target=capture)
+    th.start()
+    buf.lock.holds.clear()
+
+    snap_times = []
+    for _ in range(SNAPSHOTS):
+        t0 = time.perf_counter()
+        snap = buf.get_snapshot()
+        snap_times.append(time.perf_counter() - t0)
+        del snap
+        time.sleep(0.05)
+
+    running = False
+    th.join()
+
+    return {
+        "impl": impl,
+        "buffer_s": duration,
+        "lock_hold_max_ms": max(buf.lock.holds) * 1000,
+        "capture_stall_max_ms": max(stalls) * 1000 if stalls else 0.0,
+        "snapshot_avg_ms": sum(snap_times) / len(snap_times) * 1000,
+        "audio_mb": buf.nbytes / 1048576 if hasattr(buf, "nbytes") else None,
+        "rss_peak_mb": rss_peak_mb(),
+    }
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--case":
+        print(json.dumps(run_case(sys.argv[2], int(sys.argv[3]))))
+        return
+
+    results = []
+    for duration in (60, 300):
+        for impl in ("deque", "ring", "int16", "int24", "flac"):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", impl, str(duration)],
+                                 capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'impl':<6} {'buffer':>7} {'lock max':>10} {'stall max':>10} {'snapshot':>10} {'audio':>9} {'RSS pico':>10}")
+    for r in results:
+        rss = f"{r['rss_peak_mb']:.0f} MB" if r["rss_peak_mb"] is not None else "n/a"
+        audio = f"{r['audio_mb']:.0f} MB" if r["audio_mb"] is not None else "n/a"
+        print(f"{r['impl']:<6} {r['buffer_s']:>6}s {r['lock_hold_max_ms']:>8.2f}ms "
+              f"{r['capture_stall_max_ms']:>8.2f}ms {r['snapshot_avg_ms']:>8.2f}ms {audio:>9} {rss:>10}")
+
+
+if __name__ == "__main__":
+    main()
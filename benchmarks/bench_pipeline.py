@@ -0,0 +1,222 @@
+"""
+Benchmark de extremo a extremo del modo Replay.
+
+Arranca RecorderCore con fuentes sintéticas (vídeo lavfi testsrc2 + tonos de audio),
+espera a que el búfer se llene, pide N guardados y para. Lo repite para cada combinación
+de fps / bitrate / replay_time y escribe un JSON para comparar entre commits.
+
+Cada caso corre en su propio proceso (como bench_audio_ring.py): los picos de RSS son
+máximos de todo el proceso y, si no, cada caso heredaría el del anterior.
+
+Métricas por caso:
+  - bloqueos de los hilos de captura (max y media por bloque, vídeo y audio)
+  - latencia de guardado (captura -> fichero final) p50 / p90 / p99
+  - pico de RSS del proceso y de los FFmpeg hijos
+  - CPU por hilo (Linux, /proc/self/task)
+
+    python benchmarks/bench_pipeline.py --quick
+    python benchmarks/bench_pipeline.py --fps 60 120 240 --bitrate 6000k 20000k 40000k --replay 30 120 300
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_utils import ROOT_DIR, rss_peak_mb
+import audio_manager
+from recorder_core import RecorderCore
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _thread_cpu_seconds():
+    """CPU (user+sys) de cada hilo vivo, por nombre. Solo Linux."""
+    task_dir = "/proc/self/task"
+    if not os.path.isdir(task_dir): return {}
+    names = {t.native_id: t.name for t in threading.enumerate()}
+    tick = os.sysconf("SC_CLK_TCK")
+    cpu = {}
+    for tid in os.listdir(task_dir):
+        try:
+            with open(f"{task_dir}/{tid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Campos 14 y 15 de stat (utime, stime); tras cortar "pid (comm)" quedan en 11 y 12
+        seconds = (int(fields[11]) + int(fields[12])) / tick
+        name = names.get(int(tid), f"tid-{tid}")
+        cpu[name] = cpu.get(name, 0.0) + seconds
+    return cpu
+
+
+def _children_rss_peak_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentile(values, pct):
+    if not values: return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_case(fps, bitrate, replay_time, args):
+    out_dir = tempfile.mkdtemp(prefix="rc_bench_")
+    core = RecorderCore()
+    core.temp_dir = Path(out_dir) / "Temp_Processing"
+    core.update_settings({
+        "fps": fps,
+        "bitrate": bitrate,
+        "codec": args.encoder,
+        "resolution": args.resolution,
+        "container": args.container,
+        "save_path": out_dir,
+        "replay_time": replay_time,
+        "capture_mode": "testsrc",
+        "save_mode": args.save_mode,
+        "save_workers": args.save_workers,
+        # Cada guardado del benchmark es un clip distinto
+        "save_coalesce_window": 0,
+        "audio_tracks": audio_manager.get_synthetic_devices(args.tracks),
+    })
+
+    latencies, failures = [], []
+    done = threading.Event()
+    finished = []
+
+    def on_status(job_id, status, info):
+        if status == "done": latencies.append(info["latency"])
+        elif status in ("failed", "rejected", "cancelled"): failures.append(status)
+        if status in ("done", "failed", "rejected", "cancelled"):
+            finished.append(job_id)
+            if len(finished) >= args.saves: done.set()
+
+    core.add_save_listener(on_status)
+    cpu_before = _thread_cpu_seconds()
+    t_start = time.monotonic()
+
+    core.start_replay_buffer()
+    # Dejamos que se llene el búfer (o lo que diga --warmup)
+    time.sleep(args.warmup if args.warmup is not None else replay_time)
+    for _ in range(args.saves):
+        core.save_replay()
+        time.sleep(args.interval)
+    done.wait(timeout=max(60, replay_time))
+    # CPU antes de parar: los hilos de captura mueren con stop_replay_buffer
+    cpu_after = _thread_cpu_seconds()
+    stats = core.get_pipeline_stats()
+    core.stop_replay_buffer()
+    core.wait_for_saves()
+    wall = time.monotonic() - t_start
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+    audio_stats = list(stats["audio"].values())
+    video = stats["video_reader"]
+    return {
+        "fps": fps,
+        "bitrate": bitrate,
+        "replay_time": replay_time,
+        "wall_s": wall,
+        "capture": {
+            "video_max_stall_ms": video["max_stall_ms"],
+            "video_avg_stall_ms": video["total_stall_ms"] / video["blocks"] if video["blocks"] else None,
+            "audio_max_stall_ms": max((a["max_stall_ms"] for a in audio_stats), default=None),
+            "audio_blocks": sum(a["blocks"] for a in audio_stats),
+        },
+        "saves": {
+            "requested": args.saves,
+            "ok": len(latencies),
+            "failed": len(failures),
+            "latency_p50_s": _percentile(latencies, 50),
+            "latency_p90_s": _percentile(latencies, 90),
+            "latency_p99_s": _percentile(latencies, 99),
+        },
+        "rss_peak_mb": rss_peak_mb(),
+        "ffmpeg_rss_peak_mb": _children_rss_peak_mb(),
+        "cpu_s_per_thread": {name: round(sec - cpu_before.get(name, 0.0), 3) for name, sec in cpu_after.items()},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--fps", type=int, nargs="+", default=[60, 120, 240])
+    ap.add_argument("--bitrate", nargs="+", default=["6000k", "20000k", "40000k"])
+    ap.add_argument("--replay", type=int, nargs="+", default=[30, 120, 300])
+    ap.add_argument("--quick", action="store_true", help="Un solo caso corto (60 fps, 6000k, 30 s, 10 s de llenado)")
+    ap.add_argument("--saves", type=int, default=5)
+    ap.add_argument("--interval", type=float, default=2.0, help="Segundos entre guardados")
+    ap.add_argument("--warmup", type=float, default=None, help="Segundos de llenado (por defecto replay_time)")
+    ap.add_argument("--tracks", type=int, default=2, help="Pistas de audio sintéticas")
+    ap.add_argument("--encoder", default="libx264")
+    ap.add_argument("--resolution", default="1280x720")
+    ap.add_argument("--container", default="mkv")
+    ap.add_argument("--save-mode", default="pipe", choices=["pipe", "files"])
+    ap.add_argument("--save-workers", type=int, default=1)
+    ap.add_argument("--output", default=None, help="JSON de salida (por defecto bench_results/<commit>_<fecha>.json)")
+    ap.add_argument("--case", nargs=3, default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.quick:
+        args.fps, args.bitrate, args.replay = [60], ["6000k"], [30]
+        if args.warmup is None: args.warmup = 10
+
+    if args.case:
+        # Proceso hijo: un solo caso, resultado en la última línea
+        fps, bitrate, replay_time = args.case
+        print(json.dumps(run_case(int(fps), bitrate, int(replay_time), args)))
+        return
+
+    commit = _git_commit()
+    results = []
+    for replay_time in args.replay:
+        for fps in args.fps:
+            for bitrate in args.bitrate:
+                print(f"--- {fps} fps / {bitrate} / {replay_time}s ---")
+                out = subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+                                     + ["--case", str(fps), bitrate, str(replay_time)],
+                                     stdout=subprocess.PIPE, text=True, check=True)
+                r = json.loads(out.stdout.strip().splitlines()[-1])
+                s = r["saves"]
+                p50 = f"{s['latency_p50_s']:.2f}s" if s["latency_p50_s"] is not None else "n/a"
+                print(f"    guardados {s['ok']}/{s['requested']}  p50 {p50}  "
+                      f"stall vídeo {r['capture']['video_max_stall_ms']:.1f}ms  RSS {r['rss_peak_mb']}")
+                results.append(r)
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(ROOT_DIR, "bench_results"), exist_ok=True)
+        output = os.path.join(ROOT_DIR, "bench_results", f"{commit or 'nocommit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados: {output}")
+
+
+if __name__ == "__main__":
+    main()
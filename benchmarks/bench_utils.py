@@ -0,0 +1,36 @@
+"""Utilidades compartidas por los benchmarks (no forman parte de la app)."""
+import os
+import sys
+import threading
+import time
+
+# Los benchmarks importan los módulos de la app desde la raíz del repo
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+class TimedLock:
+    """Lock que apunta cuánto tiempo se ha mantenido cogido cada vez."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.holds = []
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.holds.append(time.perf_counter() - self._t0)
+        self._lock.release()
+
+
+def rss_peak_mb():
+    """Pico de memoria residente del proceso en MB (None en Windows, sin ru_maxrss)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devuelve KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
@@ -0,0 +1,139 @@
+"""
+Benchmark del guardado de replay desde el búfer de vídeo TS.
+
+Alimenta un TSVideoRingBuffer con un MPEG-TS sintético a 25 Mbps / 60 fps (ritmo real)
+y guarda varios clips mientras tanto. Compara:
+  - locked:  escribir a disco con el lock cogido (comportamiento anterior)
+  - writev:  snapshot de referencias bajo el lock + os.writev fuera de él
+Mide el tiempo máximo que se mantiene el lock durante un guardado y el peor bloqueo del lector.
+
+    python benchmarks/bench_video_save.py [--mbps 25] [--replay 60] [--saves 5]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from bench_utils import TimedLock
+from video_buffer import TSVideoRingBuffer, TS_PACKET_SIZE, PTS_CLOCK
+
+VIDEO_PID = 0x100
+PMT_PID = 0x1000
+
+
+def _packet(pid, payload, pusi=False, rai=False):
+    """Paquete TS de 188 bytes. Si rai=True lleva campo de adaptación con random_access_indicator."""
+    header = bytes([0x47, (0x40 if pusi else 0) | (pid >> 8), pid & 0xFF])
+    if rai:
+        body = bytes([0x30, 1, 0x40]) + payload
+    else:
+        body = bytes([0x10]) + payload
+    return (header + body).ljust(TS_PACKET_SIZE, b"\xff")[:TS_PACKET_SIZE]
+
+
+def _pes_header(pts):
+    ticks = int(pts * PTS_CLOCK)
+    pts_bytes = bytes([
+        0x21 | ((ticks >> 29) & 0x0E), (ticks >> 22) & 0xFF, 0x01 | ((ticks >> 14) & 0xFE),
+        (ticks >> 7) & 0xFF, 0x01 | ((ticks << 1) & 0xFE),
+    ])
+    return b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + pts_bytes
+
+
+def synthetic_ts(mbps, fps, gop):
+    """Generador infinito de frames TS (bytes) con keyframe cada `gop` frames."""
+    pat = _packet(0, bytes([0, 0x00, 0xB0, 13, 0, 1, 0xC1, 0, 0, 0, 1, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF, 0, 0, 0, 0]), pusi=True)
+    pmt = _packet(PMT_PID, bytes([0, 0x02, 0xB0, 18]), pusi=True)
+    packets_per_frame = max(2, int(mbps * 1e6 / 8 / fps / TS_PACKET_SIZE))
+    filler = _packet(VIDEO_PID, b"\x00" * 184) * (packets_per_frame - 1)
+    n = 0
+    while True:
+        key = n % gop == 0
+        head = (pat + pmt) if key else b""
+        yield head + _packet(VIDEO_PID, _pes_header(1.4 + n / fps), pusi=True, rai=key) + filler
+        n += 1
+
+
+def run(mode, mbps, replay, saves, fps=60):
+    buf = TSVideoRingBuffer(replay)
+    buf.lock = TimedLock()
+    frames = synthetic_ts(mbps, fps, gop=fps)
+
+    # Prellenado instantáneo: la ventana completa más un GOP
+    batch = 4
+    for _ in range((replay + 1) * fps // batch):
+        buf.feed(b"".join(next(frames) for _ in range(batch)))
+
+    running = True
+    stalls = []
+
+    def reader():
+        period = batch / fps
+        next_t = time.perf_counter()
+        while running:
+            data = b"".join(next(frames) for _ in range(batch))
+            t0 = time.perf_counter()
+            buf.feed(data)
+            stalls.append(time.perf_counter() - t0)
+            next_t += period
+            time.sleep(max(0.0, next_t - time.perf_counter()))
+
+    th = threading.Thread(target=reader)
+    th.start()
+
+    save_holds, save_times = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(saves):
+            path = os.path.join(tmp, f"clip_{i}.ts")
+            before = len(buf.lock.holds)
+            t0 = time.perf_counter()
+            if mode == "locked":
+                with open(path, "wb") as f, buf.lock:
+                    parts, _ = _parts_unlocked(buf, replay)
+                    for part in parts:
+                        f.write(part)
+            else:
+                with open(path, "wb", buffering=0) as f:
+                    buf.write_clip(f, replay)
+            save_times.append(time.perf_counter() - t0)
+            save_holds.extend(buf.lock.holds[before:])
+            os.remove(path)
+            time.sleep(0.5)
+
+    running = False
+    th.join()
+    return {
+        "mode": mode,
+        "lock_hold_max_ms": max(save_holds) * 1000,
+        "reader_stall_max_ms": max(stalls) * 1000,
+        "save_avg_ms": sum(save_times) / len(save_times) * 1000,
+    }
+
+
+def _parts_unlocked(buf, duration):
+    """Misma selección que snapshot_clip pero sin coger el lock (el llamante ya lo tiene)."""
+    kf_pts, kf_offset, _ = buf._find_clip_start(duration)
+    parts = [memoryview(p) for p in (buf.pat_packet, buf.pmt_packet) if p]
+    for seg_offset, seg in buf.segments:
+        if seg_offset + len(seg) <= kf_offset: continue
+        parts.append(memoryview(seg)[max(0, kf_offset - seg_offset):])
+    return parts, buf.last_pts - kf_pts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mbps", type=float, default=25)
+    ap.add_argument("--replay", type=int, default=60)
+    ap.add_argument("--saves", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"TS sintético {args.mbps:g} Mbps, replay {args.replay}s, {args.saves} guardados")
+    print(f"{'modo':<8} {'lock max':>10} {'stall lector':>13} {'guardado':>10}")
+    for mode in ("locked", "writev"):
+        r = run(mode, args.mbps, args.replay, args.saves)
+        print(f"{r['mode']:<8} {r['lock_hold_max_ms']:>8.2f}ms {r['reader_stall_max_ms']:>11.2f}ms {r['save_avg_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+
+
+class CaptureBackend:
+    """
+    Fuente de vídeo para FFmpeg. Cada backend devuelve los argumentos de entrada
+    (y el filtro que necesite) que van antes de la parte de encoder en _get_video_cmd.
+    """
+    name = ""
+    platforms = ()   # Vacío = cualquier sistema
+
+    def is_available(self):
+        return not self.platforms or sys.platform.startswith(self.platforms)
+
+    def input_args(self, settings, using_nvenc):
+        raise NotImplementedError
+
+    def requirements(self, using_nvenc):
+        """Lo que tiene que traer el FFmpeg para esta fuente: [(tipo, nombre)] con tipo filters/devices/hwaccels."""
+        return []
+
+
+class DDAGrabBackend(CaptureBackend):
+    """Desktop Duplication (Windows 8+). Con NVENC los frames no salen de la GPU."""
+    name = "ddagrab"
+    platforms = ("win",)
+
+    def input_args(self, settings, using_nvenc):
+        fps = settings["fps"]
+        monitor_idx = settings.get("monitor_idx", 0)
+        source = f"ddagrab=framerate={fps}:draw_mouse=0:output_idx={monitor_idx}"
+        if using_nvenc:
+            return [
+                "-init_hw_device", "d3d11va=gpu:0", "-filter_hw_device", "gpu",
+                "-extra_hw_frames", "256",
+                "-f", "lavfi", "-i", source,
+            ]
+        return ["-f", "lavfi", "-i", source, "-vf", "hwdownload,format=nv12"]
+
+    def requirements(self, using_nvenc):
+        reqs = [("filters", "ddagrab")]
+        if using_nvenc: reqs.append(("hwaccels", "d3d11va"))
+        return reqs
+
+
+class GDIGrabBackend(CaptureBackend):
+    """Captura por CPU de Windows (compatible con todo, más lenta)."""
+    name = "gdigrab"
+    platforms = ("win",)
+
+    def input_args(self, settings, using_nvenc):
+        return ["-f", "gdigrab", "-framerate", str(settings["fps"]), "-i", "desktop"]
+
+    def requirements(self, using_nvenc):
+        return [("devices", "gdigrab")]
+
+
+class X11GrabBackend(CaptureBackend):
+    """Captura de un servidor X (Linux). Usa $DISPLAY y la resolución configurada."""
+    name = "x11grab"
+    platforms = ("linux",)
+
+    def input_args(self, settings, using_nvenc):
+        display = os.environ.get("DISPLAY", ":0.0")
+        return [
+            "-f", "x11grab", "-framerate", str(settings["fps"]),
+            "-video_size", settings.get("resolution", "1920x1080"),
+            "-draw_mouse", "0", "-i", f"{display}+0,0",
+        ]
+
+    def requirements(self, using_nvenc):
+        return [("devices", "x11grab")]
+
+
+class TestSourceBackend(CaptureBackend):
+    """
+    Fuente sintética (lavfi testsrc2) a ritmo real. No necesita pantalla ni GPU:
+    sirve para perfilar búfer, guardado y mux en máquinas Linux sin cabeza.
+    """
+    name = "testsrc"
+
+    def input_args(self, settings, using_nvenc):
+        size = settings.get("resolution", "1920x1080")
+        # -re: lavfi genera lo más rápido que puede; así entrega frames como una captura real
+        return ["-re", "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={settings['fps']}"]
+
+    def requirements(self, using_nvenc):
+        return [("filters", "testsrc2")]
+
+
+BACKENDS = {b.name: b for b in (DDAGrabBackend(), GDIGrabBackend(), X11GrabBackend(), TestSourceBackend())}
+
+
+def get_backend(capture_mode):
+    """Busca el backend por nombre (acepta textos de la UI tipo 'ddagrab (GPU)')."""
+    for name, backend in BACKENDS.items():
+        if name in (capture_mode or ""):
+            return backend
+    return BACKENDS["gdigrab"]
+
+
+def available_backends():
+    return [name for name, backend in BACKENDS.items() if backend.is_available()]
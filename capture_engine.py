@@ -0,0 +1,253 @@
+import threading
+import time
+
+import audio_manager
+
+# Si record() tarda más que esto es que ha esperado al driver (el bloque aún no estaba completo)
+BLOCKED_READ_SECONDS = 0.001
+# Cuánto antes de lo previsto se va a leer cada dispositivo: si el reloj de la tarjeta adelanta
+# al nuestro, la lectura temprana no espera y la previsión se corrige sola
+EARLY_FRACTION = 0.25
+# Reintento de un dispositivo caído aunque el registro no haya visto cambios
+RETRY_SECONDS = 1.0
+# Una lectura que sigue sin volver tras STALL_BLOCKS bloques (y al menos STALL_MIN_SECONDS) ya no
+# es esperar al driver: el dispositivo está atascado y se queda con el hilo que lo lee
+STALL_BLOCKS = 4
+STALL_MIN_SECONDS = 0.5
+# Cada cuánto mira el vigilante si hay una lectura atascada
+WATCHDOG_SECONDS = 0.1
+
+
+class _DeviceSlot:
+    """Estado del motor para un AudioWorker: su recorder abierto y cuándo estará listo su próximo bloque."""
+    def __init__(self, worker):
+        self.worker = worker
+        self.recorder = None
+        self.block_seconds = worker.block_size / worker.samplerate
+        self.completed = None    # Fin estimado del último bloque leído (time.monotonic())
+        self.retry_at = 0.0
+        self.generation = -1
+        self.stall_seconds = max(STALL_MIN_SECONDS, STALL_BLOCKS * self.block_seconds)
+        self.detached = False    # El vigilante lo sacó del motor: su lectura sigue en el hilo atascado
+
+    @property
+    def due(self):
+        return self.completed + self.block_seconds
+
+    def open(self):
+        mic = audio_manager.get_mic(self.worker.device_id)
+        if mic is None: return False
+        recorder = mic.recorder(samplerate=self.worker.samplerate, blocksize=self.worker.block_size)
+        recorder.__enter__()
+        self.recorder = recorder
+        self.completed = time.monotonic()
+        return True
+
+    def close(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is None: return
+        try: recorder.__exit__(None, None, None)
+        except Exception: pass
+
+
+class AudioCaptureEngine(threading.Thread):
+    """
+    Un solo hilo para todos los dispositivos de audio, en lugar de un AudioWorker.run() por pista.
+    Cada dispositivo lleva su propio tamaño de bloque; el motor duerme hasta que el siguiente
+    bloque de alguno esté completo, lo lee (record() ya no espera) y se lo pasa a su worker
+    (_consume: deriva, anillo, AAC, grabación). Con 3-4 pistas son 3-4 bucles de Python menos
+    peleando por el GIL.
+
+    Por dispositivo se mide la latencia (cuánto llevaba el bloque listo cuando se leyó) y los
+    underruns (lecturas con más de un bloque de retraso: el driver puede haber perdido audio).
+    Lo que haga _consume en un dispositivo retrasa a los demás: por eso aparece en su latencia.
+
+    Límite: record() no se puede interrumpir. Si un dispositivo se atasca dentro de record()
+    (driver colgado, reloj parado), un vigilante lo saca del motor pasado stall_seconds: el hilo
+    atascado se queda como hilo propio de ese dispositivo (como un AudioWorker normal) y otro
+    hilo sigue con el resto. Hasta ese momento las demás pistas esperan.
+    """
+    def __init__(self, name="audio-engine"):
+        super().__init__(name=name, daemon=True)
+        self.slots = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self.wake = threading.Event()
+        self._reading = None     # (slot, instante) de la lectura en curso, para el vigilante
+        self._looping = False
+        self._watchdog = None
+        self._loops = 0
+
+    def add(self, worker):
+        """Registra un AudioWorker (lo llama worker.start()). El motor arranca con el primero."""
+        with self._lock:
+            self._pending.append(worker)
+            first = not self._looping and self.ident is None
+            if first: self._looping = True
+        self.wake.set()
+        if first: self.start()
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for worker in pending:
+            try:
+                worker._open_sink()
+            except Exception as e:
+                worker.error = e
+                print(f"[AUDIO-ENGINE] Error preparando {worker.device_name}: {e}")
+                worker._finished.set()
+                continue
+            self.slots.append(_DeviceSlot(worker))
+
+    def _retire(self, slot):
+        slot.close()
+        try: slot.worker._close_sink()
+        except Exception as e: print(f"[AUDIO-ENGINE] Error cerrando {slot.worker.device_name}: {e}")
+        slot.worker._finished.set()
+        self.slots.remove(slot)
+
+    def _reopen(self, now):
+        """Abre los dispositivos que falten (recién añadidos o reconectados) sin bloquear al resto."""
+        generation = audio_manager.registry.generation
+        for slot in self.slots:
+            if slot.recorder is not None: continue
+            if now < slot.retry_at and generation == slot.generation: continue
+            try:
+                if slot.open(): continue
+            except Exception as e:
+                slot.close()
+                print(f"[AUDIO-ENGINE] No se pudo abrir {slot.worker.device_name}: {e}")
+            slot.retry_at = now + RETRY_SECONDS
+            slot.generation = generation
+
+    def run(self):
+        self._loop()
+
+    def _loop(self):
+        with self._lock:
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch, name=f"{self.name}-watchdog", daemon=True)
+                self._watchdog.start()
+        while True:
+            self._take_pending()
+            for slot in [s for s in self.slots if not s.worker.running]:
+                self._retire(slot)
+            if not self.slots:
+                with self._lock:
+                    if not self._pending:
+                        self._looping = False
+                        break
+                continue
+            now = time.monotonic()
+            self._reopen(now)
+            live = [s for s in self.slots if s.recorder is not None]
+            if not live:
+                self.wake.wait(0.2)
+                self.wake.clear()
+                continue
+            slot = min(live, key=lambda s: s.due)
+            delay = slot.due - slot.block_seconds * EARLY_FRACTION - now
+            if delay > 0:
+                # Despierta antes si llega un worker nuevo (o alguno se para)
+                if self.wake.wait(delay):
+                    self.wake.clear()
+                    continue
+            if not self._service(slot):
+                # Este hilo se ha quedado con el dispositivo atascado: el motor sigue en otro
+                return
+
+    def _watch(self):
+        """Vigilante: si la lectura en curso se atasca, el motor sigue en un hilo nuevo sin ese dispositivo."""
+        while True:
+            time.sleep(WATCHDOG_SECONDS)
+            with self._lock:
+                if not self._looping:
+                    self._watchdog = None
+                    return
+                reading = self._reading
+                if reading is None: continue
+                slot, started = reading
+                stalled = time.monotonic() - started
+                if stalled < slot.stall_seconds: continue
+                # El hilo atascado no toca self.slots hasta que record() vuelva: ya es solo de este dispositivo
+                slot.detached = True
+                self._reading = None
+                self.slots.remove(slot)
+                self._loops += 1
+                loop = threading.Thread(target=self._loop, name=f"{self.name}-{self._loops}", daemon=True)
+            print(f"[AUDIO-ENGINE] {slot.worker.device_name} lleva {stalled:.1f}s sin volver de record(): "
+                  f"pasa a su propio hilo y el resto sigue en otro")
+            loop.start()
+            self.wake.set()
+
+    def _service(self, slot):
+        """Lee y procesa un bloque de `slot`. Devuelve False si el vigilante lo sacó del motor mientras leía."""
+        worker = slot.worker
+        expected = slot.due
+        t0 = time.monotonic()
+        with self._lock:
+            self._reading = (slot, t0)
+        try:
+            data = slot.recorder.record(numframes=worker.block_size)
+        except Exception as e:
+            if not self._end_read(slot):
+                self._adopt(slot, None, None)
+                return False
+            slot.close()
+            if worker.running: worker._on_device_lost(e)
+            slot.retry_at = time.monotonic() + RETRY_SECONDS
+            slot.generation = audio_manager.registry.generation
+            return True
+        if not self._end_read(slot):
+            self._adopt(slot, data, time.monotonic())
+            return False
+        now = time.monotonic()
+        if now - t0 > BLOCKED_READ_SECONDS:
+            # Ha esperado al driver: el bloque acaba de completarse
+            completed = now
+        else:
+            # Ya estaba listo: terminó como tarde cuando empezamos a leer
+            completed = min(expected, t0)
+        slot.completed = completed
+        latency = now - completed
+        stats = worker.stats
+        stats["latency_ms_total"] += latency * 1000
+        if latency * 1000 > stats["max_latency_ms"]: stats["max_latency_ms"] = latency * 1000
+        if latency > slot.block_seconds: stats["underruns"] += 1
+        t1 = time.perf_counter()
+        try:
+            worker._consume(data, completed)
+        except Exception as e:
+            # Igual que en AudioWorker.run: un error procesando termina esa pista (no es el dispositivo)
+            worker.error = e
+            print(f"[AUDIO-ENGINE] Error procesando {worker.device_name}: {e}")
+            self._retire(slot)
+            return True
+        worker._track_block(time.perf_counter() - t1)
+        return True
+
+    def _end_read(self, slot):
+        """Cierra la lectura en curso. False si el vigilante ya le dio el dispositivo a este hilo."""
+        with self._lock:
+            self._reading = None
+            return not slot.detached
+
+    def _adopt(self, slot, data, captured_at):
+        """
+        El hilo que se quedó atascado leyendo `slot` sigue como hilo propio de su worker: entrega
+        el bloque que por fin llegó y abre el dispositivo de nuevo (reloj nuevo, el hueco se rellena).
+        """
+        worker = slot.worker
+        slot.close()
+        try:
+            if data is not None: worker._consume(data, captured_at)
+            worker._reset_clock()
+            worker._capture_loop()
+        except Exception as e:
+            worker.error = e
+            print(f"[AUDIO-ENGINE] Error grabando {worker.device_name}: {e}")
+        finally:
+            try: worker._close_sink()
+            except Exception as e: print(f"[AUDIO-ENGINE] Error cerrando {worker.device_name}: {e}")
+            worker._finished.set()
@@ -0,0 +1,116 @@
+import subprocess
+import time
+
+# Margen que pedimos sobre tiempo real para dar un encoder por bueno (10%)
+MIN_SPEED = 1.1
+
+# Ajustes de baja latencia por encoder, en orden de preferencia si empatan.
+#   pre:  opciones globales antes de las entradas (dispositivos hw)
+#   vf:   filtro que necesita el encoder para recibir frames
+#   args: opciones del encoder
+#   ts:   False si el búfer de replay (MPEG-TS) no puede usarlo: video_buffer.py solo indexa PES de
+#         vídeo 0xE0-0xEF y AV1 en TS va en un stream privado (0xBD), así que nunca vería un keyframe
+ENCODER_PROFILES = {
+    "h264_nvenc": {"args": ["-preset", "p1", "-tune", "ull", "-rc", "cbr"]},
+    "hevc_nvenc": {"args": ["-preset", "p1", "-tune", "ull", "-rc", "cbr"]},
+    "h264_qsv":   {"args": ["-preset", "veryfast", "-look_ahead", "0"]},
+    "hevc_qsv":   {"args": ["-preset", "veryfast"]},
+    "h264_amf":   {"args": ["-usage", "ultralowlatency", "-quality", "speed"]},
+    "hevc_amf":   {"args": ["-usage", "ultralowlatency", "-quality", "speed"]},
+    "h264_vaapi": {"pre": ["-vaapi_device", "/dev/dri/renderD128"], "vf": "format=nv12,hwupload", "args": []},
+    "hevc_vaapi": {"pre": ["-vaapi_device", "/dev/dri/renderD128"], "vf": "format=nv12,hwupload", "args": []},
+    "libx264":    {"args": ["-preset", "ultrafast", "-tune", "zerolatency"]},
+    "libx265":    {"args": ["-preset", "ultrafast", "-tune", "zerolatency"]},
+    "libsvtav1":  {"args": ["-preset", "12"], "ts": False},
+}
+
+
+def supports_ts_buffer(encoder):
+    return ENCODER_PROFILES.get(encoder, {}).get("ts", True)
+
+
+def list_encoders(ffmpeg_exec):
+    """Nombres de los encoders de vídeo que trae este FFmpeg (`ffmpeg -encoders`)."""
+    try:
+        out = subprocess.run([ffmpeg_exec, "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=15).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    encoders = []
+    for line in out.splitlines():
+        parts = line.split()
+        # Formato: " V....D libx264   descripción"
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith("V"):
+            encoders.append(parts[1])
+    return encoders
+
+
+def _timed_run(cmd, timeout):
+    t0 = time.perf_counter()
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return time.perf_counter() - t0 if result.returncode == 0 else None
+
+
+def trial_encode(ffmpeg_exec, encoder, fps, resolution, seconds=2.0, source_time=0.0):
+    """
+    Codifica `seconds` de testsrc2 a la resolución/fps pedidos y devuelve la velocidad
+    respecto a tiempo real (2.0 = el doble de rápido), o None si el encoder no funciona aquí.
+    `source_time` es lo que tarda solo la fuente; se descuenta para medir el encoder.
+    """
+    profile = ENCODER_PROFILES.get(encoder, {"args": []})
+    cmd = [ffmpeg_exec, "-hide_banner", "-y"] + profile.get("pre", [])
+    cmd += ["-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={fps}", "-t", str(seconds)]
+    if profile.get("vf"): cmd += ["-vf", profile["vf"]]
+    cmd += ["-c:v", encoder] + profile["args"] + ["-f", "null", "-"]
+    elapsed = _timed_run(cmd, timeout=seconds * 20 + 10)
+    if elapsed is None: return None
+    return seconds / max(elapsed - source_time, 1e-3)
+
+
+def probe_best_encoder(ffmpeg_exec, fps, resolution, candidates=None, seconds=2.0, available=None):
+    """
+    Prueba los encoders disponibles y se queda con el más rápido que aguanta el ritmo.
+    Sin `candidates` solo entran los que sirven también para el búfer de replay (el resultado se usa para los dos).
+    `available` evita volver a listar los encoders si ya los tenemos (caché de capacidades).
+    Devuelve {"encoder", "speed", "results": {encoder: speed|None}}.
+    """
+    available = set(available if available is not None else list_encoders(ffmpeg_exec))
+    candidates = [e for e in (candidates or [e for e in ENCODER_PROFILES if supports_ts_buffer(e)]) if e in available]
+
+    # Coste de generar los frames: se descuenta para no penalizar a los encoders rápidos
+    source_time = _timed_run([ffmpeg_exec, "-hide_banner", "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={fps}",
+                              "-t", str(seconds), "-f", "null", "-"], timeout=seconds * 20 + 10) or 0.0
+
+    results = {}
+    for encoder in candidates:
+        speed = trial_encode(ffmpeg_exec, encoder, fps, resolution, seconds, source_time)
+        results[encoder] = round(speed, 2) if speed else None
+        print(f"[PROBE] {encoder}: " + (f"x{speed:.2f}" if speed else "no disponible"))
+
+    usable = [(speed, e) for e, speed in results.items() if speed and speed >= MIN_SPEED]
+    if usable:
+        speed, best = max(usable, key=lambda x: x[0])
+    else:
+        # Nadie llega: el menos malo (o libx264 como último recurso)
+        measured = [(speed, e) for e, speed in results.items() if speed]
+        speed, best = max(measured) if measured else (None, "libx264")
+    return {"encoder": best, "speed": speed, "results": results}
+
+
+def get_best_encoder(ffmpeg_exec, fps, resolution, force=False, caps=None):
+    """
+    Resultado cacheado para este FFmpeg/resolución/fps (en ffmpeg_caps.FFmpegCapabilities),
+    o lo mide y lo guarda. Sin `caps` mide siempre.
+    """
+    if caps is not None:
+        caps.wait()
+        if not force:
+            cached = caps.get_probe(fps, resolution)
+            if cached: return cached
+    available = caps.caps["encoders"] if caps is not None and caps.ready else None
+    result = probe_best_encoder(ffmpeg_exec, fps, resolution, available=available)
+    if caps is not None:
+        caps.set_probe(fps, resolution, dict(result, probed_at=time.strftime("%Y-%m-%d %H:%M:%S")))
+    return result
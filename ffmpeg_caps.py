@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+
+def _app_dir():
+    if getattr(sys, 'frozen', False):
+        return sys._MEIPASS
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+# Junto al programa, no en el directorio de trabajo (los benchmarks se lanzan desde benchmarks/)
+CACHE_FILE = os.path.join(_app_dir(), "ffmpeg_caps.json")
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _write_cache(cache_file, data):
+    try:
+        with open(cache_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+    except Exception as e:
+        print(f"[CAPS] Error guardando caché: {e}")
+
+
+def resolve_ffmpeg_executable(cache_file=CACHE_FILE):
+    """
+    ffmpeg.exe junto al programa o, si no, el del PATH.
+    La ruta resuelta se guarda en la caché y se reutiliza mientras el fichero siga existiendo.
+    """
+    local_ffmpeg = os.path.join(_app_dir(), "ffmpeg.exe")
+    if os.path.exists(local_ffmpeg):
+        return local_ffmpeg
+    cached = _read_cache(cache_file).get("executable")
+    if cached and os.path.exists(cached):
+        return cached
+    found = shutil.which("ffmpeg")
+    if found:
+        data = _read_cache(cache_file)
+        data["executable"] = found
+        _write_cache(cache_file, data)
+        return found
+    return "ffmpeg"
+
+
+def _run_list(ffmpeg_exec, flag):
+    try:
+        return subprocess.run([ffmpeg_exec, "-hide_banner", flag], capture_output=True, text=True, timeout=15).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+
+
+def _parse_table(text, min_flags):
+    """Tablas de -encoders/-filters/-devices: ' FLAGS nombre descripción'. Se queda con los nombres."""
+    names = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) >= min_flags and set(parts[0]) <= set("VASFDETC.|XBN"):
+            if parts[1] != "=": names.append(parts[1])
+    return names
+
+
+def ffmpeg_version(ffmpeg_exec):
+    text = _run_list(ffmpeg_exec, "-version")
+    return text.splitlines()[0] if text else None
+
+
+def detect_capabilities(ffmpeg_exec):
+    """Pregunta a FFmpeg qué sabe hacer (tarda unos cientos de ms: por eso se cachea)."""
+    hwaccels_text = _run_list(ffmpeg_exec, "-hwaccels")
+    return {
+        "version": ffmpeg_version(ffmpeg_exec),
+        "encoders": [n for n in _parse_table(_run_list(ffmpeg_exec, "-encoders"), 6)],
+        "filters": [n for n in _parse_table(_run_list(ffmpeg_exec, "-filters"), 3)],
+        "devices": [n for n in _parse_table(_run_list(ffmpeg_exec, "-devices"), 1)],
+        # -hwaccels: una cabecera y luego un nombre por línea
+        "hwaccels": [l.strip() for l in hwaccels_text.splitlines()[1:] if l.strip()],
+        "encoder_probe": {},
+    }
+
+
+class FFmpegCapabilities:
+    """
+    Qué encoders, filtros, dispositivos y hwaccels tiene el FFmpeg en uso, más la velocidad
+    medida de los encoders (encoder_probe.py).
+    Se guarda en disco por binario (ruta + mtime + tamaño) y se comprueba la versión, así que
+    solo se vuelve a detectar si cambia el ffmpeg. La carga va en un hilo: la UI abre al momento
+    y las comprobaciones que la necesitan simplemente se saltan si aún no está lista.
+    """
+    def __init__(self, ffmpeg_exec, cache_file=CACHE_FILE):
+        self.ffmpeg_exec = ffmpeg_exec
+        self.cache_file = cache_file
+        self.caps = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._key = None
+
+    def _binary_key(self):
+        path = shutil.which(self.ffmpeg_exec) or self.ffmpeg_exec
+        try:
+            st = os.stat(path)
+            return f"{os.path.abspath(path)}|{int(st.st_mtime)}|{st.st_size}"
+        except OSError:
+            return path
+
+    def load_async(self):
+        threading.Thread(target=self.load, name="ffmpeg-caps", daemon=True).start()
+
+    def load(self):
+        try:
+            key = self._binary_key()
+            entry = _read_cache(self.cache_file).get("binaries", {}).get(key)
+            # -version es barato; el resto de listados es lo que nos ahorramos
+            if entry is not None and entry.get("version") != ffmpeg_version(self.ffmpeg_exec):
+                entry = None
+            if entry is None:
+                entry = detect_capabilities(self.ffmpeg_exec)
+                print(f"[CAPS] {entry['version']}: {len(entry['encoders'])} encoders, {len(entry['filters'])} filtros")
+                with self._lock:
+                    self._key, self.caps = key, entry
+                self._persist()
+            else:
+                with self._lock:
+                    self._key, self.caps = key, entry
+        except Exception as e:
+            print(f"[CAPS] Error detectando capacidades: {e}")
+        finally:
+            self._ready.set()
+
+    def _persist(self):
+        with self._lock:
+            if self.caps is None: return
+            data = _read_cache(self.cache_file)
+            data.setdefault("binaries", {})[self._key] = self.caps
+        _write_cache(self.cache_file, data)
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self.caps is not None
+
+    def wait(self, timeout=None):
+        """Bloquea hasta que estén cargadas (solo para hilos de fondo). Devuelve el dict o None."""
+        self._ready.wait(timeout)
+        return self.caps
+
+    # Las consultas devuelven None si aún no se sabe (caché cargando): el llamante no debe esperar
+    def has(self, kind, name):
+        """kind: encoders, filters, devices o hwaccels."""
+        if not self.ready: return None
+        return name in self.caps.get(kind, [])
+
+    def has_encoder(self, name): return self.has("encoders", name)
+    def has_filter(self, name): return self.has("filters", name)
+    def has_device(self, name): return self.has("devices", name)
+    def has_hwaccel(self, name): return self.has("hwaccels", name)
+
+    # --- Resultados de encoder_probe (velocidad medida por resolución/fps) ---
+    def get_probe(self, fps, resolution):
+        if not self.ready: return None
+        return self.caps.get("encoder_probe", {}).get(f"{resolution}@{fps}")
+
+    def set_probe(self, fps, resolution, result):
+        if not self.ready: return
+        with self._lock:
+            self.caps.setdefault("encoder_probe", {})[f"{resolution}@{fps}"] = result
+        self._persist()
@@ -0,0 +1,132 @@
+import collections
+import subprocess
+import threading
+import time
+
+
+class FFmpegJob:
+    """
+    Proceso FFmpeg vigilado: lee `-progress pipe:1` para saber fps, velocidad y bytes escritos,
+    guarda las últimas líneas de error y se puede cancelar.
+    Además del timeout total, si FFmpeg deja de informar progreso durante `stall_timeout`
+    segundos lo damos por colgado y lo matamos, para que no bloquee al siguiente guardado.
+    """
+    def __init__(self, cmd, name="ffmpeg", stdin=None, pass_fds=(), timeout=None, stall_timeout=None, on_progress=None):
+        # -progress va justo detrás del ejecutable: es una opción global
+        self.cmd = [cmd[0], "-nostats", "-progress", "pipe:1", "-loglevel", "error"] + list(cmd[1:])
+        self.name = name
+        self.stdin = stdin
+        self.pass_fds = pass_fds
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.on_progress = on_progress
+
+        self.process = None
+        self.returncode = None
+        self.cancelled = False
+        self.timed_out = False
+        self.started_at = None
+        self.finished_at = None
+        self.last_progress_at = None
+        self.progress = {"frame": 0, "fps": 0.0, "speed": 0.0, "total_size": 0, "out_time": 0.0, "status": "pending"}
+        self.stderr_tail = collections.deque(maxlen=20)
+        self._readers = []
+
+    def start(self):
+        self.started_at = self.last_progress_at = time.monotonic()
+        self.progress["status"] = "running"
+        self.process = subprocess.Popen(self.cmd, stdin=self.stdin if self.stdin is not None else subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=self.pass_fds)
+        self._readers = [
+            threading.Thread(target=self._read_progress, daemon=True),
+            threading.Thread(target=self._read_stderr, daemon=True),
+        ]
+        for t in self._readers: t.start()
+        return self.process
+
+    def _read_progress(self):
+        block = {}
+        for raw in self.process.stdout:
+            line = raw.decode("utf-8", "replace").strip()
+            if "=" not in line: continue
+            key, value = line.split("=", 1)
+            block[key] = value
+            # Cada bloque de -progress termina con "progress=continue|end"
+            if key == "progress":
+                self._apply_progress(block)
+                block = {}
+
+    def _apply_progress(self, block):
+        p = self.progress
+        try:
+            p["frame"] = int(block.get("frame", p["frame"]))
+            p["fps"] = float(block.get("fps", p["fps"]))
+            size = block.get("total_size", "N/A")
+            if size != "N/A": p["total_size"] = int(size)
+            us = block.get("out_time_us", "N/A")
+            if us != "N/A": p["out_time"] = max(0, int(us)) / 1e6
+            speed = block.get("speed", "N/A").rstrip("x").strip()
+            if speed and speed != "N/A": p["speed"] = float(speed)
+        except ValueError: pass
+        if block.get("progress") == "end": p["status"] = "finishing"
+        self.last_progress_at = time.monotonic()
+        if self.on_progress:
+            try: self.on_progress(self)
+            except Exception: pass
+
+    def _read_stderr(self):
+        for raw in self.process.stderr:
+            line = raw.decode("utf-8", "replace").rstrip()
+            if line: self.stderr_tail.append(line)
+
+    def wait(self):
+        """Espera a que termine respetando timeout/stall_timeout. Devuelve el código de salida."""
+        while True:
+            try:
+                self.returncode = self.process.wait(timeout=0.25)
+                break
+            except subprocess.TimeoutExpired:
+                now = time.monotonic()
+                if self.timeout and now - self.started_at > self.timeout:
+                    self.timed_out = True
+                elif self.stall_timeout and now - self.last_progress_at > self.stall_timeout:
+                    self.timed_out = True
+                if self.timed_out:
+                    print(f"[MUX] {self.name}: FFmpeg sin progreso, se cancela")
+                    self.cancel()
+        for t in self._readers: t.join(timeout=1)
+        self.finished_at = time.monotonic()
+        if self.cancelled: self.progress["status"] = "cancelled"
+        elif self.returncode == 0: self.progress["status"] = "done"
+        else: self.progress["status"] = "failed"
+        return self.returncode
+
+    def cancel(self):
+        """Corta el proceso (terminate y, si no responde, kill)."""
+        self.cancelled = True
+        if not self.process or self.process.poll() is not None: return
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=2)
+        except Exception:
+            try: self.process.kill()
+            except Exception: pass
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.cancelled
+
+    @property
+    def elapsed(self):
+        if self.started_at is None: return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def stats(self):
+        """Resumen para logs/UI: throughput y estado."""
+        s = dict(self.progress)
+        s["elapsed"] = self.elapsed
+        s["returncode"] = self.returncode
+        return s
+
+    def error_summary(self):
+        return self.stderr_tail[-1] if self.stderr_tail else f"código {self.returncode}"
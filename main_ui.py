@@ -5,12 +5,13 @@ from pynput import keyboard
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QPushButton, QComboBox, 
                              QLineEdit, QFileDialog, QGroupBox, QSpinBox, 
-                             QTextEdit, QInputDialog, QMessageBox, QGridLayout, QScrollArea, QFrame, QSizePolicy)
-from PyQt6.QtCore import Qt, pyqtSignal, QObject, QSize
+                             QTextEdit, QInputDialog, QMessageBox, QGridLayout, QScrollArea, QFrame, QSizePolicy, QCheckBox, QProgressBar)
+from PyQt6.QtCore import Qt, pyqtSignal, QObject, QSize, QTimer
 from PyQt6.QtGui import QFont, QColor, QPalette
 
 # Importamos los módulos del sistema
 from recorder_core import RecorderCore
+from capture_backends import get_backend
 from profile_manager import ProfileManager
 import audio_manager
 
@@ -201,6 +202,8 @@ class WorkerSignals(QObject):
     update_rec_btn = pyqtSignal()
     update_buffer_btn = pyqtSignal()
     update_hotkey_ui = pyqtSignal(str, str)
+    devices_changed = pyqtSignal(str, str)
+    calibration_done = pyqtSignal(dict)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -219,6 +222,7 @@ class MainWindow(QMainWindow):
         
         # Variables
         self.audio_track_widgets = []
+        self.audio_block_sizes = {}   # Bloque calibrado por ID de dispositivo (se guarda en el perfil)
         self.cached_audio_devices = []
         self.hotkey_listener = None
         self.listening_for_new_hotkey = False
@@ -231,6 +235,12 @@ class MainWindow(QMainWindow):
         self.signals.update_rec_btn.connect(self.update_rec_button_state)
         self.signals.update_buffer_btn.connect(self.update_buffer_button_state)
         self.signals.update_hotkey_ui.connect(self.update_hotkey_display)
+        self.signals.devices_changed.connect(self.on_audio_device_changed)
+        self.signals.calibration_done.connect(self.on_calibration_done)
+        # Altas/bajas de dispositivos: llegan desde el hilo vigilante, pasan por una señal
+        audio_manager.registry.add_listener(lambda event, dev: self.signals.devices_changed.emit(event, dev['name']))
+        # Los callbacks de guardado llegan desde los hilos del core: pasan por la señal de log
+        self.recorder.add_save_listener(self.on_save_status)
 
         # Build UI
         self.setup_ui()
@@ -238,9 +248,16 @@ class MainWindow(QMainWindow):
         
         # Inits
         self.detect_audio_devices_list()
+        # Vigila altas/bajas de dispositivos (hot-plug) mientras la app está abierta
+        audio_manager.registry.start_watcher()
         self.load_startup_profile()
         self.restart_hotkey_listener()
 
+        # Medidores de nivel: se consulta al core (sin locks) 10 veces por segundo
+        self.level_timer = QTimer(self)
+        self.level_timer.timeout.connect(self.update_audio_meters)
+        self.level_timer.start(100)
+
     def setup_ui(self):
         # Widget principal
         central_widget = QWidget()
@@ -332,7 +349,7 @@ class MainWindow(QMainWindow):
         vid_layout.addWidget(btn_ref_mon, 0, 3)
 
         # Parametros
-        self.mode_combo = QComboBox(); self.mode_combo.addItems(["ddagrab (GPU)", "gdigrab (CPU)"])
+        self.mode_combo = QComboBox(); self.mode_combo.addItems(["ddagrab (GPU)", "gdigrab (CPU)", "x11grab (Linux)", "testsrc (Sintético)"])
         vid_layout.addWidget(QLabel("Motor Captura:"), 1, 0); vid_layout.addWidget(self.mode_combo, 1, 1)
 
         self.fps_spin = QSpinBox(); self.fps_spin.setRange(30, 360); self.fps_spin.setValue(60); self.fps_spin.setSuffix(" FPS")
@@ -341,16 +358,34 @@ class MainWindow(QMainWindow):
         self.bitrate_combo = QComboBox(); self.bitrate_combo.setEditable(True); self.bitrate_combo.addItems(["10000k", "25000k", "50000k", "80000k"])
         vid_layout.addWidget(QLabel("Bitrate (Calidad):"), 2, 0); vid_layout.addWidget(self.bitrate_combo, 2, 1)
 
-        self.codec_combo = QComboBox(); self.codec_combo.addItems(["h264_nvenc (NVIDIA)", "hevc_nvenc (H.265)", "libx264 (CPU)"])
+        self.codec_combo = QComboBox(); self.codec_combo.addItems(["h264_nvenc (NVIDIA)", "hevc_nvenc (H.265)", "libx264 (CPU)", "Auto (Medir)"])
         vid_layout.addWidget(QLabel("Encoder:"), 2, 2); vid_layout.addWidget(self.codec_combo, 2, 3)
         
         # Buffer & Format
-        self.replay_time_spin = QSpinBox(); self.replay_time_spin.setRange(5, 600); self.replay_time_spin.setSuffix(" s")
+        self.replay_time_spin = QSpinBox(); self.replay_time_spin.setRange(5, 3600); self.replay_time_spin.setSuffix(" s")
         vid_layout.addWidget(QLabel("Tiempo Buffer:"), 3, 0); vid_layout.addWidget(self.replay_time_spin, 3, 1)
 
         self.fmt_combo = QComboBox(); self.fmt_combo.addItems(["mkv", "mp4"])
         vid_layout.addWidget(QLabel("Contenedor:"), 3, 2); vid_layout.addWidget(self.fmt_combo, 3, 3)
 
+        # Formato del audio del buffer en RAM (menos memoria en buffers largos / muchas pistas)
+        self.audio_fmt_combo = QComboBox(); self.audio_fmt_combo.addItems(["float32 (Máxima)", "int24 (Estudio)", "int16 (CD)", "flac (Comprimido)"])
+        vid_layout.addWidget(QLabel("Audio en RAM:"), 4, 0); vid_layout.addWidget(self.audio_fmt_combo, 4, 1)
+
+        # Buffers de 30-60 min: solo el último minuto en RAM, el resto en Temp_Processing
+        self.spill_check = QCheckBox("Buffer largo en disco")
+        vid_layout.addWidget(self.spill_check, 4, 2, 1, 2)
+
+        # Grabación por segmentos: se une mientras se graba y sobrevive a un cierre inesperado
+        self.segment_spin = QSpinBox(); self.segment_spin.setRange(0, 3600); self.segment_spin.setSingleStep(60)
+        self.segment_spin.setSuffix(" s"); self.segment_spin.setSpecialValueText("No")
+        vid_layout.addWidget(QLabel("Segmentos:"), 5, 0); vid_layout.addWidget(self.segment_spin, 5, 1)
+
+        # Techo de RAM del replay: el vídeo se ajusta a lo que quede tras el audio y los búferes fijos
+        self.ram_budget_spin = QSpinBox(); self.ram_budget_spin.setRange(0, 65536); self.ram_budget_spin.setSingleStep(256)
+        self.ram_budget_spin.setSuffix(" MB"); self.ram_budget_spin.setSpecialValueText("Sin límite")
+        vid_layout.addWidget(QLabel("RAM máx.:"), 5, 2); vid_layout.addWidget(self.ram_budget_spin, 5, 3)
+
         vid_group.setLayout(vid_layout)
         self.main_layout.addWidget(vid_group)
 
@@ -367,7 +402,24 @@ class MainWindow(QMainWindow):
         btn_add_track.setStyleSheet("background-color: #2979FF; color: white; font-weight: bold; border: none;")
         btn_add_track.clicked.connect(lambda: self.add_audio_track())
         
+        # Un solo hilo de captura para todas las pistas (capture_engine.py)
+        self.shared_engine_check = QCheckBox("Un solo hilo")
+        self.shared_engine_check.setToolTip("Lee todos los dispositivos desde un único hilo (menos CPU con muchas pistas).\n"
+                                            "Límite: si un dispositivo se cuelga al leer, las demás pistas esperan hasta\n"
+                                            "que se detecta (unos 0,5 s); después ese dispositivo pasa a su propio hilo.")
+
+        # Pista 0 con la suma de todas (audio_mix.py), además de las pistas separadas
+        self.mix_check = QCheckBox("Pista mezcla")
+        self.mix_check.setToolTip("Añade una primera pista con todas las pistas mezcladas (con 2 o más pistas)")
+
+        self.btn_calibrate = QPushButton("Calibrar")
+        self.btn_calibrate.setToolTip("Mide cada dispositivo y elige su tamaño de bloque (se guarda en el perfil)")
+        self.btn_calibrate.clicked.connect(self.calibrate_audio)
+
         audio_tools.addWidget(btn_refresh_audio)
+        audio_tools.addWidget(self.btn_calibrate)
+        audio_tools.addWidget(self.shared_engine_check)
+        audio_tools.addWidget(self.mix_check)
         audio_tools.addStretch()
         audio_tools.addWidget(btn_add_track)
         audio_layout.addLayout(audio_tools)
@@ -473,7 +525,15 @@ class MainWindow(QMainWindow):
         for combo, _ in self.audio_track_widgets:
             self._fill_audio_combo(combo)
 
-    def _fill_audio_combo(self, combo, select_device_name=None):
+    def on_audio_device_changed(self, event, name):
+        # Los hilos de captura ya reabren solos por ID; aquí solo se actualizan las listas
+        if event == "added": self.log_message(f"🔌 Dispositivo conectado: {name}")
+        else: self.log_message(f"⚠️ Dispositivo desconectado: {name}")
+        self.cached_audio_devices = audio_manager.registry.devices()
+        for combo, _ in self.audio_track_widgets:
+            self._fill_audio_combo(combo)
+
+    def _fill_audio_combo(self, combo, select_device_name=None, select_device_id=None):
         current_data = combo.currentData()
         combo.clear()
         
@@ -483,26 +543,50 @@ class MainWindow(QMainWindow):
             combo.addItem(display_text, userData=dev)
         
         target_name = select_device_name if select_device_name else (current_data['name'] if current_data else None)
+        target_id = select_device_id if select_device_id else (current_data.get('id') if current_data else None)
         
-        if target_name:
+        if target_name or target_id:
             found = False
-            for i in range(combo.count()):
-                data = combo.itemData(i)
-                if data['name'] == target_name:
-                    combo.setCurrentIndex(i)
-                    found = True
-                    break
+            # Primero por ID (dos dispositivos pueden llamarse igual), luego por nombre (perfiles antiguos)
+            for key, value in (('id', target_id), ('name', target_name)):
+                if not value: continue
+                for i in range(combo.count()):
+                    data = combo.itemData(i)
+                    if data.get(key) == value:
+                        combo.setCurrentIndex(i)
+                        found = True
+                        break
+                if found: break
             if not found:
-                combo.addItem(f"⚠️ [OFFLINE] {target_name}", userData={'name': target_name, 'index': -1})
+                combo.addItem(f"⚠️ [OFFLINE] {target_name}",
+                              userData={'name': target_name, 'index': -1, 'id': target_id})
                 combo.setCurrentIndex(combo.count() - 1)
 
-    def add_audio_track(self, preselect_name=None):
+    def add_audio_track(self, preselect_name=None, preselect_id=None, gate=False, gain=100):
         row_widget = QWidget()
         row_layout = QHBoxLayout(row_widget)
         row_layout.setContentsMargins(0, 0, 0, 0)
         
         combo = QComboBox()
-        self._fill_audio_combo(combo, preselect_name)
+        self._fill_audio_combo(combo, preselect_name, preselect_id)
+
+        # Nivel de pico del último bloque (-60..0 dBFS)
+        meter = QProgressBar()
+        meter.setRange(-60, 0); meter.setValue(-60)
+        meter.setTextVisible(False); meter.setFixedWidth(80); meter.setFixedHeight(10)
+        row_widget.meter = meter
+
+        # Puerta de silencio: los tramos largos en silencio no ocupan RAM ni apenas fichero
+        gate_check = QCheckBox("Puerta")
+        gate_check.setToolTip("Guarda los silencios largos como silencio digital (menos RAM y ficheros más pequeños)")
+        gate_check.setChecked(gate)
+        row_widget.gate_check = gate_check
+
+        # Ganancia de la pista en la mezcla (%)
+        gain_spin = QSpinBox()
+        gain_spin.setRange(0, 200); gain_spin.setSuffix(" %"); gain_spin.setValue(gain)
+        gain_spin.setToolTip("Volumen de esta pista en la pista mezcla")
+        row_widget.gain_spin = gain_spin
         
         btn_del = QPushButton("✕")
         btn_del.setFixedWidth(35)
@@ -510,6 +594,9 @@ class MainWindow(QMainWindow):
         btn_del.clicked.connect(lambda: self.remove_audio_track(row_widget, combo))
         
         row_layout.addWidget(combo, 1)
+        row_layout.addWidget(meter)
+        row_layout.addWidget(gate_check)
+        row_layout.addWidget(gain_spin)
         row_layout.addWidget(btn_del)
         
         self.tracks_layout.addWidget(row_widget)
@@ -520,14 +607,52 @@ class MainWindow(QMainWindow):
         widget.deleteLater()
         self.audio_track_widgets = [t for t in self.audio_track_widgets if t[0] != combo]
 
+    def calibrate_audio(self):
+        if self.recorder.is_recording or self.recorder.is_replay_active:
+            self.log_message("⚠️ Para la grabación y el buffer antes de calibrar.")
+            return
+        self.apply_settings_to_core()
+        tracks = self.recorder.settings.get("audio_tracks", [])
+        if not tracks:
+            self.log_message("No hay pistas de audio que calibrar.")
+            return
+        # Mientras calibra tiene los dispositivos: nada de grabar ni de buffer (el core también lo rechaza)
+        for btn in (self.btn_calibrate, self.btn_rec, self.btn_buff): btn.setEnabled(False)
+        self.log_message(f"Calibrando {len(tracks)} dispositivo(s)...")
+        threading.Thread(target=lambda: self.signals.calibration_done.emit(self.recorder.calibrate_audio_devices(tracks)),
+                         name="audio-calibration", daemon=True).start()
+
+    def on_calibration_done(self, results):
+        for btn in (self.btn_calibrate, self.btn_rec, self.btn_buff): btn.setEnabled(True)
+        for dev_id, r in results.items():
+            self.audio_block_sizes[dev_id] = r["block_size"]
+            self.log_message(f"🎚️ {r['name']}: bloque {r['block_size']} ({r['block_size'] / 48:.1f} ms)")
+        if results: self.save_current_profile()
+
     def get_configured_audio_tracks(self):
         tracks = []
-        for combo, _ in self.audio_track_widgets:
+        for combo, widget in self.audio_track_widgets:
             data = combo.currentData()
             if data and data.get('index') != -1:
-                tracks.append(data)
+                tracks.append(dict(data, silence_gate=widget.gate_check.isChecked(),
+                                   mix_gain=widget.gain_spin.value() / 100))
         return tracks
 
+    def update_audio_meters(self):
+        levels = self.recorder.get_audio_levels()
+        for combo, widget in self.audio_track_widgets:
+            data = combo.currentData()
+            # Por ID: con dos dispositivos del mismo nombre cada medidor sigue siendo el suyo (None es la mezcla)
+            level = levels.get(data['id']) if data and data.get('id') is not None else None
+            # Sin captura (o sin bloques desde hace 1 s): medidor a cero
+            if not level or level['age'] is None or level['age'] > 1.0:
+                widget.meter.setValue(-60)
+                widget.meter.setToolTip("Sin señal")
+                continue
+            widget.meter.setValue(int(max(-60, min(0, level['peak_db']))))
+            state = " (puerta cerrada)" if level['gated'] else ""
+            widget.meter.setToolTip(f"Pico {level['peak_db']:.1f} dBFS, RMS {level['rms_db']:.1f} dBFS{state}")
+
     # ================= LOGICA PERFILES =================
     def load_startup_profile(self):
         names = self.profiles.get_profile_names()
@@ -573,6 +698,13 @@ class MainWindow(QMainWindow):
         self.codec_combo.setCurrentText(data.get("codec", "h264_nvenc"))
         self.replay_time_spin.setValue(data.get("time", 30))
         self.fmt_combo.setCurrentText(data.get("fmt", "mkv"))
+        self.audio_fmt_combo.setCurrentText(data.get("audio_fmt", "float32 (Máxima)"))
+        self.spill_check.setChecked(data.get("spill", False))
+        self.segment_spin.setValue(data.get("segment", 0))
+        self.ram_budget_spin.setValue(data.get("ram_budget", 0))
+        self.shared_engine_check.setChecked(data.get("audio_engine", "threads") == "shared")
+        self.mix_check.setChecked(data.get("mix", False))
+        self.audio_block_sizes = dict(data.get("audio_block_sizes", {}))
         
         idx = self.monitor_combo.findData(data.get("monitor_idx", 0))
         if idx >= 0: self.monitor_combo.setCurrentIndex(idx)
@@ -582,8 +714,13 @@ class MainWindow(QMainWindow):
             self.remove_audio_track(w, cb)
         
         saved_audios = data.get("audio_tracks_names", [])
-        for dev_name in saved_audios:
-            self.add_audio_track(preselect_name=dev_name)
+        saved_ids = data.get("audio_tracks_ids", [])
+        saved_gates = data.get("audio_tracks_gates", [])
+        saved_gains = data.get("audio_tracks_gains", [])
+        for i, dev_name in enumerate(saved_audios):
+            self.add_audio_track(preselect_name=dev_name, preselect_id=saved_ids[i] if i < len(saved_ids) else None,
+                                 gate=saved_gates[i] if i < len(saved_gates) else False,
+                                 gain=saved_gains[i] if i < len(saved_gains) else 100)
 
         self.hotkey_rec_str = data.get("hk_rec", "<f9>")
         self.hotkey_replay_str = data.get("hk_rep", "<f10>")
@@ -594,10 +731,14 @@ class MainWindow(QMainWindow):
         self.log_message(f"Perfil '{name}' cargado.")
 
     def gather_ui_data(self):
-        audio_names = []
-        for combo, _ in self.audio_track_widgets:
+        audio_names, audio_ids, audio_gates, audio_gains = [], [], [], []
+        for combo, widget in self.audio_track_widgets:
             d = combo.currentData()
-            if d: audio_names.append(d['name'])
+            if d:
+                audio_names.append(d['name'])
+                audio_ids.append(d.get('id'))
+                audio_gates.append(widget.gate_check.isChecked())
+                audio_gains.append(widget.gain_spin.value())
 
         return {
             "mode": self.mode_combo.currentText(),
@@ -606,10 +747,20 @@ class MainWindow(QMainWindow):
             "codec": self.codec_combo.currentText(),
             "time": self.replay_time_spin.value(),
             "fmt": self.fmt_combo.currentText(),
+            "audio_fmt": self.audio_fmt_combo.currentText(),
+            "spill": self.spill_check.isChecked(),
+            "segment": self.segment_spin.value(),
+            "ram_budget": self.ram_budget_spin.value(),
+            "audio_engine": "shared" if self.shared_engine_check.isChecked() else "threads",
+            "audio_block_sizes": self.audio_block_sizes,
+            "mix": self.mix_check.isChecked(),
             "hk_rec": self.hotkey_rec_str,
             "hk_rep": self.hotkey_replay_str,
             "monitor_idx": self.monitor_combo.currentData(),
-            "audio_tracks_names": audio_names
+            "audio_tracks_names": audio_names,
+            "audio_tracks_ids": audio_ids,
+            "audio_tracks_gates": audio_gates,
+            "audio_tracks_gains": audio_gains
         }
 
     def save_current_profile(self):
@@ -637,8 +788,9 @@ class MainWindow(QMainWindow):
         br = self.bitrate_combo.currentText()
         if br.isdigit(): br += "k"
         
-        mode_val = "ddagrab" if "ddagrab" in self.mode_combo.currentText() else "gdigrab"
-        codec_val = "h264_nvenc" if "h264" in self.codec_combo.currentText() else "hevc_nvenc" if "hevc" in self.codec_combo.currentText() else "libx264"
+        mode_val = get_backend(self.mode_combo.currentText()).name
+        codec_txt = self.codec_combo.currentText()
+        codec_val = "auto" if "Auto" in codec_txt else "h264_nvenc" if "h264" in codec_txt else "hevc_nvenc" if "hevc" in codec_txt else "libx264"
         
         s = {
             "fps": self.fps_spin.value(),
@@ -647,6 +799,13 @@ class MainWindow(QMainWindow):
             "container": self.fmt_combo.currentText(),
             "save_path": self.path_input.text(),
             "replay_time": self.replay_time_spin.value(),
+            "audio_ram_format": self.audio_fmt_combo.currentText().split()[0],
+            "spill_to_disk": self.spill_check.isChecked(),
+            "segment_seconds": self.segment_spin.value(),
+            "ram_budget_mb": self.ram_budget_spin.value(),
+            "audio_engine": "shared" if self.shared_engine_check.isChecked() else "threads",
+            "audio_block_sizes": dict(self.audio_block_sizes),
+            "mix_track": self.mix_check.isChecked(),
             "capture_mode": mode_val,
             "monitor_idx": self.monitor_combo.currentData(),
             "audio_tracks": self.get_configured_audio_tracks()
@@ -682,18 +841,25 @@ class MainWindow(QMainWindow):
             if not tracks: self.log_message("⚠️ Grabando SIN AUDIO (No hay pistas).")
             
             try:
-                self.recorder.start_recording()
+                # Con el buffer activo la grabación empieza con lo que ya hay en él (sin reiniciar la captura)
+                if self.recorder.is_replay_active:
+                    self.recorder.start_recording_from_buffer()
+                    self.log_message(f"🔴 Grabando desde el buffer...")
+                else:
+                    self.recorder.start_recording()
+                    self.log_message(f"🔴 Grabando...")
                 self.btn_rec.setText("⏹ DETENER GRABACIÓN")
                 self.btn_rec.setObjectName("btn_rec_stop")
                 self.apply_theme() # Refresh style for ID change
-                self.log_message(f"🔴 Grabando...")
             except Exception as e: self.log_message(f"Error: {e}")
         else:
+            pending_buffer = self.recorder.buffer_stop_pending
             self.recorder.stop_recording()
             self.btn_rec.setText("🔴 INICIAR GRABACIÓN")
             self.btn_rec.setObjectName("btn_rec_start")
             self.apply_theme()
             self.log_message("⬜ Grabación Guardada.")
+            if pending_buffer and not self.recorder.is_replay_active: self.on_buffer_closed()
 
     def toggle_buffer(self):
         if not self.recorder.is_replay_active:
@@ -707,20 +873,35 @@ class MainWindow(QMainWindow):
                 self.log_message(f"🟢 Buffer Activo (RAM).")
             except Exception as e: self.log_message(f"Error: {e}")
         else:
-            self.recorder.stop_replay_buffer()
-            self.btn_buff.setText("⚡ ACTIVAR BUFFER")
-            self.btn_buff.setObjectName("btn_buff_start")
-            self.apply_theme()
-            self.btn_save.setEnabled(False)
-            self.log_message("⚪ Buffer Cerrado.")
+            # Con una grabación colgada del buffer la captura sigue hasta que esa grabación acabe
+            if not self.recorder.stop_replay_buffer():
+                self.btn_buff.setText("⏳ SE CIERRA AL GRABAR")
+                self.btn_save.setEnabled(False)
+                self.log_message("⏳ El buffer se cerrará al detener la grabación.")
+                return
+            self.on_buffer_closed()
+
+    def on_buffer_closed(self):
+        self.btn_buff.setText("⚡ ACTIVAR BUFFER")
+        self.btn_buff.setObjectName("btn_buff_start")
+        self.apply_theme()
+        self.btn_save.setEnabled(False)
+        self.log_message("⚪ Buffer Cerrado.")
 
     def save_replay(self):
+        # La captura es instantánea; el mux va a la cola del core (no bloquea el atajo)
         if self.recorder.is_replay_active:
-            self.signals.log.emit("💾 Guardando..."); threading.Thread(target=self._save_th).start()
-    
-    def _save_th(self):
-        try: self.recorder.save_replay(); self.signals.log.emit("✅ Clip Guardado.")
-        except Exception as e: self.signals.log.emit(f"❌ Error: {e}")
+            try: self.recorder.save_replay()
+            except Exception as e: self.signals.log.emit(f"❌ Error: {e}")
+
+    def on_save_status(self, job_id, status, info):
+        if status == "queued": self.signals.log.emit(f"💾 Guardando clip #{job_id}...")
+        elif status == "done": self.signals.log.emit(f"✅ Clip #{job_id} Guardado ({info.get('latency', 0):.1f}s).")
+        elif status == "rejected":
+            reason = "sin RAM en el presupuesto" if info.get('reason') == "memory" else "cola de guardado llena"
+            self.signals.log.emit(f"⚠️ Clip descartado: {reason}.")
+        elif status == "failed": self.signals.log.emit(f"❌ Error guardando clip #{job_id}: {info.get('error', 'FFmpeg')}")
+        elif status == "cancelled": self.signals.log.emit(f"⏹ Clip #{job_id} cancelado.")
 
     # --- HOTKEYS ---
     def start_hotkey_recording(self, t):
@@ -763,7 +944,8 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, e):
         if self.hotkey_listener: self.hotkey_listener.stop()
-        self.recorder.stop_recording(); self.recorder.stop_replay_buffer(); e.accept()
+        audio_manager.registry.stop_watcher()
+        self.recorder.stop_recording(); self.recorder.stop_replay_buffer(); self.recorder.wait_for_saves(); e.accept()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
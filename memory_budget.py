@@ -0,0 +1,92 @@
+import os
+
+from audio_buffer import REPLAY_MARGIN_SECONDS
+
+MB = 1024 * 1024
+
+# Bytes por muestra y canal de cada formato del anillo de audio (flac: peor caso razonable, ~60% de int24)
+AUDIO_BYTES_PER_SAMPLE = {"float32": 4, "int16": 2, "int24": 3, "flac": 1.8}
+# El TS añade cabeceras de paquete/PES al bitrate del encoder, y el CBR de NVENC tiene picos
+TS_OVERHEAD = 1.1
+# Lo que cabe en el pipe de Python: ~1 s de vídeo, dentro de estos límites
+PIPE_MIN, PIPE_MAX = 1 * MB, 16 * MB
+# -rtbufsize de FFmpeg (frames en bruto esperando al encoder): una parte del presupuesto, acotada
+RTBUF_SHARE, RTBUF_MIN, RTBUF_MAX = 0.1, 64 * MB, 512 * MB
+
+
+def video_byte_rate(bitrate):
+    """'6000k' -> bytes por segundo."""
+    return int(str(bitrate)[:-1]) * 1000 / 8
+
+
+def audio_ring_bytes(seconds, sample_format, samplerate=48000, channels=2):
+    return int((seconds + REPLAY_MARGIN_SECONDS) * samplerate * channels * AUDIO_BYTES_PER_SAMPLE.get(sample_format, 4))
+
+
+def rtbuf_bytes(budget_mb):
+    """Tamaño de -rtbufsize para un presupuesto (0 = sin presupuesto: el valor de siempre)."""
+    if not budget_mb: return 2048 * MB
+    return int(min(RTBUF_MAX, max(RTBUF_MIN, budget_mb * MB * RTBUF_SHARE)))
+
+
+def plan_replay_memory(settings, track_count, live_audio=False):
+    """
+    Reparte `ram_budget_mb` entre los búferes del replay. Lo que tiene tamaño fijo (anillos de
+    audio, AAC en vivo, pipe, -rtbufsize, la copia de audio de UN guardado) se resta primero y lo
+    que queda es el techo del vídeo en RAM. Devuelve un dict en bytes con las asignaciones y
+    `video_seconds`, los segundos de vídeo que caben al bitrate configurado.
+    `saves` es lo que ocupa la copia float32 de un guardado (0 si el audio va en AAC o se lee del
+    disco): un guardado cabe siempre; los siguientes que se encolen solo entran si su copia cabe
+    en lo que sobra del presupuesto (RecorderCore.save_replay los rechaza si no).
+    """
+    budget = int(settings.get("ram_budget_mb", 0) or 0) * MB
+    replay_time = settings["replay_time"]
+    byte_rate = video_byte_rate(settings["bitrate"]) * TS_OVERHEAD
+    spill = settings.get("spill_to_disk") and replay_time > settings.get("ram_tier_seconds", 60)
+    ram_seconds = settings.get("ram_tier_seconds", 60) if spill else replay_time
+
+    audio_format = settings.get("audio_ram_format", "float32")
+    per_track = audio_ring_bytes(ram_seconds, audio_format)
+    aac = int((replay_time + 2) * video_byte_rate(settings.get("audio_bitrate", "320k"))) if live_audio else 0
+    pipe = int(min(PIPE_MAX, max(PIPE_MIN, byte_rate)))
+    rtbuf = rtbuf_bytes(settings.get("ram_budget_mb", 0))
+    # El clip puede pasar de replay_time hasta un GOP: mismo margen que el vídeo
+    saves = 0 if live_audio or spill else int((replay_time + 2) * 48000 * 2 * 4) * track_count
+
+    plan = {
+        "budget": budget, "audio_per_track": per_track, "audio": per_track * track_count,
+        "aac": aac * track_count, "saves": saves, "pipe": pipe, "rtbuf": rtbuf,
+    }
+    fixed = plan["audio"] + plan["aac"] + saves + pipe + rtbuf
+    wanted = int((ram_seconds + 2) * byte_rate)   # + un GOP de más y margen
+    if not budget:
+        plan["video"] = None if not spill else wanted
+    else:
+        plan["video"] = min(wanted, max(0, budget - fixed))
+        if fixed > budget:
+            print(f"[MEM] El audio y los búferes fijos ({fixed / MB:.0f} MB) ya superan el presupuesto "
+                  f"({budget / MB:.0f} MB): usa un formato de audio más pequeño o menos pistas")
+    plan["video_seconds"] = replay_time if plan["video"] is None else plan["video"] / byte_rate
+    plan["spill"] = spill
+    plan["total"] = fixed + (plan["video"] or wanted)
+    return plan
+
+
+def pipe_backlog(pipe):
+    """Bytes esperando en un pipe (stdout de FFmpeg) que aún no hemos leído, o None si no se sabe."""
+    try:
+        fd = pipe.fileno()
+        if os.name == "nt":
+            import ctypes
+            import msvcrt
+            avail = ctypes.c_ulong(0)
+            ok = ctypes.windll.kernel32.PeekNamedPipe(msvcrt.get_osfhandle(fd), None, 0, None, ctypes.byref(avail), None)
+            return avail.value if ok else None
+        import fcntl
+        import termios
+        import array
+        buf = array.array("i", [0])
+        fcntl.ioctl(fd, termios.FIONREAD, buf, True)
+        return buf[0]
+    except Exception:
+        return None
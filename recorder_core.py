@@ -4,21 +4,89 @@ import shutil
 import time
 import threading
 import collections
+import itertools
+import queue
 import sys
+import math
 import numpy as np
 import soundfile as sf
 from pathlib import Path
 
 # Importamos el manager de audio
 import audio_manager 
+from audio_buffer import make_audio_ring, AudioRangeReader
+from audio_sync import DriftEstimator, StreamingResampler
+from audio_writer import AudioFileWriter
+from audio_encoder import LiveAACEncoder
+from audio_mix import AudioMixer
+from capture_engine import AudioCaptureEngine
+import audio_calibration
+from video_buffer import TSVideoRingBuffer, TSFileSink, write_parts
+from ffmpeg_jobs import FFmpegJob
+from spill import SpillFile
+from segmented_recording import SegmentedRecording, recover_recordings
+from memory_budget import MB, TS_OVERHEAD, plan_replay_memory, pipe_backlog, rtbuf_bytes, video_byte_rate
+from capture_backends import get_backend
+from ffmpeg_caps import FFmpegCapabilities, resolve_ffmpeg_executable
+import encoder_probe
+from encoder_probe import ENCODER_PROFILES
+
+# FFmpeg puede leer pipes extra (pipe:N) heredando descriptores solo en POSIX.
+# En Windows el audio del modo pipe cae a WAV temporales; el vídeo sí va siempre por stdin.
+AUDIO_PIPES_SUPPORTED = os.name == "posix"
+# La historia del buffer se copia a la pista de grabación en trozos de este tamaño
+HISTORY_CHUNK_SECONDS = 10
+# Puerta de silencio (pistas con 'silence_gate'): un bloque cuyo pico no pasa de SILENCE_GATE_DB
+# es silencio; tras SILENCE_GATE_HOLD_SECONDS seguidos, la pista se guarda como silencio digital
+SILENCE_GATE_DB = -60.0
+SILENCE_GATE_HOLD_SECONDS = 2.0
+# Suelo de los medidores (dBFS) para bloques a cero
+LEVEL_FLOOR_DB = -120.0
+# Nombre de la pista de mezcla (la primera del fichero cuando está activada)
+MIX_TRACK_NAME = "Mezcla"
+
+
+def _to_db(value):
+    return 20 * math.log10(value) if value > 1e-6 else LEVEL_FLOOR_DB
+
+
+def _new_capture_stats():
+    return {"blocks": 0, "max_stall_ms": 0.0, "total_stall_ms": 0.0}
+
+
+def _snapshot_bytes(jobs):
+    """RAM que retienen las copias de audio (float32) de estos guardados."""
+    return sum(a['data'].nbytes for job in jobs for a in job['audio'] if a.get('data') is not None)
+
+
+def _track_stall(stats, seconds):
+    """Acumula el tiempo que un hilo de captura pasa fuera de su lectura (procesando un bloque)."""
+    ms = seconds * 1000
+    stats["blocks"] += 1
+    stats["total_stall_ms"] += ms
+    if ms > stats["max_stall_ms"]: stats["max_stall_ms"] = ms
+
+
+class _DeviceLost(Exception):
+    """Fallo del dispositivo (abrirlo o leer de él): se reabre. Lo demás es un error del hilo."""
+
 
 class AudioWorker(threading.Thread):
     """
     Hilo de grabación de audio de ALTA FIDELIDAD (32-bit float).
+    Cada dispositivo tiene su propio reloj: se mide su deriva contra time.monotonic() y se
+    remuestrea al vuelo para que todas las pistas sigan alineadas en grabaciones de horas.
+    El dispositivo se busca por su ID estable (audio_manager.DeviceRegistry). Si se desconecta,
+    el hilo espera a que vuelva y lo reabre; el hueco se rellena con silencio para no desalinear.
+    Con `engine` (capture_engine.py) no hay hilo propio: start() lo registra en el motor compartido,
+    que lee el dispositivo y llama a _consume() con cada bloque.
     """
-    def __init__(self, device_index, device_name, filename, is_buffer_mode=False, buffer_duration=30):
-        super().__init__()
-        self.device_index = device_index
+    def __init__(self, device_id, device_name, filename, is_buffer_mode=False, buffer_duration=30,
+                 clock_origin=None, drift_correction=True, writer=None, buffer_format="float32", encoder=None,
+                 spill_path=None, ram_seconds=None, segment_seconds=None, engine=None, block_size=4096,
+                 silence_gate=False, mix=None, mix_index=0):
+        super().__init__(name=f"audio-{device_name}")
+        self.device_id = device_id
         self.device_name = device_name
         self.filename = filename
         self.running = True
@@ -26,69 +94,381 @@ class AudioWorker(threading.Thread):
         
         # 48kHz es el estándar nativo para evitar glitches robóticos
         self.samplerate = 48000 
-        self.block_size = 4096 
+        self.block_size = int(block_size)
         self.subtype = 'FLOAT' 
         
-        # Lock para evitar errores si leemos el buffer mientras se escribe
-        self.lock = threading.Lock()
-        
-        # --- BÚFER MASIVO ---
-        # Multiplicamos por 5.0 la duración para que SOBRE audio.
-        # Luego el sistema recortará el exceso, pero así aseguramos que nunca falte.
-        safety_multiplier = 5.0
-        
-        maxlen = int((self.samplerate * (buffer_duration * safety_multiplier)) / self.block_size)
-        self.ram_buffer = collections.deque(maxlen=maxlen)
+        # --- BÚFER CIRCULAR PREASIGNADO ---
+        # Tamaño exacto: replay_time + un margen pequeño (ver audio_buffer.py).
+        # Solo reservamos memoria en modo buffer; en grabación se escribe directo a disco.
+        # buffer_format: float32 / int16 / int24 / flac (los snapshots siempre salen en float32)
+        # spill_path: buffers largos en fichero mapeado, con solo `ram_seconds` residentes
+        self.ram_buffer = make_audio_ring(buffer_duration, self.samplerate, 2, buffer_format,
+                                          spill_path=spill_path, ram_seconds=ram_seconds) if is_buffer_mode else None
         self.error = None
+        # Tiempo que el hilo pasa procesando cada bloque (si crece, el recorder pierde audio)
+        self.stats = _new_capture_stats()
+        # Motor compartido: cuánto llevaba listo cada bloque al leerlo y lecturas con más de un bloque de retraso
+        self.stats.update(max_latency_ms=0.0, latency_ms_total=0.0, underruns=0)
+        self.engine = engine
+        self._finished = threading.Event()
+
+        # --- MEDIDORES Y PUERTA DE SILENCIO ---
+        # (rms dBFS, pico dBFS, puerta cerrada, sello) del último bloque. Se sustituye la tupla entera,
+        # así la UI la lee sin lock y nunca ve valores de dos bloques distintos.
+        self.levels = (LEVEL_FLOOR_DB, LEVEL_FLOOR_DB, False, None)
+        self.silence_gate = silence_gate
+        self._gate_threshold = 10 ** (SILENCE_GATE_DB / 20)
+        self._gate_hold = int(SILENCE_GATE_HOLD_SECONDS * self.samplerate)
+        self._quiet_frames = 0
+        self.stats["gated_frames"] = 0
+        # Pista de mezcla (MixTrack) a la que se manda cada bloque ya procesado, como entrada `mix_index`
+        self.mix = mix
+        self.mix_index = mix_index
+
+        # --- RELOJ COMPARTIDO (audio_sync.py) ---
+        # clock_origin: time.monotonic() en que empieza la grabación; la primera muestra del WAV
+        # se coloca ahí (con silencio delante si el dispositivo tardó en abrir).
+        self.clock_origin = clock_origin
+        self.drift = DriftEstimator(self.samplerate)
+        self.resampler = StreamingResampler() if drift_correction else None
+        self.frames_in = 0
+        self._aligned = False
+        self._last_end = None    # time.monotonic() de la última muestra entregada
+        self._gap_from = None    # Tras reabrir: desde dónde hay que rellenar con silencio
+        self.reopens = 0
+
+        # Grabación: el disco lo escribe un único hilo (audio_writer.py); aquí solo se encola
+        self.writer = writer
+        self._own_writer = False
+        self.sink = None
+        # Grabación por segmentos: `filename` es un patrón %d y el WAV se parte cada segment_seconds
+        self.segment_frames = int(segment_seconds * self.samplerate) if segment_seconds else None
+        # Replay: AAC en vivo junto al anillo PCM (audio_encoder.py), para guardar MP4 sin recodificar
+        self.encoder = encoder
+        # Modo buffer: consumidores en vivo (pista de grabación, otros...) que reciben cada bloque.
+        # La lista se sustituye entera al cambiar, así el hilo de captura la recorre sin lock.
+        self.sinks = []
+        # El hilo de captura engancha cada consumidor nuevo entre dos bloques
+        self._attach_lock = threading.Lock()
+        self._pending_sink = None
+        self._attach_frame = None
+        self._attached = threading.Event()
+
+    def _correct(self, data, captured_at):
+        """Mide la deriva con el bloque recién llegado y lo devuelve remuestreado a 48 kHz exactos."""
+        self.frames_in += len(data)
+        ratio = self.drift.feed(self.frames_in, captured_at)
+        if self.resampler is not None:
+            data = self.resampler.process(data, ratio)
+        return data
+
+    def _align_start(self, data, captured_at):
+        """Primer bloque de una grabación: rellena o recorta para que empiece en clock_origin."""
+        self._aligned = True
+        if self.clock_origin is None: return data
+        lead = int(round((captured_at - len(data) / self.samplerate - self.clock_origin) * self.samplerate))
+        if lead > 0:
+            return np.concatenate((np.zeros((lead, data.shape[1]), dtype=data.dtype), data))
+        return data[-lead:]
+
+    def _gap_fill(self, data, captured_at):
+        """
+        Tras reabrir el dispositivo: silencio desde la última muestra entregada hasta el inicio de
+        este bloque, para que la pista siga en el mismo reloj que el vídeo. None si no hay hueco.
+        """
+        if self._gap_from is None: return None
+        gap = int(round((captured_at - len(data) / self.samplerate - self._gap_from) * self.samplerate))
+        self._gap_from = None
+        if gap <= 0: return None
+        return np.zeros((gap, data.shape[1]), dtype=np.float32)
+
+    def _measure(self, data, captured_at):
+        """
+        RMS y pico del bloque (vectorizado, sin temporales del tamaño del bloque) y estado de la puerta.
+        Devuelve True si el bloque va como silencio.
+        """
+        flat = data.reshape(-1)
+        if not len(flat): return False
+        peak = max(float(flat.max()), -float(flat.min()))
+        rms = math.sqrt(float(np.dot(flat, flat)) / len(flat))
+        if peak < self._gate_threshold:
+            self._quiet_frames += len(data)
+        else:
+            self._quiet_frames = 0
+        gated = self.silence_gate and self._quiet_frames >= self._gate_hold
+        self.levels = (_to_db(rms), _to_db(peak), gated, captured_at)
+        if gated: self.stats["gated_frames"] += len(data)
+        return gated
+
+    def get_levels(self):
+        """Últimos niveles de la pista (lo consulta la UI; sin locks)."""
+        rms_db, peak_db, gated, stamp = self.levels
+        return {"rms_db": rms_db, "peak_db": peak_db, "gated": gated,
+                "age": None if stamp is None else time.monotonic() - stamp}
+
+    def _consume(self, data, captured_at):
+        """Procesa un bloque recién capturado: deriva, alineación y reparto al disco o al anillo."""
+        data = self._correct(data, captured_at)
+        gap = self._gap_fill(data, captured_at)
+        self._last_end = captured_at
+        silent = self._measure(data, captured_at)
+        if silent: data = np.zeros_like(data)
+        if not self.is_buffer_mode:
+            if gap is not None: data = np.concatenate((gap, data))
+            if not self._aligned: data = self._align_start(data, captured_at)
+            # Nunca bloquea: si el disco no da abasto se cuenta un overrun
+            self.sink.push(data)
+            if self.mix is not None: self.mix.push(self.mix_index, data, captured_at)
+            return
+        if gap is not None:
+            # El silencio entra en el anillo con su propio sello (acaba donde empieza el bloque)
+            gap_end = captured_at - len(data) / self.samplerate
+            self._consume_buffer(gap, gap_end)
+            if self.mix is not None: self.mix.push(self.mix_index, gap, gap_end)
+        self._consume_buffer(data, captured_at, silent)
+        if self.mix is not None: self.mix.push(self.mix_index, data, captured_at)
+
+    def _consume_buffer(self, data, captured_at, silent=False):
+        # El anillo gestiona su propio lock (solo para el cursor)
+        if silent:
+            # Puerta cerrada: el anillo no copia nada (y suelta esa memoria)
+            self.ram_buffer.write_silence(len(data), captured_at)
+        else:
+            self.ram_buffer.write(data, captured_at)
+        if self.encoder is not None: self.encoder.push(data)
+        sinks = self.sinks
+        # Una sola lectura: attach_sink() lo pone a None si se cansa de esperar
+        pending = self._pending_sink
+        if pending is not None:
+            # Frontera exacta: lo que ya está en el anillo va como historia, lo siguiente en vivo
+            self._attach_frame = self.ram_buffer.total_frames
+            self.sinks = sinks + [pending]
+            self._pending_sink = None
+            self._attached.set()
+        for sink in sinks:
+            sink.push(data)
+
+    def _open_device(self):
+        """Busca el dispositivo por su ID; si no está (desenchufado) espera a que el registro lo vea volver."""
+        warned = False
+        while self.running:
+            mic = audio_manager.get_mic(self.device_id)
+            if mic is not None: return mic
+            if self._last_end is None and not self.is_buffer_mode and not warned:
+                print(f"[AUDIO-THREAD] {self.device_name} no está conectado, esperando...")
+            warned = True
+            audio_manager.registry.wait_for_change(timeout=1.0)
+        return None
+
+    def _reset_clock(self):
+        """Dispositivo nuevo (o reabierto) = reloj nuevo: la deriva se vuelve a medir desde cero."""
+        self._gap_from = self._last_end
+        self.drift = DriftEstimator(self.samplerate)
+        if self.resampler is not None: self.resampler = StreamingResampler()
+        self.frames_in = 0
+
+    def _open_sink(self):
+        """MODO GRABACIÓN: abre la pista en el escritor de disco (en modo buffer no hay nada que abrir)."""
+        if self.is_buffer_mode: return
+        # Sin escritor compartido (uso suelto de AudioWorker) creamos uno propio
+        self._own_writer = self.writer is None
+        if self._own_writer:
+            self.writer = AudioFileWriter()
+            self.writer.start()
+        self.sink = self.writer.open_track(self.filename, self.samplerate, 2, self.subtype, self.block_size,
+                                           segment_frames=self.segment_frames)
+
+    def _close_sink(self):
+        if self.sink is None: return
+        self.writer.close_track(self.sink)
+        if self._own_writer: self.writer.stop()
+
+    def _on_device_lost(self, error):
+        # Desconectado (o el driver se reinició): se reabre en cuanto vuelva, sin parar la grabación
+        print(f"[AUDIO-THREAD] {self.device_name} se ha perdido ({error}), se reabrirá al volver")
+        self.reopens += 1
+        self._reset_clock()
+
+    def _track_block(self, seconds):
+        _track_stall(self.stats, seconds)
+
+    def start(self):
+        if self.engine is None: return super().start()
+        self.engine.add(self)
+
+    def join(self, timeout=None):
+        if self.engine is None: return super().join(timeout)
+        self._finished.wait(timeout)
 
     def run(self):
+        self._own_writer = False
         try:
-            mic = audio_manager.get_mic_object_by_index(self.device_index)
-            if not mic: return
-
-            if not self.is_buffer_mode:
-                # MODO GRABACIÓN
-                with sf.SoundFile(self.filename, mode='w', samplerate=self.samplerate, channels=2, subtype=self.subtype) as file:
-                    with mic.recorder(samplerate=self.samplerate, blocksize=self.block_size) as recorder:
-                        while self.running:
-                            data = recorder.record(numframes=self.block_size)
-                            file.write(data)
-            else:
-                # MODO BUFFER
-                with mic.recorder(samplerate=self.samplerate, blocksize=self.block_size) as recorder:
-                    while self.running:
-                        data = recorder.record(numframes=self.block_size)
-                        # Protegemos la escritura en RAM
-                        with self.lock:
-                            self.ram_buffer.append(data)
-                        
+            # MODO GRABACIÓN: la pista se abre antes que el dispositivo
+            self._open_sink()
+            self._capture_loop()
         except Exception as e:
             self.error = e
             print(f"[AUDIO-THREAD] Error grabando {self.device_name}: {e}")
+        finally:
+            self._close_sink()
+            self._finished.set()
+
+    def _capture_loop(self):
+        """Abre el dispositivo y lee de él hasta parar; si se pierde, espera a que vuelva y lo reabre."""
+        while self.running:
+            mic = self._open_device()
+            if mic is None: break
+            try:
+                self._capture(mic)
+            except _DeviceLost as e:
+                if not self.running: break
+                self._on_device_lost(e.__cause__)
+                audio_manager.registry.wait_for_change(timeout=1.0)
+
+    def _capture(self, mic):
+        """
+        Lee `mic` hasta que se pare el hilo. Solo lo que falla en el recorder sale como _DeviceLost;
+        un error de _consume (disco, anillo...) sube tal cual y termina el hilo con self.error.
+        """
+        try:
+            recorder = mic.recorder(samplerate=self.samplerate, blocksize=self.block_size)
+            recorder.__enter__()
+        except Exception as e:
+            raise _DeviceLost(e) from e
+        try:
+            while self.running:
+                try:
+                    data = recorder.record(numframes=self.block_size)
+                except Exception as e:
+                    raise _DeviceLost(e) from e
+                # Sello en el reloj compartido con el vídeo: record() vuelve al completarse el bloque
+                captured_at = time.monotonic()
+                t0 = time.perf_counter()
+                self._consume(data, captured_at)
+                self._track_block(time.perf_counter() - t0)
+        finally:
+            try: recorder.__exit__(None, None, None)
+            except Exception: pass
 
     def stop(self):
         self.running = False
     
-    def get_snapshot(self):
+    def attach_sink(self, sink, t_start=None, timeout=2.0):
         """
-        Devuelve una COPIA instantánea de lo que hay en RAM.
+        Modo buffer: empieza a mandar los bloques a `sink` sin parar la captura. `sink` necesita
+        push(bloque) y release(historia): la historia (el audio del anillo desde `t_start`, un
+        iterable que se lee a trozos) se le entrega después de engancharlo y debe ir delante de
+        lo que ya haya recibido (AudioTrackQueue retenido). Devuelve False si el hilo no llegó a engancharlo (dispositivo caído).
+        """
+        first = None
+        if t_start is not None:
+            frames = self.ram_buffer.frame_range(t_start, t_start)
+            if frames is not None: first = frames[0]
+        with self._attach_lock:
+            self._attached.clear()
+            self._pending_sink = sink
+            if not self._attached.wait(timeout):
+                self._pending_sink = None
+                sink.release()
+                return False
+            end = self._attach_frame
+        # La historia no se copia aquí (hilo de la UI): la va leyendo del anillo el escritor
+        sink.release(self._history(first, end) if first is not None else ())
+        return True
+
+    def _history(self, first, end):
+        """Audio del anillo [first, end) a trozos de HISTORY_CHUNK_SECONDS, copiado según se pide."""
+        step = HISTORY_CHUNK_SECONDS * self.samplerate
+        for start in range(first, end, step):
+            chunk = self.ram_buffer.snapshot_frames(start, min(start + step, end))
+            if chunk is not None: yield chunk
+
+    def detach_sink(self, sink):
+        """Deja de mandar bloques a `sink` (como mucho recibe uno más si el hilo ya lo estaba repartiendo)."""
+        self.sinks = [s for s in self.sinks if s is not sink]
+
+    def get_snapshot(self, max_frames=None):
+        """
+        Devuelve una COPIA instantánea de lo que hay en RAM (los últimos `max_frames` si se indica).
         Esto se hace antes de escribir a disco para asegurar sincronía perfecta.
         """
-        with self.lock:
-            if not self.ram_buffer: return None
-            try:
-                return np.concatenate(self.ram_buffer)
-            except: return None
+        if self.ram_buffer is None: return None
+        try:
+            return self.ram_buffer.get_snapshot(max_frames)
+        except: return None
 
-    def save_snapshot_to_file(self, audio_data):
-        """Escribe los datos capturados a disco"""
-        if audio_data is None: return False
+    def get_encoded_range(self, t_start, t_end):
+        """
+        Frames AAC del encoder en vivo para t_start..t_end: (partes ADTS, desfase en s) o None.
+        El desfase (< 1 frame) es lo que hay que retrasar la pista para que case con el vídeo.
+        """
+        if self.encoder is None or self.ram_buffer is None: return None
         try:
-            sf.write(self.filename, audio_data, self.samplerate, subtype=self.subtype)
-            return True
-        except Exception as e:
-            print(f"[AUDIO-THREAD] Error guardando wav: {e}")
-            return False
+            frames = self.ram_buffer.frame_range(t_start, t_end)
+            if frames is None: return None
+            parts, offset = self.encoder.snapshot_frames(*frames)
+            return (parts, offset) if parts else None
+        except: return None
+
+    def get_snapshot_range(self, t_start, t_end):
+        """COPIA del audio capturado entre t_start y t_end (time.monotonic(), el reloj del vídeo)."""
+        if self.ram_buffer is None: return None
+        try:
+            return self.ram_buffer.snapshot_range(t_start, t_end)
+        except: return None
+
+    def get_stream_range(self, t_start, t_end):
+        """
+        Anillo en disco: el audio de t_start..t_end como AudioRangeReader (se lee a trozos al
+        guardar, sin copia entera). None si el anillo está en RAM o no hay sellos.
+        """
+        if self.ram_buffer is None or getattr(self.ram_buffer, "spill", None) is None: return None
+        try:
+            return self.ram_buffer.reader_range(t_start, t_end)
+        except: return None
+
+    def is_silent_range(self, t_start, t_end):
+        """¿Estuvo la puerta cerrada todo t_start..t_end? Entonces no hace falta copiar nada."""
+        if self.ram_buffer is None or not self.silence_gate: return False
+        frames = self.ram_buffer.frame_range(t_start, t_end)
+        return frames is not None and self.ram_buffer.is_silent(*frames)
+
+
+class MixTrack(AudioWorker):
+    """
+    Pista de mezcla: la suma en vivo de todas las pistas, cada una con su ganancia (audio_mix.py).
+    No tiene dispositivo ni hilo: los AudioWorker le pasan sus bloques ya corregidos y lo mezclado
+    sigue el mismo camino que el bloque de un dispositivo (anillo, AAC en vivo, pistas de grabación),
+    así que guardarla cuesta lo mismo que guardar una pista más. Va como pista 0 del fichero.
+    """
+    def __init__(self, gains, filename=None, is_buffer_mode=False, buffer_duration=30, clock_origin=None, **kwargs):
+        super().__init__(None, MIX_TRACK_NAME, filename, is_buffer_mode, buffer_duration,
+                         clock_origin=clock_origin, drift_correction=False, **kwargs)
+        # En grabación la mezcla empieza en clock_origin, como los WAV de cada pista
+        self.mixer = AudioMixer(gains, self.samplerate, origin=clock_origin)
+        self._mix_lock = threading.Lock()
+
+    def push(self, index, data, captured_at):
+        """Lo llaman los hilos de captura: el lock ordena las sumas y las escrituras del anillo."""
+        with self._mix_lock:
+            mixed = self.mixer.push(index, data, captured_at)
+            if mixed is None: return
+            block, stamp = mixed
+            t0 = time.perf_counter()
+            self._measure(block, stamp)
+            if self.is_buffer_mode:
+                self._consume_buffer(block, stamp)
+            elif self.sink is not None:
+                self.sink.push(block)
+            self._track_block(time.perf_counter() - t0)
+
+    def start(self):
+        # MODO GRABACIÓN: abre su WAV en el escritor compartido
+        self._open_sink()
+
+    def join(self, timeout=None):
+        # Los workers ya pararon: lo que quede en la cola se escribe y el fichero se cierra
+        self._close_sink()
 
 
 class RecorderCore:
@@ -96,15 +476,47 @@ class RecorderCore:
         self.process = None
         self.is_recording = False
         self.is_replay_active = False
+        # Cierre del buffer aplazado hasta que acabe la grabación colgada de él
+        self.buffer_stop_pending = False
         
-        self.ffmpeg_exec = self._detect_ffmpeg_executable()
+        self.ffmpeg_exec = resolve_ffmpeg_executable()
         print(f"[CORE] Motor de video: {self.ffmpeg_exec}")
+        # Encoders/filtros/dispositivos del FFmpeg: caché en disco, cargada en segundo plano
+        self.caps = FFmpegCapabilities(self.ffmpeg_exec)
+        self.caps.load_async()
         
-        self.video_ram_buffer = collections.deque()
-        self.video_ram_lock = threading.Lock()
+        # Se crea al arrancar el buffer (depende de replay_time)
+        self.video_ram_buffer = None
+        self.video_spill = None
+        self.memory_plan = None     # Reparto del presupuesto de RAM del replay en curso
+        # Calibración en marcha: tiene los dispositivos abiertos y los filtros de warnings cambiados
+        # (globales al proceso), así que no se puede arrancar ninguna captura hasta que acabe
+        self.calibrating = False
+        self._calibration_lock = threading.Lock()
         self.video_thread = None
+        self.video_stats = _new_capture_stats()
         
         self.audio_workers = []
+        self.mix_track = None          # MixTrack de la sesión (settings["mix_track"] con 2+ pistas)
+        self.audio_writer = None
+        self.recording_session = None   # SegmentedRecording en curso (o terminando el concat)
+        self.finishing_sessions = []    # Sesiones ya paradas cuyo concat sigue en segundo plano
+        # Grabación colgada del proceso del buffer: TSFileSink del vídeo y (worker, pista) de audio
+        self.video_sink = None
+        self.buffer_tracks = []
+
+        # --- COLA DE GUARDADO ---
+        # La captura del clip es instantánea (referencias + snapshots); el mux va a una cola
+        # acotada que atienden `save_workers` hilos. Los callbacks reciben (job_id, estado, info).
+        self.save_queue = None
+        self.save_workers = []
+        self.save_listeners = []
+        self._save_ids = itertools.count(1)
+        self._save_lock = threading.Lock()
+        self._last_capture = None   # (monotonic, job_id) para agrupar pulsaciones seguidas
+        self.save_jobs = {}         # Guardados en cola o en marcha, por id (se quitan al terminar)
+        self._deferred_closes = []  # Desbordes a disco de un buffer ya parado que algún guardado aún lee
+        self.mux_jobs = {}          # FFmpegJob en marcha, por nombre ("save-3", "recording"...)
         
         self.temp_dir = Path(os.getcwd()) / "Temp_Processing"
         self.recordings_dir = Path(os.getcwd()) / "Recordings"
@@ -119,53 +531,144 @@ class RecorderCore:
             "replay_time": 30,
             "capture_mode": "ddagrab",
             "monitor_idx": 0,
+            "save_mode": "pipe",   # "pipe": RAM -> FFmpeg en una pasada | "files": temporales en disco
+            "save_workers": 1,          # Muxes simultáneos
+            "save_queue_size": 4,       # Clips capturados esperando mux (el resto se rechaza)
+            "save_coalesce_window": 1.0,  # Pulsaciones dentro de esta ventana = mismo clip
+            "mux_stall_timeout": 30,    # Segundos sin progreso antes de dar un mux por colgado
+            "drift_correction": True,   # Remuestrear cada tarjeta a su deriva medida (audio_sync.py)
+            "audio_ram_format": "float32",  # Audio del replay en RAM: float32 | int16 | int24 | flac
+            "live_audio_encode": "auto",    # AAC en vivo para el replay: auto (solo si no es mkv) | always | off
+            "audio_bitrate": "320k",
+            "spill_to_disk": False,     # Replay largo: lo más antiguo a ficheros mapeados en Temp_Processing
+            "ram_tier_seconds": 60,     # Segundos más recientes que se quedan en RAM con spill_to_disk
+            "ram_budget_mb": 0,         # Techo de RAM del replay (búferes + pipe + -rtbufsize); 0 = sin límite
+            "segment_seconds": 0,       # Grabación: 0 = un fichero y mux al parar | N = segmentos de N s unidos en segundo plano
+            "audio_engine": "threads",  # "threads": un hilo por pista | "shared": un solo hilo para todos los dispositivos
+            "mix_track": False,         # Pista 0 extra con la suma de todas (ganancia por pista: track['mix_gain'])
+            "gated_audio_flac": False,  # MKV: pistas con puerta de silencio en FLAC (24 bits enteros, ya no float32 exacto)
+            "audio_block_sizes": {},    # Muestras por bloque por ID de dispositivo (calibrate_audio_devices; por defecto 4096)
             "audio_tracks": []
         }
 
-    def _detect_ffmpeg_executable(self):
-        if getattr(sys, 'frozen', False):
-            base_dir = sys._MEIPASS
-        else:
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-        local_ffmpeg = os.path.join(base_dir, "ffmpeg.exe")
-        return local_ffmpeg if os.path.exists(local_ffmpeg) else "ffmpeg"
+        # Sonda de encoders: solo con codec "auto" (update_settings la lanza si se elige después).
+        # Con un encoder fijo no se abre ninguna sesión NVENC/AMF/QSV de prueba
+        self.encoder_probe_results = {}
+        self.encoder_probe_thread = None
+        self._probe_lock = threading.Lock()
+        if self.settings["codec"] == "auto": self.probe_encoders()
+
+        # Grabaciones por segmentos que quedaron a medias (cierre inesperado)
+        if self.temp_dir.exists():
+            threading.Thread(target=recover_recordings, args=(self.temp_dir, self._mux_files, self.ffmpeg_exec),
+                             name="recording-recovery", daemon=True).start()
+
+    # ==========================================================
+    #  ENCODER AUTOMÁTICO (codec = "auto")
+    # ==========================================================
+    def _probe_key(self):
+        return (self.settings["fps"], self.settings.get("resolution", "1920x1080"))
+
+    def probe_encoders(self, background=True, force=False):
+        """
+        Mide qué encoder aguanta los fps/resolución configurados (ver encoder_probe.py).
+        El resultado se cachea junto a las capacidades del FFmpeg, así que solo la primera vez cuesta unos segundos.
+        """
+        key = self._probe_key()
+        def _run():
+            result = encoder_probe.get_best_encoder(self.ffmpeg_exec, key[0], key[1], force=force, caps=self.caps)
+            with self._probe_lock:
+                self.encoder_probe_results[key] = result
+            speed = f"x{result['speed']:.2f}" if result.get('speed') else "sin medir"
+            print(f"[PROBE] Encoder elegido para {key[1]}@{key[0]}: {result['encoder']} ({speed})")
+        if not background:
+            _run()
+            return
+        t = threading.Thread(target=_run, name="encoder-probe", daemon=True)
+        t.start()
+        self.encoder_probe_thread = t
+
+    def _resolve_codec(self):
+        """
+        Devuelve el codec real. Con "auto" usa la sonda o su caché; si aún no hay resultado no se
+        espera (se llega aquí desde el hilo de la UI): la medición sigue en segundo plano y esta
+        sesión usa libx264, que está en cualquier FFmpeg.
+        """
+        codec = self.settings["codec"]
+        if codec != "auto": return codec
+        key = self._probe_key()
+        with self._probe_lock:
+            result = self.encoder_probe_results.get(key)
+        if result is None and self.caps.ready:
+            result = self.caps.get_probe(*key)
+            if result:
+                with self._probe_lock: self.encoder_probe_results[key] = result
+        if result: return result["encoder"]
+        if not (self.encoder_probe_thread and self.encoder_probe_thread.is_alive()):
+            self.probe_encoders()
+        print("[PROBE] La medición de encoders aún no ha terminado: esta sesión usa libx264")
+        return "libx264"
+
+    def _check_capabilities(self, backend, codec):
+        """
+        Comprueba contra la caché de capacidades que existen la fuente y el encoder, y cae a
+        alternativas seguras si no. Si la caché aún no ha cargado no se espera: se sigue tal cual.
+        """
+        if not self.caps.ready: return backend, codec
+        if not self.caps.has_encoder(codec):
+            print(f"[CAPS] Encoder {codec} no disponible en este FFmpeg, se usa libx264")
+            codec = "libx264"
+        missing = [name for kind, name in backend.requirements("nvenc" in codec) if not self.caps.has(kind, name)]
+        if missing:
+            print(f"[CAPS] A este FFmpeg le falta {', '.join(missing)} para capturar con {backend.name}")
+            # ddagrab sin soporte (FFmpeg antiguo o sin D3D11): gdigrab captura en cualquier Windows
+            if backend.name == "ddagrab" and self.caps.has("devices", "gdigrab"):
+                print("[CAPS] Se usa gdigrab en su lugar")
+                backend = get_backend("gdigrab")
+        return backend, codec
 
     def update_settings(self, new_settings):
         self.settings.update(new_settings)
+        # Si cambian fps/resolución con codec auto, medimos ya en segundo plano
+        if self.settings["codec"] == "auto" and self._probe_key() not in self.encoder_probe_results:
+            self.probe_encoders()
         if not os.path.exists(self.settings["save_path"]):
             os.makedirs(self.settings["save_path"])
         if not self.temp_dir.exists():
             self.temp_dir.mkdir(parents=True)
 
-    def _get_video_cmd(self, output_target, is_buffer_mode=False):
+    def _get_video_cmd(self, output_target, is_buffer_mode=False, segment=None):
+        """segment: (segundos, lista_csv) para grabar por segmentos; output_target es entonces un patrón %d."""
         fps = str(self.settings["fps"])
         bitrate = self.settings["bitrate"]
-        codec = self.settings["codec"]
+        codec = self._resolve_codec()
         capture_mode = self.settings.get("capture_mode", "ddagrab")
-        monitor_idx = self.settings.get("monitor_idx", 0)
+        backend, codec = self._check_capabilities(get_backend(capture_mode), codec)
+        if is_buffer_mode and not encoder_probe.supports_ts_buffer(codec):
+            # El búfer no encontraría ningún keyframe y los guardados saldrían vacíos
+            print(f"[BUFFER] {codec} no sirve para el búfer de replay (MPEG-TS), se usa libx264")
+            codec = "libx264"
         using_nvenc = "nvenc" in codec
+        profile = ENCODER_PROFILES.get(codec, {"args": ["-preset", "ultrafast"]})
 
         cmd = [
             self.ffmpeg_exec, "-y", "-hide_banner", 
             "-thread_queue_size", "9192", 
-            "-rtbufsize", "2048M"
+            "-rtbufsize", f"{rtbuf_bytes(self.settings.get('ram_budget_mb', 0)) // MB}M"
         ]
         
-        if "ddagrab" in capture_mode and using_nvenc:
-            cmd.extend(["-init_hw_device", "d3d11va=gpu:0", "-filter_hw_device", "gpu"])
-            cmd.extend(["-extra_hw_frames", "256"]) 
-            cmd.extend([
-                "-f", "lavfi",
-                "-i", f"ddagrab=framerate={fps}:draw_mouse=0:output_idx={monitor_idx}"
-            ])
-        elif "ddagrab" in capture_mode:
-            cmd.extend([
-                "-f", "lavfi",
-                "-i", f"ddagrab=framerate={fps}:draw_mouse=0:output_idx={monitor_idx}",
-                "-vf", "hwdownload,format=nv12"
-            ])
-        else:
-            cmd.extend(["-f", "gdigrab", "-framerate", fps, "-i", "desktop"])
+        # Dispositivos hw que necesita el encoder (p.ej. VAAPI) van antes de las entradas
+        cmd.extend(profile.get("pre", []))
+        # La fuente (ddagrab, gdigrab, x11grab, testsrc...) la decide el backend de captura
+        input_args = backend.input_args(self.settings, using_nvenc)
+        if profile.get("vf"):
+            # Si el backend ya trae filtro (hwdownload...), encadenamos el del encoder detrás
+            if "-vf" in input_args:
+                i = input_args.index("-vf") + 1
+                input_args = input_args[:i] + [input_args[i] + "," + profile["vf"]] + input_args[i + 1:]
+            else:
+                input_args = input_args + ["-vf", profile["vf"]]
+        cmd.extend(input_args)
 
         cmd.extend(["-c:v", codec])
         bitrate_val = int(bitrate[:-1])
@@ -183,10 +686,24 @@ class RecorderCore:
                 cmd.extend(["-preset", "p4", "-rc", "cbr"])
             cmd.extend(["-g", str(fps_val)]) 
         else:
-            cmd.extend(["-preset", "ultrafast"])
+            # Ajustes de baja latencia propios de cada encoder (encoder_probe.py)
+            cmd.extend(profile["args"])
+            # GOP de 1 segundo: el búfer de replay descarta y corta por keyframes
+            if is_buffer_mode: cmd.extend(["-g", fps])
+
+        if segment:
+            # Keyframe forzado en cada corte: el segmento k empieza justo en k*segundos, igual que su WAV
+            seconds, segment_list = segment
+            cmd.extend(["-force_key_frames", f"expr:gte(t,n_forced*{seconds})",
+                        "-f", "segment", "-segment_time", str(seconds), "-segment_format", "matroska",
+                        # Clusters de 1 s volcados al momento: tras un cierre inesperado el .mkv a medias se puede leer
+                        "-segment_format_options", "cluster_time_limit=1000:flush_packets=1",
+                        "-reset_timestamps", "1", "-segment_list", str(segment_list), "-segment_list_type", "csv"])
 
         if is_buffer_mode:
-            cmd.extend(["-f", "mpegts", "-muxdelay", "0.1", "-"])
+            # -flush_packets: cada frame sale al pipe en cuanto se codifica, así la hora de
+            # llegada sirve para situar los PTS en el reloj de captura (video_buffer.py)
+            cmd.extend(["-f", "mpegts", "-muxdelay", "0.1", "-flush_packets", "1", "-"])
         else:
             cmd.append(output_target)
             
@@ -195,42 +712,140 @@ class RecorderCore:
     # ==========================================================
     #  BUFFER
     # ==========================================================
+    def _make_audio_engine(self):
+        """Motor compartido para los AudioWorker de esta sesión, o None (un hilo por pista)."""
+        if self.settings.get("audio_engine", "threads") != "shared": return None
+        return AudioCaptureEngine()
+
+    def _mix_enabled(self):
+        return bool(self.settings.get("mix_track")) and len(self.settings.get("audio_tracks", [])) > 1
+
+    def _audio_outputs(self):
+        """Pistas que van al fichero, en orden: la mezcla (si la hay) y después una por dispositivo."""
+        return ([self.mix_track] if self.mix_track is not None else []) + self.audio_workers
+
+    def _make_live_encoder(self, name):
+        if not self._use_live_audio(): return None
+        try:
+            return LiveAACEncoder(self.ffmpeg_exec, self.settings["replay_time"],
+                                  bitrate=self.settings.get("audio_bitrate", "320k"), name=name)
+        except Exception as e:
+            print(f"[BUFFER] Sin AAC en vivo para {name}: {e}")
+            return None
+
+    def _block_size(self, track):
+        return int(self.settings.get("audio_block_sizes", {}).get(track.get('id'), audio_calibration.DEFAULT_BLOCK))
+
+    def calibrate_audio_devices(self, tracks=None):
+        """
+        Mide cada dispositivo con varios tamaños de bloque (audio_calibration.py) y guarda el elegido
+        en settings["audio_block_sizes"]. Bloquea unos segundos por dispositivo: llamar desde un hilo.
+        Devuelve {id: resultado}; vacío si hay una captura en marcha (los dispositivos están ocupados).
+        """
+        with self._calibration_lock:
+            if self.is_recording or self.is_replay_active or self.calibrating:
+                print("[CALIB] Para la grabación o el buffer antes de calibrar")
+                return {}
+            self.calibrating = True
+        try:
+            tracks = tracks if tracks is not None else self.settings.get("audio_tracks", [])
+            results = audio_calibration.calibrate_devices(tracks)
+        finally:
+            self.calibrating = False
+        sizes = dict(self.settings.get("audio_block_sizes", {}))
+        sizes.update({dev_id: r["block_size"] for dev_id, r in results.items()})
+        self.settings["audio_block_sizes"] = sizes
+        return results
+
+    def _spill_enabled(self):
+        return self.settings.get("spill_to_disk") and self.settings["replay_time"] > self.settings.get("ram_tier_seconds", 60)
+
+    def _check_not_calibrating(self):
+        # Llamar con _calibration_lock: o arranca la captura o la calibración, nunca las dos
+        if self.calibrating:
+            raise RuntimeError("Calibración de audio en marcha: espera a que termine")
+
     def start_replay_buffer(self):
         if self.is_replay_active: return
-        self.video_ram_buffer.clear()
+        with self._calibration_lock:
+            self._check_not_calibrating()
+            self._start_replay_buffer()
+
+    def _start_replay_buffer(self):
+        replay_time = self.settings["replay_time"]
+        ram_seconds = self.settings.get("ram_tier_seconds", 60)
+        spill_tag = int(time.time())
+        # Presupuesto de RAM: lo fijo (audio, pipe, -rtbufsize...) primero, el resto para el vídeo
+        track_count = len(self.settings.get("audio_tracks", [])) + (1 if self._mix_enabled() else 0)
+        plan = self.memory_plan = plan_replay_memory(self.settings, track_count,
+                                                     self._use_live_audio())
+        if not plan["spill"] and plan["video_seconds"] < replay_time:
+            # Sin nivel de disco el presupuesto recortaría la ventana: mejor no arrancar que guardar clips cortos
+            raise RuntimeError(f"El presupuesto de RAM ({plan['budget'] / MB:.0f} MB) solo da para "
+                               f"{plan['video_seconds']:.0f}s de vídeo de {replay_time}s: súbelo, baja el "
+                               f"bitrate o activa el desborde a disco")
+        if self._spill_enabled():
+            # Nivel de disco: ventana completa + margen al bitrate configurado (el resto lo cubre _evict)
+            byte_rate = video_byte_rate(self.settings["bitrate"]) * TS_OVERHEAD
+            self.video_spill = SpillFile(self.temp_dir / f"replay_video_{spill_tag}.spill", (replay_time + 10) * byte_rate)
+            self.video_ram_buffer = TSVideoRingBuffer(replay_time, spill=self.video_spill, ram_bytes=plan["video"])
+            print(f"[BUFFER] Desborde a disco: {self.video_spill.capacity / MB:.0f} MB de vídeo, {plan['video'] / MB:.0f} MB en RAM")
+        else:
+            self.video_ram_buffer = TSVideoRingBuffer(replay_time, ram_bytes=plan["video"])
+        if plan["budget"]:
+            print(f"[MEM] Presupuesto {plan['budget'] / MB:.0f} MB: vídeo {(plan['video'] or 0) / MB:.0f}, "
+                  f"audio {plan['audio'] / MB:.0f}, guardado {plan['saves'] / MB:.0f}, rtbuf {plan['rtbuf'] / MB:.0f}")
         
         cmd = self._get_video_cmd(None, is_buffer_mode=True)
         print("[BUFFER] Video RAM Iniciado...")
-        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, bufsize=128*1024*1024)
+        # El pipe de Python solo necesita ~1 s de vídeo: el histórico vive en el búfer TS
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, bufsize=plan["pipe"])
         
         self.is_replay_active = True
-        self.video_thread = threading.Thread(target=self._video_buffer_worker)
+        self.video_stats = _new_capture_stats()
+        self.video_thread = threading.Thread(target=self._video_buffer_worker, name="video-reader")
         self.video_thread.start()
         
         self.audio_workers = []
-        for i, track in enumerate(self.settings.get("audio_tracks", [])):
-            worker = AudioWorker(track['index'], track['name'], None, True, self.settings["replay_time"])
+        engine = self._make_audio_engine()
+        tracks = self.settings.get("audio_tracks", [])
+        self.mix_track = None
+        if self._mix_enabled():
+            spill_path = self.temp_dir / f"replay_audio_{spill_tag}_mix.spill" if self._spill_enabled() else None
+            self.mix_track = MixTrack([t.get('mix_gain', 1.0) for t in tracks], None, True, replay_time,
+                                      buffer_format=self.settings.get("audio_ram_format", "float32"),
+                                      encoder=self._make_live_encoder(MIX_TRACK_NAME),
+                                      spill_path=spill_path, ram_seconds=ram_seconds)
+        for i, track in enumerate(tracks):
+            encoder = self._make_live_encoder(track['name'])
+            spill_path = self.temp_dir / f"replay_audio_{spill_tag}_{i}.spill" if self._spill_enabled() else None
+            worker = AudioWorker(track['id'], track['name'], None, True, self.settings["replay_time"],
+                                 drift_correction=self.settings.get("drift_correction", True),
+                                 buffer_format=self.settings.get("audio_ram_format", "float32"), encoder=encoder,
+                                 spill_path=spill_path, ram_seconds=ram_seconds,
+                                 engine=engine, block_size=self._block_size(track),
+                                 silence_gate=track.get('silence_gate', False), mix=self.mix_track, mix_index=i)
             worker.start()
             self.audio_workers.append(worker)
 
+    def _use_live_audio(self):
+        """¿Se guarda el audio ya comprimido? En MKV va PCM sin pérdidas, salvo que se pida siempre."""
+        mode = self.settings.get("live_audio_encode", "auto")
+        if mode == "always": return True
+        return mode == "auto" and self.settings["container"].lower() != "mkv"
+
     def _video_buffer_worker(self):
-        bitrate_k = int(self.settings["bitrate"].replace('k', ''))
-        bytes_per_sec = (bitrate_k * 1000) / 8
-        # Reducimos el multiplicador de seguridad del video para que no se pase tanto de tiempo
-        max_buffer_size = int(bytes_per_sec * self.settings["replay_time"] * 1.3)
-        
-        chunk = 8 * 1024 * 1024 
-        current_size = 0
+        # El búfer TS indexa keyframes y descarta GOPs por tiempo (ver video_buffer.py).
+        # read1 devuelve lo que haya en el pipe sin esperar a llenar el chunk entero.
+        chunk = 1024 * 188
         try:
             while self.is_replay_active and self.process:
-                data = self.process.stdout.read(chunk)
+                data = self.process.stdout.read1(chunk)
                 if not data: break
-                with self.video_ram_lock:
-                    self.video_ram_buffer.append(data)
-                    current_size += len(data)
-                    while current_size > max_buffer_size and self.video_ram_buffer:
-                        removed = self.video_ram_buffer.popleft()
-                        current_size -= len(removed)
+                arrival = time.monotonic()
+                t0 = time.perf_counter()
+                self.video_ram_buffer.feed(data, arrival)
+                _track_stall(self.video_stats, time.perf_counter() - t0)
         except: pass
 
     # ==========================================================
@@ -238,81 +853,525 @@ class RecorderCore:
     # ==========================================================
     def start_recording(self):
         if self.is_recording: return
+        if self.is_replay_active:
+            # Un solo encode: la grabación cuelga del FFmpeg del buffer en vez de abrir otra captura
+            # (otra sesión NVENC y el doble de GPU). Empieza en el último keyframe.
+            return self._start_attached_recording(0)
+        with self._calibration_lock:
+            self._check_not_calibrating()
+            self._start_recording()
+
+    def _start_recording(self):
         timestamp = int(time.time())
         self.temp_video_path = self.temp_dir / f"temp_vid_{timestamp}.mkv"
         self.final_output_path = Path(self.settings["save_path"]) / f"Recording_{timestamp}.{self.settings['container']}"
-        
-        cmd = self._get_video_cmd(str(self.temp_video_path), is_buffer_mode=False)
+        segment_seconds = int(self.settings.get("segment_seconds", 0) or 0)
+        tracks = self.settings.get("audio_tracks", [])
+        mix = self._mix_enabled()
+
+        if segment_seconds > 0:
+            # Por segmentos: cada trozo se une mientras se sigue grabando (segmented_recording.py)
+            self.recording_session = SegmentedRecording(
+                self._mux_files, self.ffmpeg_exec, self.temp_dir, timestamp, self.final_output_path,
+                segment_seconds, ([MIX_TRACK_NAME] if mix else []) + [t['name'] for t in tracks],
+                sinks=lambda: [w.sink for w in self._audio_outputs()],
+                stall_timeout=self.settings.get("mux_stall_timeout", 30))
+            session = self.recording_session
+            cmd = self._get_video_cmd(session.video_pattern, is_buffer_mode=False,
+                                      segment=(segment_seconds, session.segment_list))
+        else:
+            self.recording_session = None
+            cmd = self._get_video_cmd(str(self.temp_video_path), is_buffer_mode=False)
         print(f"[REC] Grabando...")
+        # Instante común de arranque: todas las pistas de audio empiezan aquí
+        clock_origin = time.monotonic()
         self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
         
+        self.audio_writer = AudioFileWriter()
+        self.audio_writer.start()
         self.audio_workers = []
-        for i, track in enumerate(self.settings.get("audio_tracks", [])):
-            wav_filename = self.temp_dir / f"temp_audio_{timestamp}_{i}.wav"
-            worker = AudioWorker(track['index'], track['name'], str(wav_filename), False)
+        engine = self._make_audio_engine()
+        self.mix_track = None
+        if mix:
+            if self.recording_session:
+                mix_filename = self.recording_session.audio[0]['pattern']
+            else:
+                mix_filename = self.temp_dir / f"temp_audio_{timestamp}_mix.wav"
+            self.mix_track = MixTrack([t.get('mix_gain', 1.0) for t in tracks], str(mix_filename), False,
+                                      clock_origin=clock_origin, writer=self.audio_writer,
+                                      segment_seconds=segment_seconds or None)
+            self.mix_track.start()
+        for i, track in enumerate(tracks):
+            if self.recording_session:
+                wav_filename = self.recording_session.audio[i + (1 if mix else 0)]['pattern']
+            else:
+                wav_filename = self.temp_dir / f"temp_audio_{timestamp}_{i}.wav"
+            worker = AudioWorker(track['id'], track['name'], str(wav_filename), False, clock_origin=clock_origin,
+                                 drift_correction=self.settings.get("drift_correction", True), writer=self.audio_writer,
+                                 segment_seconds=segment_seconds or None,
+                                 engine=engine, block_size=self._block_size(track),
+                                 silence_gate=track.get('silence_gate', False), mix=self.mix_track, mix_index=i)
             worker.start()
             self.audio_workers.append(worker)
+        if self.recording_session: self.recording_session.start()
+        self.is_recording = True
+
+    @property
+    def recording_from_buffer(self):
+        return self.video_sink is not None
+
+    def start_recording_from_buffer(self):
+        """
+        Grabación retroactiva: el fichero empieza con lo que ya hay en el buffer de replay y sigue
+        con la misma captura (mismo FFmpeg y mismos hilos de audio, sin reiniciar nada).
+        """
+        if self.is_recording or not self.is_replay_active: return False
+        return self._start_attached_recording(self.settings["replay_time"])
+
+    def attach_video_sink(self, sink, history=None):
+        """
+        Engancha un consumidor al vídeo del buffer (un solo encode, tantas salidas como se quiera).
+        `sink` necesita push(trozo TS); con `history` recibe antes esos segundos ya capturados.
+        Devuelve (segundos de historia, instante monotonic de su keyframe inicial) o None sin buffer.
+        """
+        if not self.is_replay_active: return None
+        return self.video_ram_buffer.attach(sink, history)
+
+    def detach_video_sink(self, sink):
+        if self.video_ram_buffer: self.video_ram_buffer.detach(sink)
+
+    def _start_attached_recording(self, history):
+        """
+        Grabación que cuelga del proceso del buffer: el vídeo se engancha al búfer TS y cada pista
+        de audio a su hilo de captura; ambos empiezan en el mismo keyframe, como un guardado de
+        replay. history=0 empieza en el último keyframe (como mucho un GOP antes de ahora).
+        """
+        timestamp = int(time.time())
+        self.temp_video_path = self.temp_dir / f"temp_vid_{timestamp}.ts"
+        self.final_output_path = Path(self.settings["save_path"]) / f"Recording_{timestamp}.{self.settings['container']}"
+        self.recording_session = None
+
+        self.video_sink = TSFileSink(self.temp_video_path)
+        self.video_sink.start()
+        history, clip_start = self.video_ram_buffer.attach(self.video_sink, history)
+        self.audio_writer = AudioFileWriter()
+        self.audio_writer.start()
+        self.buffer_tracks = []
+        for i, worker in enumerate(self._audio_outputs()):
+            wav_filename = self.temp_dir / f"temp_audio_{timestamp}_{i}.wav"
+            track = self.audio_writer.open_track(str(wav_filename), worker.samplerate, 2, worker.subtype,
+                                                 worker.block_size, held=True)
+            if not worker.attach_sink(track, clip_start):
+                print(f"[REC] {worker.device_name} no responde, la pista quedará vacía")
+            self.buffer_tracks.append((worker, track))
         self.is_recording = True
+        print(f"[REC] Grabando desde el buffer ({history:.1f}s de historia)...")
+        return True
+
+    def _stop_recording_from_buffer(self):
+        """Suelta los consumidores (la captura del buffer sigue) y une vídeo y audio."""
+        self.video_ram_buffer.detach(self.video_sink)
+        audio_inputs = []
+        for worker, track in self.buffer_tracks:
+            worker.detach_sink(track)
+            self.audio_writer.close_track(track)
+            audio_inputs.append({'name': worker.device_name, 'path': track.filename, 'gated': worker.silence_gate})
+        self.buffer_tracks = []
+        self.video_sink.close()
+        self.video_sink = None
+        self.audio_writer.stop()
+        self.audio_writer = None
+        self.is_recording = False
+        self._mux_files(self.temp_video_path, audio_inputs, self.final_output_path, job_name="recording")
+        # El buffer se pidió cerrar mientras grababa: era el último consumidor
+        if self.buffer_stop_pending: self.stop_replay_buffer()
 
     def stop_recording(self):
         if not self.is_recording: return
+        if self.recording_from_buffer:
+            self._stop_recording_from_buffer()
+            return
         self._stop_ffmpeg()
         for worker in self.audio_workers:
             worker.stop()
             worker.join()
+        if self.mix_track is not None: self.mix_track.join()
+        self.audio_writer.stop()
+        self.audio_writer = None
         self.is_recording = False
+        if self.recording_session:
+            # Casi todo está ya unido: el último segmento y el concat van en segundo plano
+            self.recording_session.finish()
+            # Se sigue vigilando aunque empiece otra grabación (wait_for_saves la espera al cerrar)
+            self.finishing_sessions = [s for s in self.finishing_sessions if s.thread and s.thread.is_alive()]
+            self.finishing_sessions.append(self.recording_session)
+            return
         # En modo normal no usamos recorte, guardamos todo
-        self._mux_files(self.temp_video_path, self.audio_workers, self.final_output_path, trim_duration=None)
+        audio_inputs = [{'name': w.device_name, 'path': w.filename, 'gated': w.silence_gate} for w in self._audio_outputs()]
+        self._mux_files(self.temp_video_path, audio_inputs, self.final_output_path, job_name="recording")
 
     # ==========================================================
-    #  GUARDADO INTELIGENTE (SNAPSHOT + TRIM)
+    #  GUARDADO INTELIGENTE (SNAPSHOT + COLA DE MUX)
     # ==========================================================
+    def add_save_listener(self, callback):
+        """
+        callback(job_id, status, info). Estados: queued, coalesced, rejected, running,
+        progress (info = stats de FFmpeg), done, failed, cancelled.
+        """
+        self.save_listeners.append(callback)
+
+    def _notify_save(self, job_id, status, **info):
+        for cb in list(self.save_listeners):
+            try: cb(job_id, status, info)
+            except Exception as e: print(f"[SAVE] Error en callback: {e}")
+
     def save_replay(self):
-        if not self.is_replay_active: return
-        print("[SAVE] Iniciando guardado sincronizado...")
+        """
+        Captura el clip AHORA y encola el mux. No bloquea: devuelve el id del trabajo
+        (el mismo si se agrupa con una pulsación reciente) o None si no se pudo encolar.
+        """
+        if not self.is_replay_active: return None
+        with self._save_lock:
+            now = time.monotonic()
+            # Pulsaciones seguidas del atajo = un único clip
+            if self._last_capture and now - self._last_capture[0] < self.settings.get("save_coalesce_window", 1.0):
+                job_id = self._last_capture[1]
+                self._notify_save(job_id, "coalesced")
+                return job_id
+
+            self._ensure_save_workers()
+            if self.save_queue.full():
+                # Backpressure: nunca acumulamos clips sin límite (cada uno retiene RAM).
+                # Se mira antes de capturar: una pulsación rechazada no copia nada
+                job_id = next(self._save_ids)
+                print(f"[SAVE] Cola llena, clip #{job_id} descartado")
+                self._notify_save(job_id, "rejected", reason="queue_full")
+                return None
+            if not self._save_fits_budget():
+                # La copia del audio de este clip pasaría del presupuesto de RAM
+                job_id = next(self._save_ids)
+                print(f"[SAVE] Sin RAM en el presupuesto para otro clip, #{job_id} descartado")
+                self._notify_save(job_id, "rejected", reason="memory")
+                return None
+            job = self._capture_replay()
+            if job is None: return None
+            # Solo este método encola (bajo _save_lock), así que tras full() hay sitio seguro
+            self._last_capture = (now, job['id'])
+            self.save_jobs[job['id']] = job
+            self._notify_save(job['id'], "queued", pending=self.save_queue.qsize() + 1)
+            self.save_queue.put_nowait(job)
+            return job['id']
+
+    def _save_fits_budget(self):
+        """
+        ¿Cabe otra copia de audio (plan["saves"]) sin pasar de ram_budget_mb? La de un guardado
+        está reservada en el plan; las de los demás en cola salen de lo que el plan dejó libre.
+        Llamar con _save_lock.
+        """
+        plan = self.memory_plan
+        if not plan or not plan["budget"] or not plan["saves"]: return True
+        # La reserva cubre la copia nueva; las que ya esperan tienen que caber en lo que sobra
+        headroom = max(0, plan["budget"] - plan["total"])
+        return _snapshot_bytes(self.save_jobs.values()) <= headroom
+
+    def _capture_replay(self):
+        """
+        1. CAPTURA INSTANTÁNEA (Evita desfase Video vs Audio)
+        El clip de vídeo empieza en un keyframe, así que puede durar algo más que replay_time.
+        Vídeo y audio llevan sellos del mismo reloj (time.monotonic()), así que cada pista se
+        corta aquí a la ventana exacta del vídeo: [keyframe, último frame]. FFmpeg ya no recorta.
+        """
+        # Fijado: si el clip empieza en el disco, el anillo no lo recicla hasta que acabe el guardado
+        parts, clip_seconds, clip_start, pin = self.video_ram_buffer.pin_clip(self.settings["replay_time"])
+        if not clip_seconds: return None
+        # El último PTS es el inicio del último frame: la ventana acaba un frame después
+        clip_end = None if clip_start is None else clip_start + clip_seconds + 1.0 / self.settings["fps"]
+        audio = []
+        use_encoded = self._use_live_audio()
+        for worker in self._audio_outputs():
+            if use_encoded and clip_start is not None:
+                # AAC ya codificado: solo referencias a frames, el mux hace copia de paquetes
+                encoded = worker.get_encoded_range(clip_start, clip_end)
+                if encoded is not None:
+                    audio.append({'name': worker.device_name, 'adts': encoded[0], 'offset': encoded[1],
+                                  'samplerate': worker.samplerate})
+                    continue
+            if clip_start is not None and worker.is_silent_range(clip_start, clip_end):
+                # Puerta cerrada todo el clip: ni copia ni pipe, FFmpeg genera el silencio
+                audio.append({'name': worker.device_name, 'silence': clip_end - clip_start,
+                              'samplerate': worker.samplerate, 'gated': True})
+                continue
+            stream = worker.get_stream_range(clip_start, clip_end) if clip_start is not None else None
+            if stream is not None:
+                # Nivel de disco: como el vídeo, se lee del fichero mapeado al muxear
+                audio.append({'name': worker.device_name, 'stream': stream, 'samplerate': worker.samplerate,
+                              'gated': worker.silence_gate})
+                continue
+            snap = worker.get_snapshot_range(clip_start, clip_end) if clip_start is not None else None
+            if snap is None:
+                # Sin sellos todavía: las últimas muestras con la duración del clip
+                snap = worker.get_snapshot(int(clip_seconds * worker.samplerate))
+            if snap is not None:
+                audio.append({'name': worker.device_name, 'data': snap, 'samplerate': worker.samplerate,
+                              'gated': worker.silence_gate})
+
+        job_id = next(self._save_ids)
         timestamp = int(time.time())
-        
-        # 1. CAPTURA INSTANTÁNEA (Evita desfase Video vs Audio)
-        # Capturamos el audio de la RAM *antes* de ponernos a escribir el video (que es lento)
-        audio_snapshots = []
-        for worker in self.audio_workers:
-            audio_snapshots.append(worker.get_snapshot())
-            
-        # 2. Escribir Video RAM -> Disco
-        ts_filename = self.temp_dir / f"temp_replay_vid_{timestamp}.ts"
+        return {
+            'id': job_id,
+            # El id en el nombre evita que dos clips del mismo segundo se pisen
+            'tag': f"{timestamp}_{job_id}",
+            'created': time.monotonic(),
+            'video_parts': parts,
+            'video_pin': (self.video_ram_buffer, pin) if pin is not None else None,
+            'clip_seconds': clip_seconds,
+            'audio': audio,
+            'final_path': Path(self.settings["save_path"]) / f"Replay_{timestamp}_{job_id}.{self.settings['container']}",
+            'save_mode': self.settings.get("save_mode", "pipe"),
+            # Lo activa cancel_save(); es lo que decide si el guardado acabó "cancelled"
+            'cancel': threading.Event(),
+        }
+
+    def _ensure_save_workers(self):
+        if self.save_queue is None:
+            self.save_queue = queue.Queue(maxsize=max(1, int(self.settings.get("save_queue_size", 4))))
+        self.save_workers = [t for t in self.save_workers if t.is_alive()]
+        while len(self.save_workers) < max(1, int(self.settings.get("save_workers", 1))):
+            t = threading.Thread(target=self._save_worker_loop, name=f"save-worker-{len(self.save_workers)}", daemon=True)
+            t.start()
+            self.save_workers.append(t)
+
+    def _save_worker_loop(self):
+        while True:
+            job = self.save_queue.get()
+            job_id, cancel = job['id'], job['cancel']
+            try:
+                if cancel.is_set():
+                    self._notify_save(job_id, "cancelled")
+                    continue
+                self._notify_save(job_id, "running")
+                ok = self._run_save_job(job)
+                latency = time.monotonic() - job['created']
+                if cancel.is_set():
+                    self._notify_save(job_id, "cancelled", latency=latency)
+                elif ok:
+                    print(f"[SAVE] Clip #{job_id} guardado en {latency:.2f}s")
+                    self._notify_save(job_id, "done", path=str(job['final_path']), latency=latency)
+                else:
+                    self._notify_save(job_id, "failed", latency=latency)
+            except Exception as e:
+                print(f"[SAVE] Error en clip #{job_id}: {e}")
+                self._notify_save(job_id, "cancelled" if cancel.is_set() else "failed", error=str(e))
+            finally:
+                with self._save_lock:
+                    self.save_jobs.pop(job_id, None)
+                    if job.get('video_pin'):
+                        buffer, pin = job['video_pin']
+                        buffer.unpin(pin)
+                    # Soltamos las referencias al búfer cuanto antes (antes de cerrar sus ficheros)
+                    job.clear()
+                    closers = [] if self.save_jobs else self._deferred_closes
+                    if closers: self._deferred_closes = []
+                for close in closers: close()
+                self.save_queue.task_done()
+
+    def cancel_save(self, job_id):
+        """
+        Cancela un guardado: si está en cola no llega a ejecutarse; si está muxeando se mata FFmpeg.
+        Devuelve False si el id no está en cola ni en marcha (ya terminó o no existe).
+        """
+        with self._save_lock:
+            job = self.save_jobs.get(job_id)
+            if job is None: return False
+            job['cancel'].set()
+            # Si el mux aún no se ha registrado, _mux_files verá el flag al registrarlo
+            ff_job = self.mux_jobs.get(f"save-{job_id}")
+        if ff_job: ff_job.cancel()
+        return True
+
+    def get_mux_jobs(self):
+        """Progreso de los FFmpeg de mux en marcha: {nombre: stats}."""
+        with self._save_lock:
+            jobs = {name: job.stats() for name, job in self.mux_jobs.items()}
+        for session in self._unfinished_sessions():
+            if session.job and session.job.progress["status"] == "running":
+                jobs[session.job.name] = session.job.stats()
+        return jobs
+
+    def _unfinished_sessions(self):
+        sessions = list(self.finishing_sessions)
+        if self.recording_session is not None and self.recording_session not in sessions:
+            sessions.append(self.recording_session)
+        return sessions
+
+    def wait_for_saves(self):
+        """Bloquea hasta que la cola de guardado esté vacía y acaben los concat de las grabaciones (útil al cerrar)."""
+        if self.save_queue is not None:
+            self.save_queue.join()
+        for session in self._unfinished_sessions():
+            session.join()
+
+    def _run_save_job(self, job):
+        final_path = job['final_path']
+        tag = job['tag']
+
+        if job['save_mode'] == "pipe":
+            # MODO PIPE: una sola pasada. El vídeo va de la RAM al stdin de FFmpeg y cada pista
+            # de audio por su propio pipe; solo se escribe a disco el fichero final.
+            audio_inputs = []
+            for i, audio in enumerate(job['audio']):
+                if AUDIO_PIPES_SUPPORTED:
+                    audio_inputs.append(audio)
+                else:
+                    # Windows no hereda descriptores extra: el audio va por WAV/AAC temporal
+                    temp = self._write_temp_audio(self.temp_dir / f"temp_replay_aud_{tag}_{i}", audio)
+                    if temp: audio_inputs.append(temp)
+            return self._mux_files(job['video_parts'], audio_inputs, final_path, job_name=f"save-{job['id']}",
+                                   on_progress=self._save_progress_cb(job['id']), cancel=job['cancel'])
+
+        # 2. Escribir Video RAM -> Disco (desde el keyframe, sin estimaciones)
+        # Bajo el lock solo se copiaron referencias; el disco se escribe aquí (writev, sin copias),
+        # así el hilo lector sigue vaciando el pipe de FFmpeg mientras guardamos.
+        ts_filename = self.temp_dir / f"temp_replay_vid_{tag}.ts"
         try:
-            with open(ts_filename, "wb") as f:
-                with self.video_ram_lock:
-                    for chunk in self.video_ram_buffer:
-                        f.write(chunk)
-        except: return
+            with open(ts_filename, "wb", buffering=0) as f:
+                write_parts(f, job['video_parts'])
+        except: return False
 
         # 3. Escribir Audio RAM (Snapshot) -> Disco
-        wav_files_workers = []
-        for i, worker in enumerate(self.audio_workers):
-            wav_path = self.temp_dir / f"temp_replay_aud_{timestamp}_{i}.wav"
-            worker.filename = str(wav_path)
-            # Guardamos lo que capturamos en el paso 1
-            if worker.save_snapshot_to_file(audio_snapshots[i]):
-                wav_files_workers.append(worker)
-        
-        final_path = Path(self.settings["save_path"]) / f"Replay_{timestamp}.{self.settings['container']}"
+        audio_inputs = []
+        for i, audio in enumerate(job['audio']):
+            temp = self._write_temp_audio(self.temp_dir / f"temp_replay_aud_{tag}_{i}", audio)
+            if temp: audio_inputs.append(temp)
         
-        # 4. UNIR Y RECORTAR EXACTAMENTE AL TIEMPO PEDIDO
-        # Pasamos replay_time para que FFmpeg corte lo que sobre
-        self._mux_files(ts_filename, wav_files_workers, final_path, trim_duration=self.settings["replay_time"])
-        
-        try: os.remove(ts_filename)
-        except: pass
+        # 4. UNIR (vídeo y audio ya vienen cortados a la misma ventana)
+        return self._mux_files(ts_filename, audio_inputs, final_path, job_name=f"save-{job['id']}",
+                               on_progress=self._save_progress_cb(job['id']), cancel=job['cancel'])
+
+    def _save_progress_cb(self, job_id):
+        return lambda ff_job: self._notify_save(job_id, "progress", **ff_job.stats())
+
+    def _write_temp_audio(self, base_path, audio):
+        """
+        Vuelca una pista del clip a disco: .aac si viene del encoder en vivo, .wav si es PCM.
+        Devuelve la entrada para _mux_files ({'name', 'path', ...}) o None si falló.
+        """
+        if 'silence' in audio:
+            # Pista muda: no hay nada que escribir, FFmpeg la genera
+            return audio
+        if 'adts' in audio:
+            path = str(base_path) + ".aac"
+            try:
+                with open(path, "wb", buffering=0) as f:
+                    write_parts(f, audio['adts'])
+            except Exception as e:
+                print(f"[SAVE] Error guardando aac: {e}")
+                return None
+            return {'name': audio['name'], 'path': path, 'encoded': True, 'offset': audio['offset']}
+        path = str(base_path) + ".wav"
+        if not self._write_temp_wav(path, audio): return None
+        return {'name': audio['name'], 'path': path, 'gated': audio.get('gated', False)}
+
+    def _write_temp_wav(self, wav_path, audio):
+        """Escribe un snapshot de audio a WAV float32 (mismo formato que AudioWorker)."""
+        try:
+            if 'stream' in audio:
+                stream = audio['stream']
+                with sf.SoundFile(str(wav_path), "w", audio['samplerate'], stream.channels, subtype='FLOAT') as f:
+                    for chunk in stream.chunks(): f.write(chunk)
+                self._report_lost(audio)
+                return True
+            sf.write(str(wav_path), audio['data'], audio['samplerate'], subtype='FLOAT')
+            return True
+        except Exception as e:
+            print(f"[SAVE] Error guardando wav: {e}")
+            return False
+
+    def get_audio_levels(self):
+        """
+        Niveles del último bloque de cada pista: {id del dispositivo: {'rms_db', 'peak_db', 'gated', 'age'}}.
+        Por ID estable y no por nombre: dos dispositivos pueden llamarse igual. La mezcla va con id None.
+        """
+        return {w.device_id: w.get_levels() for w in self._audio_outputs()}
+
+    def get_pipeline_stats(self):
+        """Contadores de los hilos de captura: bloques procesados y peor bloqueo (ms)."""
+        return {
+            "video_reader": dict(self.video_stats),
+            "audio": {w.device_name: dict(w.stats, drift_ppm=round(w.drift.ppm, 1), reopens=w.reopens,
+                                          ram_mb=w.ram_buffer.nbytes / MB if w.ram_buffer else 0.0)
+                      for w in self._audio_outputs()},
+            # Grabación: profundidad de cola y overruns del escritor de disco por pista
+            "audio_writer": {w.device_name: dict(t.stats, depth=len(t.blocks))
+                             for w, t in [(w, w.sink) for w in self._audio_outputs()] + self.buffer_tracks if t is not None},
+            "video_writer": dict(self.video_sink.stats) if self.video_sink else None,
+        }
+
+    def get_memory_stats(self):
+        """
+        Bytes que ocupa ahora cada búfer del replay frente al presupuesto (ram_budget_mb):
+        vídeo en RAM y en disco, anillo y AAC por pista, clips en cola y lo que espera en el pipe.
+        """
+        buf = self.video_ram_buffer
+        stats = {
+            "budget": self.memory_plan["budget"] if self.memory_plan else int(self.settings.get("ram_budget_mb", 0)) * MB,
+            "video": buf.ram_bytes_used if buf else 0,
+            "video_disk": buf.disk_bytes_used if buf else 0,
+            "audio": {w.device_name: w.ram_buffer.nbytes for w in self._audio_outputs() if w.ram_buffer is not None},
+            "aac": {w.device_name: w.encoder.ring.nbytes for w in self._audio_outputs() if w.encoder is not None},
+            "pipe_backlog": pipe_backlog(self.process.stdout) if self.is_replay_active and self.process else 0,
+            "save_queue": self.save_queue.qsize() if self.save_queue is not None else 0,
+            # Audio copiado por los guardados pendientes (los leídos del disco o ya en AAC no ocupan)
+            "saves": self._queued_snapshot_bytes(),
+        }
+        stats["total"] = (stats["video"] + sum(stats["audio"].values()) + sum(stats["aac"].values())
+                          + stats["saves"] + (stats["pipe_backlog"] or 0))
+        return stats
+
+    def _queued_snapshot_bytes(self):
+        with self._save_lock:
+            return _snapshot_bytes(self.save_jobs.values())
 
     def stop_replay_buffer(self):
+        """
+        Cierra la captura del buffer. Si hay una grabación colgada de ella no se corta: la captura
+        sigue viva hasta que esa grabación termine (stop_recording cierra entonces el buffer).
+        Devuelve False si el cierre queda aplazado.
+        """
+        if self.recording_from_buffer:
+            self.buffer_stop_pending = True
+            print("[BUFFER] Hay una grabación usando el buffer: se cerrará cuando termine")
+            return False
+        self.buffer_stop_pending = False
         self.is_replay_active = False
         self._stop_ffmpeg()
         if self.video_thread: self.video_thread.join()
         for worker in self.audio_workers:
             worker.stop()
             worker.join()
-        self.video_ram_buffer.clear()
+        closers = []
+        for worker in self._audio_outputs():
+            if worker.encoder is not None: worker.encoder.close()
+            if worker.ram_buffer is not None: closers.append(worker.ram_buffer.close)   # Solo actúa si desborda a disco
+        self.mix_track = None
+        if self.video_ram_buffer: self.video_ram_buffer.clear()
+        if self.video_spill:
+            closers.append(self.video_spill.close)
+            self.video_spill = None
+        self._close_after_saves(closers)
+        return True
+
+    def _close_after_saves(self, closers):
+        """
+        Cierra los anillos del buffer parado. Si quedan guardados en cola o en marcha (con vistas
+        a sus ficheros de desborde) se aplaza hasta que termine el último: en Windows un fichero
+        mapeado no se puede borrar, y cerrarlo antes lo dejaría huérfano en Temp_Processing.
+        """
+        with self._save_lock:
+            if self.save_jobs:
+                self._deferred_closes.extend(closers)
+                return
+        for close in closers: close()
 
     def _stop_ffmpeg(self):
         if self.process:
@@ -325,48 +1384,162 @@ class RecorderCore:
                 except: pass
             self.process = None
 
-    def _mux_files(self, video_path, audio_workers_list, final_path, trim_duration=None):
+    def _mux_files(self, video_source, audio_inputs, final_path, job_name=None, on_progress=None, cancel=None):
+        """
+        Une vídeo y pistas de audio en el contenedor final. Devuelve True si FFmpeg terminó bien.
+        video_source: ruta a un fichero, o lista de trozos TS (memoryviews) que se mandan por stdin.
+        audio_inputs: dicts {'name', 'path'} (WAV en disco) o {'name', 'data', 'samplerate'}
+                      (array float32 que se manda por un pipe propio, sin tocar el disco).
+                      {'name', 'stream': AudioRangeReader, 'samplerate'}: igual, pero leído a trozos
+                      del anillo en disco según FFmpeg lo consume.
+                      Con {'adts': partes} (pipe) o {'path', 'encoded': True} (fichero .aac) el audio
+                      ya viene en AAC y solo se copian paquetes; 'offset' lo retrasa para casar con el vídeo.
+                      'truncated': WAV de una grabación interrumpida (se lee hasta el final del fichero).
+                      {'name', 'silence': segundos, 'samplerate'}: pista muda (puerta cerrada), la genera FFmpeg.
+                      'gated': pista con puerta de silencio. En MKV sigue en pcm_f32le como las demás; con
+                      settings["gated_audio_flac"] va en FLAC (el silencio casi no ocupa, pero FLAC guarda
+                      enteros de 24 bits: el float32 se cuantiza y lo que pase de 0 dBFS se recorta).
+        Los temporales de entrada solo se borran si el mux salió bien.
+        cancel: threading.Event del guardado; si ya está activo no se lanza FFmpeg.
+        Todas las entradas llegan ya alineadas (_capture_replay): aquí no se recorta nada.
+        """
+        final_path = Path(final_path)
         print(f"[MUX] Generando: {final_path}")
         cmd = [self.ffmpeg_exec, "-y", "-hide_banner"]
         
-        # --- TRUCO MAGICO: -sseof ---
-        # Si trim_duration es 60, le decimos a FFmpeg:
-        # "Ve al final del archivo y retrocede 60 segundos. Empieza a copiar desde ahí".
-        # Esto elimina el exceso del principio y garantiza duración exacta.
-        seek_cmd = []
-        if trim_duration:
-            seek_cmd = ["-sseof", f"-{trim_duration}"]
-        
-        # Input Video (con recorte si aplica)
-        cmd.extend(seek_cmd) 
-        cmd.extend(["-i", str(video_path)])
+        # Input Video
+        video_is_pipe = not isinstance(video_source, (str, Path))
+        if video_is_pipe:
+            cmd.extend(["-f", "mpegts", "-i", "pipe:0"])
+        else:
+            cmd.extend(["-i", str(video_source)])
         
         valid_audios = []
-        for worker in audio_workers_list:
-            if os.path.exists(worker.filename):
-                # Input Audio (con el mismo recorte para que vayan a la par)
-                cmd.extend(seek_cmd) 
-                cmd.extend(["-i", worker.filename])
-                valid_audios.append(worker)
+        pipe_feeds = []   # (fd de escritura, trozos de memoria)
+        read_fds = []
+        for audio in audio_inputs:
+            if audio.get('offset'):
+                cmd.extend(["-itsoffset", f"{audio['offset']:.6f}"])
+            if audio.get('truncated'):
+                # WAV de una grabación interrumpida: la cabecera no tiene la longitud real
+                cmd.extend(["-ignore_length", "1"])
+            if 'silence' in audio:
+                cmd.extend(["-f", "lavfi", "-t", f"{audio['silence']:.6f}",
+                            "-i", f"anullsrc=r={audio['samplerate']}:cl=stereo"])
+                valid_audios.append(audio)
+            elif 'data' in audio:
+                r, w = os.pipe()
+                read_fds.append(r)
+                pipe_feeds.append((w, [memoryview(np.ascontiguousarray(audio['data'], dtype=np.float32)).cast('B')]))
+                cmd.extend(["-f", "f32le", "-ar", str(audio['samplerate']), "-ac", str(audio['data'].shape[1]), "-i", f"pipe:{r}"])
+                valid_audios.append(audio)
+            elif 'stream' in audio:
+                r, w = os.pipe()
+                read_fds.append(r)
+                pipe_feeds.append((w, audio['stream']))
+                cmd.extend(["-f", "f32le", "-ar", str(audio['samplerate']), "-ac", str(audio['stream'].channels), "-i", f"pipe:{r}"])
+                valid_audios.append(audio)
+            elif 'adts' in audio:
+                r, w = os.pipe()
+                read_fds.append(r)
+                pipe_feeds.append((w, audio['adts']))
+                cmd.extend(["-f", "aac", "-i", f"pipe:{r}"])
+                valid_audios.append(dict(audio, encoded=True))
+            elif os.path.exists(audio['path']):
+                cmd.extend(["-i", audio['path']])
+                valid_audios.append(audio)
         
         cmd.extend(["-map", "0:v"])
         is_mkv = str(final_path).lower().endswith(".mkv")
         
-        for i, worker in enumerate(valid_audios):
+        for i, audio in enumerate(valid_audios):
             cmd.extend(["-map", f"{i+1}:a"])
-            if is_mkv:
-                cmd.extend([f"-c:a:{i}", "pcm_f32le", f"-metadata:s:a:{i}", f"title={worker.device_name}"])
+            if audio.get('encoded'):
+                # AAC del encoder en vivo: copia de paquetes, sin recodificar
+                cmd.extend([f"-c:a:{i}", "copy", f"-metadata:s:a:{i}", f"title={audio['name']}"])
+            elif is_mkv and audio.get('gated') and self.settings.get("gated_audio_flac", False):
+                cmd.extend([f"-c:a:{i}", "flac", f"-metadata:s:a:{i}", f"title={audio['name']}"])
+            elif is_mkv:
+                cmd.extend([f"-c:a:{i}", "pcm_f32le", f"-metadata:s:a:{i}", f"title={audio['name']}"])
             else:
-                cmd.extend([f"-c:a:{i}", "aac", f"-b:a:{i}", "320k", f"-metadata:s:a:{i}", f"title={worker.device_name}"])
+                cmd.extend([f"-c:a:{i}", "aac", f"-b:a:{i}", "320k", f"-metadata:s:a:{i}", f"title={audio['name']}"])
         
         cmd.extend(["-c:v", "copy"])
         if not is_mkv: cmd.extend(["-bsf:a", "aac_adtstoasc"])
             
         cmd.append(str(final_path))
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
+        job = FFmpegJob(cmd, name=job_name or final_path.name,
+                        stdin=subprocess.PIPE if video_is_pipe else None, pass_fds=read_fds,
+                        stall_timeout=self.settings.get("mux_stall_timeout", 30), on_progress=on_progress)
+        with self._save_lock:
+            if cancel is not None and cancel.is_set():
+                for fd in read_fds + [w for w, _ in pipe_feeds]: os.close(fd)
+                return False
+            self.mux_jobs[job.name] = job
+        try:
+            proc = job.start()
+            # cancel_save() pudo llegar entre el registro y el arranque
+            if job.cancelled: job.cancel()
+        except Exception as e:
+            print(f"[MUX] No se pudo lanzar FFmpeg: {e}")
+            for _, w in pipe_feeds: os.close(w)
+            with self._save_lock: self.mux_jobs.pop(job.name, None)
+            return False
+        finally:
+            # El hijo ya tiene sus copias de los extremos de lectura
+            for r in read_fds: os.close(r)
+
+        # Un hilo por entrada: FFmpeg lee todas a la vez y un pipe lleno no debe bloquear a los demás
+        feeders = []
+        if video_is_pipe:
+            feeders.append(threading.Thread(target=self._feed_pipe, args=(proc.stdin, video_source)))
+        for w, parts in pipe_feeds:
+            target = self._feed_stream if isinstance(parts, AudioRangeReader) else self._feed_pipe
+            feeders.append(threading.Thread(target=target, args=(os.fdopen(w, "wb"), parts)))
+        for t in feeders: t.start()
+        job.wait()
+        for t in feeders: t.join()
+        with self._save_lock:
+            self.mux_jobs.pop(job.name, None)
+        for audio in valid_audios: self._report_lost(audio)
+
+        stats = job.stats()
+        if not job.ok or not os.path.exists(final_path):
+            # Los temporales se conservan: sin ellos no habría forma de rehacer el clip
+            reason = "cancelado" if job.cancelled else job.error_summary()
+            print(f"[MUX] Falló {final_path.name}: {reason}")
+            return False
+
+        print(f"[MUX] {final_path.name}: {stats['elapsed']:.2f}s, x{stats['speed']:.1f}, "
+              f"{stats['fps']:.0f} fps, {stats['total_size'] / 1048576:.1f} MB")
+        try:
+            if not video_is_pipe and os.path.exists(video_source): os.remove(video_source)
+            for audio in valid_audios:
+                if 'path' in audio and os.path.exists(audio['path']): os.remove(audio['path'])
+        except: pass
+        return True
+
+    def _feed_stream(self, pipe, stream):
+        """Como _feed_pipe, para un AudioRangeReader: un trozo decodificado cada vez."""
+        try:
+            for chunk in stream.chunks():
+                pipe.write(memoryview(chunk).cast('B'))
+        except (BrokenPipeError, OSError): pass
+        finally:
+            try: pipe.close()
+            except: pass
+
+    def _report_lost(self, audio):
+        stream = audio.get('stream')
+        if stream is not None and stream.lost_frames:
+            print(f"[SAVE] {audio['name']}: {stream.lost_frames / stream.samplerate:.1f}s ya sobrescritos "
+                  f"en el anillo al guardar, van como silencio")
+
+    def _feed_pipe(self, pipe, parts):
+        """Vuelca trozos de memoria a un pipe de FFmpeg y lo cierra (EOF = fin de esa entrada)."""
         try:
-            if os.path.exists(video_path): os.remove(video_path)
-            for worker in valid_audios:
-                if os.path.exists(worker.filename): os.remove(worker.filename)
-        except: pass
\ No newline at end of file
+            write_parts(pipe, parts)
+        except (BrokenPipeError, OSError): pass
+        finally:
+            try: pipe.close()
+            except: pass
@@ -0,0 +1,205 @@
+import csv
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from ffmpeg_jobs import FFmpegJob
+
+# Cada cuánto se mira la lista de segmentos de FFmpeg mientras se graba
+POLL_INTERVAL = 1.0
+
+
+def _read_segment_list(path):
+    """Lista CSV del muxer segment de FFmpeg: una línea 'fichero,inicio,fin' por segmento cerrado."""
+    entries = []
+    try:
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) >= 3:
+                    try: entries.append((row[0], float(row[1]), float(row[2])))
+                    except ValueError: pass
+    except OSError:
+        pass
+    return entries
+
+
+class SegmentedRecording:
+    """
+    Grabación por segmentos. FFmpeg escribe el vídeo con el muxer segment (un .mkv cada
+    `segment_seconds`, cortado en un keyframe forzado) y cada pista de audio se parte en WAVs
+    de la misma duración exacta (audio_writer.py). Un hilo de fondo une cada segmento en cuanto
+    FFmpeg lo apunta en su lista y todas las pistas lo han cerrado, así que al parar solo queda
+    el último trozo y un concat sin recodificar.
+    El estado va en un manifiesto JSON en Temp_Processing: si el programa se cae, al volver a
+    abrirlo recover_recordings() termina lo que quedó a medias.
+    """
+    def __init__(self, mux, ffmpeg_exec, temp_dir, tag, final_path, segment_seconds, track_names,
+                 sinks=None, stall_timeout=30):
+        self.mux = mux                  # RecorderCore._mux_files
+        self.ffmpeg_exec = ffmpeg_exec
+        self.temp_dir = Path(temp_dir)
+        self.tag = tag
+        self.final_path = Path(final_path)
+        self.segment_seconds = segment_seconds
+        self.stall_timeout = stall_timeout
+        self.video_pattern = str(self.temp_dir / f"temp_vid_{tag}_%05d.mkv")
+        self.segment_list = str(self.temp_dir / f"temp_vid_{tag}.csv")
+        self.audio = [{'name': name, 'pattern': str(self.temp_dir / f"temp_audio_{tag}_{i}_%05d.wav")}
+                      for i, name in enumerate(track_names)]
+        self.manifest_path = self.temp_dir / f"recording_{tag}.json"
+        self.muxed = []          # Segmentos ya unidos, en orden
+        self.next_index = 0
+        # Devuelve los AudioTrackQueue de la grabación (None mientras el hilo de captura abre)
+        self.sinks = sinks or (lambda: [])
+        self.stopping = threading.Event()
+        self.thread = None
+        self.job = None          # FFmpegJob del concat final (para el progreso en la UI)
+        self.ok = None
+
+    @property
+    def ext(self):
+        return self.final_path.suffix
+
+    # --- Manifiesto (recuperación tras un cierre inesperado) ---
+    def save_manifest(self):
+        data = {
+            "final_path": str(self.final_path), "segment_seconds": self.segment_seconds,
+            "video_pattern": self.video_pattern, "segment_list": self.segment_list,
+            "audio": self.audio, "muxed": self.muxed, "next_index": self.next_index,
+        }
+        try:
+            tmp = str(self.manifest_path) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp, self.manifest_path)
+        except Exception as e:
+            print(f"[REC] Error guardando manifiesto: {e}")
+
+    @classmethod
+    def from_manifest(cls, path, mux, ffmpeg_exec):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        tag = Path(path).stem[len("recording_"):]
+        session = cls(mux, ffmpeg_exec, Path(path).parent, tag, data["final_path"], data["segment_seconds"], [])
+        session.video_pattern = data["video_pattern"]
+        session.segment_list = data["segment_list"]
+        session.audio = data["audio"]
+        session.muxed = data.get("muxed", [])
+        session.next_index = data.get("next_index", len(session.muxed))
+        return session
+
+    # --- Grabación en curso ---
+    def start(self):
+        self.save_manifest()
+        self.thread = threading.Thread(target=self._run, name="segment-muxer", daemon=True)
+        self.thread.start()
+
+    def finish(self):
+        """FFmpeg y el audio ya están cerrados: el hilo une lo que falta y hace el concat. No bloquea."""
+        self.stopping.set()
+
+    def join(self, timeout=None):
+        if self.thread: self.thread.join(timeout)
+
+    def _audio_ready(self, index):
+        """Todas las pistas han cerrado el WAV del segmento `index` (o ya no graban)."""
+        for sink in self.sinks():
+            if sink is not None and not sink.closed.is_set() and sink.segments_done <= index:
+                return False
+        return True
+
+    def _run(self):
+        try:
+            while True:
+                final = self.stopping.is_set()
+                entries = _read_segment_list(self.segment_list)
+                while self.next_index < len(entries) and (final or self._audio_ready(self.next_index)):
+                    start = entries[self.next_index][1]
+                    self._mux_segment(self.next_index, start)
+                if final:
+                    # Si FFmpeg no llegó a cerrar la lista (lo mataron), el último .mkv sigue ahí
+                    while os.path.exists(self.video_pattern % self.next_index):
+                        self._mux_segment(self.next_index)
+                    break
+                self.stopping.wait(POLL_INTERVAL)
+            self.ok = self._concat()
+        except Exception as e:
+            print(f"[REC] Error en el muxer de segmentos: {e}")
+            self.ok = False
+
+    def _mux_segment(self, index, start=None, recovered=False):
+        video = self.video_pattern % index
+        out = self.temp_dir / f"temp_rec_{self.tag}_{index:05d}{self.ext}"
+        audio_inputs = []
+        for track in self.audio:
+            path = track['pattern'] % index
+            if not os.path.exists(path): continue
+            entry = {'name': track['name'], 'path': path}
+            # El WAV empieza exactamente en index*segment_seconds; el vídeo en su keyframe
+            if start is not None and index * self.segment_seconds - start > 0.0005:
+                entry['offset'] = index * self.segment_seconds - start
+            # Tras un cierre inesperado la cabecera del último WAV no tiene la longitud real
+            if recovered: entry['truncated'] = True
+            audio_inputs.append(entry)
+        if self.mux(video, audio_inputs, out, job_name=f"segment-{self.tag}-{index}"):
+            self.muxed.append(str(out))
+        else:
+            # Se conservan los temporales del segmento; el resto de la grabación sigue adelante
+            print(f"[REC] Segmento {index} no se pudo unir, se omite del fichero final")
+        self.next_index = index + 1
+        self.save_manifest()
+
+    def _concat(self):
+        if not self.muxed:
+            print("[REC] No hay segmentos que unir")
+            return False
+        if len(self.muxed) == 1:
+            shutil.move(self.muxed[0], self.final_path)
+        else:
+            list_path = self.temp_dir / f"temp_rec_{self.tag}.txt"
+            with open(list_path, "w", encoding="utf-8") as f:
+                for path in self.muxed:
+                    escaped = Path(path).resolve().as_posix().replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            # Solo copia de paquetes: el coste es leer y escribir el fichero una vez
+            cmd = [self.ffmpeg_exec, "-y", "-hide_banner", "-f", "concat", "-safe", "0", "-i", str(list_path),
+                   "-map", "0", "-c", "copy", str(self.final_path)]
+            job = self.job = FFmpegJob(cmd, name=f"recording-{self.tag}", stall_timeout=self.stall_timeout)
+            job.start()
+            job.wait()
+            if not job.ok or not self.final_path.exists():
+                print(f"[REC] Falló la unión de {self.final_path.name}: {job.error_summary()} (segmentos en {self.temp_dir})")
+                return False
+            print(f"[REC] {self.final_path.name}: {len(self.muxed)} segmentos unidos en {job.elapsed:.2f}s")
+            for path in self.muxed + [str(list_path)]:
+                try: os.remove(path)
+                except OSError: pass
+        # Restos de audio sin vídeo (la captura de audio para un instante después que FFmpeg)
+        orphans = [track['pattern'] % self.next_index for track in self.audio]
+        for path in orphans + [self.segment_list, self.manifest_path]:
+            try: os.remove(path)
+            except OSError: pass
+        return True
+
+    # --- Recuperación ---
+    def recover(self):
+        """Une los segmentos que quedaron sin procesar (incluido el último, a medio escribir) y concatena."""
+        entries = _read_segment_list(self.segment_list)
+        while os.path.exists(self.video_pattern % self.next_index):
+            index = self.next_index
+            start = entries[index][1] if index < len(entries) else None
+            self._mux_segment(index, start, recovered=True)
+        return self._concat()
+
+
+def recover_recordings(temp_dir, mux, ffmpeg_exec):
+    """Termina las grabaciones por segmentos que se quedaron a medias (cierre inesperado)."""
+    for path in sorted(Path(temp_dir).glob("recording_*.json")):
+        try:
+            session = SegmentedRecording.from_manifest(path, mux, ffmpeg_exec)
+            print(f"[REC] Recuperando grabación interrumpida: {Path(session.final_path).name}")
+            session.recover()
+        except Exception as e:
+            print(f"[REC] No se pudo recuperar {path.name}: {e}")
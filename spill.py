@@ -0,0 +1,62 @@
+import mmap
+import os
+
+
+class SpillFile:
+    """
+    Fichero en disco PREASIGNADO y mapeado en memoria, usado como anillo por los búferes de
+    replay largos. Se escribe por offset absoluto (módulo la capacidad) y se lee con memoryviews
+    directas al mapeo, sin copias. Lo ya escrito se suelta de la memoria del proceso con
+    madvise(DONTNEED): los datos siguen en el fichero (y en la caché del sistema si cabe),
+    pero no cuentan en nuestro RSS.
+    """
+    def __init__(self, path, capacity):
+        self.path = str(path)
+        self.capacity = max(mmap.PAGESIZE, int(capacity))
+        self._file = open(self.path, "w+b")
+        self._file.truncate(self.capacity)
+        self.mm = mmap.mmap(self._file.fileno(), self.capacity)
+        self.view = memoryview(self.mm)
+
+    def _spans(self, offset, length):
+        """Trozos (inicio_en_fichero, longitud) de [offset, offset+length) con la vuelta del anillo."""
+        start = offset % self.capacity
+        first = min(length, self.capacity - start)
+        spans = [(start, first)]
+        if first < length:
+            spans.append((0, length - first))
+        return spans
+
+    def write(self, offset, data):
+        pos = 0
+        for start, n in self._spans(offset, len(data)):
+            self.view[start:start + n] = data[pos:pos + n]
+            pos += n
+
+    def views(self, offset, length):
+        return [self.view[start:start + n] for start, n in self._spans(offset, length)]
+
+    def release(self, offset, length):
+        """Saca de RAM las páginas de [offset, offset+length) (solo páginas completas)."""
+        advice = getattr(mmap, "MADV_DONTNEED", None)
+        if advice is None or not hasattr(self.mm, "madvise"): return
+        page = mmap.PAGESIZE
+        for start, n in self._spans(offset, length):
+            first = -(-start // page) * page
+            end = (start + n) // page * page
+            if end > first:
+                try: self.mm.madvise(advice, first, end - first)
+                except (OSError, ValueError): pass
+
+    def close(self):
+        # Un guardado en curso puede tener aún vistas al mapeo: en ese caso lo cierra el GC
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            pass
+        try:
+            self._file.close()
+            os.remove(self.path)
+        except OSError:
+            pass
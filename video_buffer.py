@@ -0,0 +1,423 @@
+import collections
+import itertools
+import os
+import threading
+import time
+import numpy as np
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PTS_CLOCK = 90000          # Los PTS de MPEG-TS van a 90 kHz
+PTS_WRAP = 1 << 33         # y son de 33 bits (dan la vuelta cada ~26 h)
+IOV_MAX = 1024             # Límite de buffers por llamada a writev en Linux/macOS
+
+
+def _parse_pts(b):
+    """Decodifica los 5 bytes del campo PTS de una cabecera PES."""
+    return (((b[0] >> 1) & 0x07) << 30) | (b[1] << 22) | ((b[2] >> 1) << 15) | (b[3] << 7) | (b[4] >> 1)
+
+
+def write_parts(f, parts):
+    """
+    Escribe una lista de memoryviews en un fichero abierto sin copiarlos.
+    Usa os.writev (una llamada por cada IOV_MAX trozos) donde existe; en Windows, f.write por trozo.
+    """
+    if not hasattr(os, "writev"):
+        for part in parts:
+            f.write(part)
+        return
+    f.flush()
+    fd = f.fileno()
+    pending = [p for p in parts if len(p)]
+    while pending:
+        batch = pending[:IOV_MAX]
+        written = os.writev(fd, batch)
+        # writev puede escribir menos de lo pedido: avanzamos por los trozos ya completos
+        done = 0
+        while done < len(batch) and written >= len(batch[done]):
+            written -= len(batch[done])
+            done += 1
+        pending = pending[done:]
+        if written:
+            pending[0] = pending[0][written:]
+
+
+class TSFileSink(threading.Thread):
+    """
+    Consumidor del búfer TS que lo escribe a un fichero (grabación desde el buffer).
+    push() lo llama el lector de FFmpeg con el lock del búfer cogido: solo encola la referencia.
+    Este hilo vacía la cola con writev, igual que un guardado de replay.
+    """
+    def __init__(self, path, flush_interval=0.5):
+        super().__init__(name="ts-writer", daemon=True)
+        self.path = str(path)
+        self.flush_interval = flush_interval
+        self.parts = collections.deque()
+        self.wake = threading.Event()
+        self.running = True
+        self.error = None
+        self.stats = {"pushed_bytes": 0, "written_bytes": 0, "max_pending": 0}
+
+    def push(self, part):
+        self.parts.append(part)
+        self.stats["pushed_bytes"] += len(part)
+        pending = self.stats["pushed_bytes"] - self.stats["written_bytes"]
+        if pending > self.stats["max_pending"]: self.stats["max_pending"] = pending
+
+    def run(self):
+        try:
+            with open(self.path, "wb", buffering=0) as f:
+                while True:
+                    self.wake.wait(self.flush_interval)
+                    self.wake.clear()
+                    batch = []
+                    while self.parts:
+                        batch.append(self.parts.popleft())
+                    if batch:
+                        write_parts(f, batch)
+                        self.stats["written_bytes"] += sum(len(p) for p in batch)
+                    elif not self.running:
+                        break
+        except Exception as e:
+            self.error = e
+            print(f"[BUFFER] Error escribiendo {self.path}: {e}")
+
+    def close(self):
+        """Escribe lo pendiente y cierra el fichero (llamar después de detach)."""
+        self.running = False
+        self.wake.set()
+        self.join()
+
+
+class TSVideoRingBuffer:
+    """
+    Búfer de vídeo en RAM que entiende MPEG-TS.
+    Va leyendo los paquetes de 188 bytes según llegan de FFmpeg y guarda un índice de
+    keyframes (random_access_indicator) con su PTS. El descarte se hace por GOPs completos
+    y por TIEMPO, así el clip guardado siempre empieza en un keyframe y dura lo pedido.
+
+    Con `spill` (spill.SpillFile) el búfer tiene dos niveles: los últimos `ram_bytes` se quedan
+    en RAM y lo anterior se copia al fichero mapeado y se suelta de la memoria. Los snapshots
+    siguen siendo memoryviews (al mapeo o a los bytes), así que guardar no copia en ningún nivel.
+    Sin `spill`, `ram_bytes` es un techo duro: si el bitrate real no cabe, se descartan GOPs
+    antiguos aunque el clip quede más corto que `duration` (presupuesto de RAM, memory_budget.py).
+    Los guardados que leen del disco fijan su clip (pin_clip/unpin): mientras tanto esa parte del
+    anillo no se recicla y lo nuevo espera en RAM aunque pase de `ram_bytes`.
+
+    Reloj de captura: cada trozo llega sellado con time.monotonic() (el mismo reloj que el audio).
+    Por GOP guardamos el menor (llegada - PTS) visto; como la llegada siempre va por detrás de la
+    captura, ese mínimo es el desfase PTS -> reloj con menos retraso de pipe/encoder encima.
+    """
+    def __init__(self, duration, spill=None, ram_bytes=None):
+        self.duration = duration
+        self.lock = threading.Lock()
+
+        # Trozos de TS alineados a 188 bytes: (offset_absoluto, bytes). Los más nuevos, en RAM.
+        self.segments = collections.deque()
+        # Nivel de disco (más antiguo): (offset_absoluto, memoryview al SpillFile)
+        self.spill = spill
+        self.ram_bytes = ram_bytes
+        self.disk_segments = collections.deque()
+        self._ram_used = 0
+        # Consumidores en vivo (TSFileSink...): reciben cada trozo alineado según entra
+        self.sinks = []
+        # Clips fijados por guardados en curso: id -> offset absoluto de su primer byte
+        self._pins = {}
+        self._pin_ids = itertools.count(1)
+        self._pin_warned = False
+        # Índice de puntos de acceso aleatorio: (pts_segundos, offset_absoluto, desfase_reloj)
+        self.keyframes = collections.deque()
+        self.head = 0     # Offset absoluto del primer byte que conservamos
+        self.tail = 0     # Offset absoluto del siguiente byte a escribir
+
+        self._carry = b""
+        self.pmt_pid = None
+        self.video_pid = None
+        self.pat_packet = None
+        self.pmt_packet = None
+
+        self.first_pts = None
+        self.last_pts = None
+        self._last_raw_pts = None
+        self._pts_offset = 0
+
+    # ------------------------------------------------------------------
+    #  ENTRADA (hilo lector de FFmpeg)
+    # ------------------------------------------------------------------
+    def feed(self, data, arrival=None):
+        """
+        Añade bytes tal cual salen del pipe (no tienen por qué venir alineados).
+        `arrival`: time.monotonic() al leerlos (por defecto, ahora).
+        """
+        if arrival is None: arrival = time.monotonic()
+        if self._carry:
+            data = self._carry + data
+            self._carry = b""
+        start = self._resync(data)
+        usable = (len(data) - start) // TS_PACKET_SIZE * TS_PACKET_SIZE
+        self._carry = data[start + usable:]
+        if usable <= 0: return
+        chunk = data[start:start + usable] if (start or usable != len(data)) else data
+
+        # Localizamos con numpy solo los paquetes que abren unidad (PUSI); el resto ni se mira
+        packets = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+        pusi = np.flatnonzero(packets[:, 1] & 0x40)
+
+        new_keyframes = []
+        lag = None   # Menor desfase de los frames que aún pertenecen al último GOP ya indexado
+        for i in pusi:
+            pkt = chunk[i * TS_PACKET_SIZE:(i + 1) * TS_PACKET_SIZE]
+            pid = ((pkt[1] & 0x1F) << 8) | pkt[2]
+            if pid == 0:
+                self._parse_pat(pkt)
+            elif pid == self.pmt_pid:
+                self.pmt_packet = pkt
+            else:
+                pes = self._parse_video_pes(pkt, pid)
+                if pes is None: continue
+                pts, is_keyframe = pes
+                if is_keyframe:
+                    new_keyframes.append([pts, self.tail + int(i) * TS_PACKET_SIZE, arrival - pts])
+                elif new_keyframes:
+                    new_keyframes[-1][2] = min(new_keyframes[-1][2], arrival - pts)
+                elif lag is None or arrival - pts < lag:
+                    lag = arrival - pts
+
+        with self.lock:
+            if lag is not None and self.keyframes and lag < self.keyframes[-1][2]:
+                kf = self.keyframes[-1]
+                self.keyframes[-1] = (kf[0], kf[1], lag)
+            if new_keyframes or self.keyframes:
+                self.segments.append((self.tail, chunk))
+                self._ram_used += usable
+                self.keyframes.extend(tuple(kf) for kf in new_keyframes)
+            for sink in self.sinks:
+                sink.push(chunk)
+            self.tail += usable
+            if not self.keyframes:
+                # Sin keyframe no hay por dónde empezar un clip: no guardamos nada todavía
+                self.head = self.tail
+            self._evict()
+        if self.spill is not None and self._ram_used > self.ram_bytes:
+            self._spill_oldest()
+
+    def _spill_oldest(self):
+        """Pasa al fichero los trozos de RAM más antiguos hasta volver a `ram_bytes`. Hilo lector."""
+        while True:
+            with self.lock:
+                if self._ram_used <= self.ram_bytes or not self.segments: return
+                offset, seg = self.segments[0]
+                if self._pins and min(self._pins.values()) < offset + len(seg) - self.spill.capacity:
+                    # Pisaría un clip que un guardado aún está leyendo: se queda en RAM hasta unpin()
+                    if not self._pin_warned:
+                        print("[BUFFER] Un guardado aún lee el disco: el vídeo nuevo espera en RAM")
+                        self._pin_warned = True
+                    return
+                self._pin_warned = False
+                # Lo que vamos a pisar en el anillo de disco tiene que estar ya fuera de la ventana
+                self._evict(min_offset=offset + len(seg) - self.spill.capacity)
+            # La copia al mapeo va fuera del lock: ese trozo sigue siendo válido en RAM mientras tanto
+            self.spill.write(offset, seg)
+            views = self.spill.views(offset, len(seg))
+            with self.lock:
+                if not self.segments or self.segments[0][0] != offset: continue   # Lo descartó clear()
+                self.segments.popleft()
+                self._ram_used -= len(seg)
+                pos = offset
+                for view in views:
+                    last = self.disk_segments[-1] if self.disk_segments else None
+                    # Trozos seguidos en el fichero (sin cruzar la vuelta) se juntan en una sola vista:
+                    # menos partes en writev al guardar
+                    if last and last[0] + len(last[1]) == pos and pos % self.spill.capacity:
+                        self.disk_segments[-1] = (last[0], self.spill.views(last[0], len(last[1]) + len(view))[0])
+                    else:
+                        self.disk_segments.append((pos, view))
+                    pos += len(view)
+            # Fuera de RAM: los datos quedan en el fichero, no en el RSS del proceso
+            self.spill.release(offset, len(seg))
+
+    def _resync(self, data):
+        """Devuelve la posición del primer byte de sincronía válido (0x47 cada 188 bytes)."""
+        if data[:1] == b"\x47": return 0
+        for i in range(min(len(data), TS_PACKET_SIZE)):
+            if data[i] == TS_SYNC_BYTE and (i + TS_PACKET_SIZE >= len(data) or data[i + TS_PACKET_SIZE] == TS_SYNC_BYTE):
+                return i
+        return len(data)
+
+    def _payload_offset(self, pkt):
+        afc = (pkt[3] >> 4) & 0x03
+        if afc == 2: return None                # Solo campo de adaptación, sin payload
+        if afc == 3: return 5 + pkt[4]
+        return 4
+
+    def _parse_pat(self, pkt):
+        off = self._payload_offset(pkt)
+        if off is None: return
+        off += 1 + pkt[off]                     # pointer_field
+        section_len = ((pkt[off + 1] & 0x0F) << 8) | pkt[off + 2]
+        pos, end = off + 8, min(off + 3 + section_len - 4, TS_PACKET_SIZE)
+        while pos + 4 <= end:
+            program = (pkt[pos] << 8) | pkt[pos + 1]
+            if program != 0:
+                self.pmt_pid = ((pkt[pos + 2] & 0x1F) << 8) | pkt[pos + 3]
+                self.pat_packet = pkt
+                return
+            pos += 4
+
+    def _parse_video_pes(self, pkt, pid):
+        """Lee la cabecera PES de vídeo. Devuelve (PTS en segundos, es_keyframe) o None."""
+        if self.video_pid is not None and pid != self.video_pid: return None
+        off = self._payload_offset(pkt)
+        if off is None or off + 14 > TS_PACKET_SIZE: return None
+        if pkt[off:off + 3] != b"\x00\x00\x01": return None
+        stream_id = pkt[off + 3]
+        if not 0xE0 <= stream_id <= 0xEF: return None
+        self.video_pid = pid
+
+        if not (pkt[off + 7] & 0x80): return None   # PES sin PTS
+        pts = self._unwrap_pts(_parse_pts(pkt[off + 9:off + 14]))
+        if self.first_pts is None: self.first_pts = pts
+        if self.last_pts is None or pts > self.last_pts: self.last_pts = pts
+
+        # random_access_indicator del campo de adaptación = keyframe (FFmpeg lo marca siempre)
+        has_af = (pkt[3] & 0x20) and pkt[4] > 0
+        return pts, bool(has_af and (pkt[5] & 0x40))
+
+    def _unwrap_pts(self, raw):
+        if self._last_raw_pts is not None and raw < self._last_raw_pts - PTS_WRAP // 2:
+            self._pts_offset += PTS_WRAP
+        self._last_raw_pts = raw
+        return (raw + self._pts_offset) / PTS_CLOCK
+
+    def _over_budget(self):
+        """Sin nivel de disco, ¿se pasa de `ram_bytes` si conservamos el GOP más antiguo?"""
+        return self.spill is None and self.ram_bytes is not None and self.tail - self.keyframes[0][1] > self.ram_bytes
+
+    @property
+    def ram_bytes_used(self):
+        return self._ram_used
+
+    @property
+    def disk_bytes_used(self):
+        return max(0, self.tail - self.head - self._ram_used) if self.spill is not None else 0
+
+    def _evict(self, min_offset=None):
+        """
+        Descarta GOPs enteros mientras el siguiente keyframe siga cubriendo la ventana.
+        `min_offset`: además, nada por debajo de ese offset (el anillo de disco va a pisarlo).
+        """
+        while len(self.keyframes) >= 2 and (self.last_pts - self.keyframes[1][0] >= self.duration or
+                                            (min_offset is not None and self.keyframes[0][1] < min_offset) or
+                                            self._over_budget()):
+            self.keyframes.popleft()
+        if min_offset is not None and self.keyframes and self.keyframes[0][1] < min_offset:
+            # Ni el último GOP cabe en el fichero (demasiado pequeño para el bitrate): empezamos de cero
+            print("[BUFFER] Fichero de desborde demasiado pequeño para un GOP, se descarta el búfer")
+            self.keyframes.clear()
+            self.head = self.tail
+        if self.keyframes:
+            self.head = self.keyframes[0][1]
+        while self.disk_segments and self.disk_segments[0][0] + len(self.disk_segments[0][1]) <= self.head:
+            self.disk_segments.popleft()
+        while self.segments and self.segments[0][0] + len(self.segments[0][1]) <= self.head:
+            self._ram_used -= len(self.segments.popleft()[1])
+
+    # ------------------------------------------------------------------
+    #  SALIDA (guardado)
+    # ------------------------------------------------------------------
+    def clear(self):
+        with self.lock:
+            self.segments.clear()
+            self.disk_segments.clear()
+            self._ram_used = 0
+            self.keyframes.clear()
+            self.head = self.tail
+            self._carry = b""
+
+    def _find_clip_start(self, duration):
+        """Último keyframe que deja al menos `duration` segundos hasta el final (o el más antiguo)."""
+        target = self.last_pts - duration
+        start = self.keyframes[0]
+        for kf in self.keyframes:
+            if kf[0] > target: break
+            start = kf
+        return start
+
+    def clip_duration(self, duration):
+        """Duración real (s) que tendrá el clip de `duration` segundos, empezando en keyframe."""
+        with self.lock:
+            if not self.keyframes: return 0.0
+            return self.last_pts - self._find_clip_start(duration)[0]
+
+    def _clock_lag(self, since_pts):
+        """Desfase PTS -> time.monotonic() estimado con los GOPs desde `since_pts` (el mínimo)."""
+        return min(kf[2] for kf in self.keyframes if kf[0] >= since_pts)
+
+    def snapshot_clip(self, duration):
+        """
+        Toma referencias (memoryviews) a los trozos del clip: los últimos `duration` segundos
+        empezando en un keyframe, precedidos de PAT/PMT para que sea reproducible desde el byte 0.
+        Bajo el lock solo se arma la lista; los bytes de RAM son inmutables, así que siguen siendo
+        válidos aunque el lector los descarte mientras se escriben. Las vistas al disco no: el anillo
+        las pisa al dar la vuelta, y quien las lea después de un rato tiene que usar pin_clip.
+        Devuelve (partes, duración real en segundos, instante de captura del keyframe inicial
+        en el reloj time.monotonic()), o ([], 0.0, None) si aún no hay nada.
+        """
+        with self.lock:
+            return self._snapshot_unlocked(duration)
+
+    def pin_clip(self, duration):
+        """
+        Como snapshot_clip, pero el clip queda fijado: el anillo de disco no lo pisa hasta
+        unpin(id). Devuelve (partes, duración, instante de inicio, id del pin o None).
+        """
+        with self.lock:
+            parts, clip_seconds, clip_start = self._snapshot_unlocked(duration)
+            pin = None
+            if parts and self.spill is not None:
+                pin = next(self._pin_ids)
+                self._pins[pin] = self._find_clip_start(duration)[1]
+            return parts, clip_seconds, clip_start, pin
+
+    def unpin(self, pin):
+        with self.lock:
+            self._pins.pop(pin, None)
+
+    def _snapshot_unlocked(self, duration):
+        if not self.keyframes: return [], 0.0, None
+        kf_pts, kf_offset, _ = self._find_clip_start(duration)
+        parts = [memoryview(p) for p in (self.pat_packet, self.pmt_packet) if p]
+        # Primero lo que está en disco (más antiguo) y luego lo de RAM
+        for seg_offset, seg in itertools.chain(self.disk_segments, self.segments):
+            if seg_offset + len(seg) <= kf_offset: continue
+            skip = max(0, kf_offset - seg_offset)
+            parts.append(memoryview(seg)[skip:])
+        return parts, self.last_pts - kf_pts, kf_pts + self._clock_lag(kf_pts)
+
+    def attach(self, sink, history=None):
+        """
+        Engancha un consumidor en vivo. Con `history` (segundos) recibe primero el clip de esa
+        duración que ya hay en el búfer y luego cada trozo nuevo: todo bajo el mismo lock que
+        feed(), así que no hay hueco ni duplicados entre lo guardado y lo que sigue llegando.
+        Devuelve (duración de la historia, instante monotonic de su keyframe inicial o None).
+        """
+        with self.lock:
+            clip_seconds, clip_start = 0.0, None
+            if history is not None:
+                # history=0: desde el último keyframe (el fichero tiene que empezar en uno)
+                parts, clip_seconds, clip_start = self._snapshot_unlocked(history)
+                for part in parts:
+                    sink.push(part)
+            self.sinks.append(sink)
+            return clip_seconds, clip_start
+
+    def detach(self, sink):
+        with self.lock:
+            if sink in self.sinks: self.sinks.remove(sink)
+
+    def write_clip(self, f, duration):
+        """Escribe el clip en `f` FUERA del lock. Devuelve la duración real (0 si aún no hay nada)."""
+        parts, clip_seconds, _ = self.snapshot_clip(duration)
+        if parts:
+            write_parts(f, parts)
+        return clip_seconds